@@ -17,6 +17,44 @@ import os
 sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
 
 from flora_pac_lib import generate_pac
+from flora_pac_lib.pac_generator import ENGINES
+from flora_pac_lib.cache import DEFAULT_CACHE_DIR, DEFAULT_CACHE_TTL
+from flora_pac_lib.ip_data import RIR_URLS
+from flora_pac_lib.sources import is_snapshot_source
+from flora_pac_lib.stage_cache import StageCache
+
+
+def _parse_prefix_lengths(value):
+    """Parse the --prefix-lengths argument."""
+    if value == 'auto':
+        return value
+    try:
+        lengths = sorted({int(length) for length in value.split(',')})
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"invalid prefix length list: {value!r}")
+    if not all(1 <= length <= 32 for length in lengths):
+        raise argparse.ArgumentTypeError(f"prefix lengths must be within 1..32: {value!r}")
+    return lengths
+
+
+def _parse_registries(value):
+    """Parse the --registries argument."""
+    if value == 'all':
+        return list(RIR_URLS)
+    names = [name.strip().lower() for name in value.split(',') if name.strip()]
+    unknown = [name for name in names if name not in RIR_URLS]
+    if not names or unknown:
+        raise argparse.ArgumentTypeError(
+            f"unknown registry in {value!r}, choose from {', '.join(RIR_URLS)} or 'all'")
+    return names
+
+
+def _parse_countries(value):
+    """Parse the --countries argument."""
+    codes = [code.strip().lower() for code in value.split(',') if code.strip()]
+    if not codes or not all(len(code) == 2 and code.isalpha() for code in codes):
+        raise argparse.ArgumentTypeError(f"invalid country code list: {value!r}")
+    return codes
 
 
 def main():
@@ -43,6 +81,26 @@ def main():
                         default=2,
                         help="Step size of mask fragment for network alignment (default: %(default)s)")
     
+    parser.add_argument('-p', '--prefix-lengths',
+                        dest='prefix_lengths',
+                        type=_parse_prefix_lengths,
+                        default=None,
+                        help="Fragment networks to these prefix lengths instead of multiples of "
+                             "--mask-step, e.g. '8,12,16,19,22,24', or 'auto' to choose them "
+                             "with controlled prefix expansion")
+    
+    parser.add_argument('--max-probes',
+                        type=int,
+                        dest='max_probes',
+                        default=None,
+                        help="Maximum number of prefix lengths probed by '-p auto'")
+    
+    parser.add_argument('--max-entries',
+                        type=int,
+                        dest='max_entries',
+                        default=None,
+                        help="Maximum number of table entries produced by '-p auto'")
+    
     parser.add_argument('-s', '--hash-base',
                         type=int,
                         dest='hash_base',
@@ -72,11 +130,98 @@ def main():
                         default='flora_pac.pac',
                         help="Output PAC filename (default: %(default)s)")
     
+    parser.add_argument('-e', '--engine',
+                        choices=ENGINES,
+                        dest='engine',
+                        default='hash',
+                        help="Lookup engine embedded into the PAC file: "
+                             "'hash' for the mod hash_base bucket table, "
+                             "'bsearch' for a binary search over sorted ranges, "
+                             "'bitmap' for a direct-indexed /16 block map, "
+                             "'dict' for exact-match objects per prefix length, "
+                             "'mph' for minimal perfect hash tables per prefix length "
+                             "(default: %(default)s)")
+    
+    parser.add_argument('--hoist-tables',
+                        action='store_true',
+                        dest='hoist_tables',
+                        help="Build the lookup table once per PAC load instead of on every "
+                             "FindProxyForURL call")
+    
+    parser.add_argument('--integer-match',
+                        action='store_true',
+                        dest='integer_match',
+                        help="Match CN networks with integer comparisons instead of isInNet calls")
+    
+    parser.add_argument('--cache-dir',
+                        dest='cache_dir',
+                        default=DEFAULT_CACHE_DIR,
+                        help="Directory caching the APNIC delegated file and the intermediate "
+                             "tables of previous runs (default: %(default)s)")
+    
+    parser.add_argument('--cache-ttl',
+                        type=float,
+                        dest='cache_ttl',
+                        default=DEFAULT_CACHE_TTL,
+                        help="Seconds the cached file is used before revalidating it with APNIC "
+                             "(default: %(default)s)")
+    
+    parser.add_argument('--no-cache',
+                        action='store_true',
+                        dest='no_cache',
+                        help="Always download the APNIC delegated file and rebuild every table, "
+                             "bypassing the cache")
+    
+    parser.add_argument('--offline',
+                        action='store_true',
+                        dest='offline',
+                        help="Only use the cached APNIC delegated file, never touch the network")
+    
+    parser.add_argument('--snapshot',
+                        dest='snapshot',
+                        help="Start from a binary range snapshot instead of the APNIC delegated file")
+    
+    parser.add_argument('--save-snapshot',
+                        dest='save_snapshot',
+                        help="Save the merged ranges to a binary snapshot file")
+    
+    parser.add_argument('-i', '--input',
+                        dest='source',
+                        default=None,
+                        help="Read a local delegated file (plain, gzip or xz), '-' for stdin, "
+                             "or the newest file of a directory instead of downloading it")
+    
+    parser.add_argument('-c', '--countries',
+                        type=_parse_countries,
+                        dest='countries',
+                        default=None,
+                        help="Route the networks of these countries directly, e.g. 'CN,HK,MO' "
+                             "(default: CN)")
+    
+    parser.add_argument('--delta-cache',
+                        dest='delta_cache',
+                        default=None,
+                        help="Keep the hash tables in this file between runs and only re-emit "
+                             "the buckets changed since the previous run (hash engine only)")
+    
+    parser.add_argument('--registries',
+                        type=_parse_registries,
+                        dest='registries',
+                        default=None,
+                        help="Fetch these registries concurrently instead of APNIC only, "
+                             "e.g. 'apnic,arin' or 'all' (%s)" % ', '.join(RIR_URLS))
+    
     parser.add_argument('--version',
                         action='version',
                         version='Flora PAC 1.0.0 (Modular)')
 
     args = parser.parse_args()
+    if args.delta_cache is not None and args.engine != 'hash':
+        parser.error("--delta-cache requires the hash engine")
+    if (args.countries or args.registries) and (
+            args.snapshot is not None
+            or (args.source is not None and is_snapshot_source(args.source))):
+        parser.error("--countries and --registries cannot be used with a binary range snapshot")
     
     try:
         # Generate PAC file using the modular library
@@ -86,7 +231,23 @@ def main():
             no_proxy=args.no_proxy,
             hash_base=args.hash_base,
             mask_step=args.mask_step,
-            output_file=args.output
+            output_file=args.output,
+            hoist_tables=args.hoist_tables,
+            integer_match=args.integer_match,
+            engine=args.engine,
+            prefix_lengths=args.prefix_lengths,
+            max_probes=args.max_probes,
+            max_entries=args.max_entries,
+            cache_dir=None if args.no_cache else args.cache_dir,
+            cache_ttl=args.cache_ttl,
+            offline=args.offline,
+            snapshot=args.snapshot,
+            save_snapshot=args.save_snapshot,
+            registries=args.registries,
+            source=args.source,
+            countries=args.countries,
+            delta_cache=args.delta_cache,
+            stage_cache=None if args.no_cache else StageCache(os.path.join(args.cache_dir, 'stages'))
         )
         
         print(f"\nPAC file generation completed successfully!")
@@ -5,10 +5,12 @@ This package provides modular components for generating PAC files that
 automatically route Chinese IPs direct while proxying other traffic.
 """
 
+import importlib
+
 from .ip_data import fetch_ip_data, merge_nets, merge_all
 from .network_ops import fregment_net, fregment_nets, hash_address, hash_nets
 from .pac_generator import generate_balanced_proxy, generate_no_proxy, generate_pac
-from .web_ui import create_web_ui, launch_web_ui
+from .builder import Dataset, PacBuilder
 
 __version__ = "1.0.0"
 __author__ = "Yale Huang (optimized fork of @leaskh original)"
@@ -24,6 +26,28 @@ __all__ = [
     'generate_balanced_proxy',
     'generate_no_proxy',
     'generate_pac',
+    'Dataset',
+    'PacBuilder',
     'create_web_ui',
     'launch_web_ui',
-]
\ No newline at end of file
+]
+
+# Attributes whose module is only imported on first access: the web UI
+# loads gradio, which takes seconds and is not needed by the CLI
+_LAZY_ATTRIBUTES = {
+    'create_web_ui': 'web_ui',
+    'launch_web_ui': 'web_ui',
+}
+
+
+def __getattr__(name):
+    module = _LAZY_ATTRIBUTES.get(name)
+    if module is None:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    value = getattr(importlib.import_module('.' + module, __name__), name)
+    globals()[name] = value
+    return value
+
+
+def __dir__():
+    return sorted(set(globals()) | set(_LAZY_ATTRIBUTES))
@@ -0,0 +1,212 @@
+"""
+PAC Builder Module
+
+This module separates loading the networks from rendering PAC files. A
+Dataset is loaded once (from the network, a local file or a snapshot), a
+PacBuilder builds its lookup tables once, and render() then produces any
+number of PAC files for different proxies without re-fetching, merging,
+fragmenting or hashing anything.
+"""
+
+import io
+import ipaddress
+import time
+from typing import IO, Iterable, Iterator, List, NamedTuple, Optional, Union
+
+from .cache import DEFAULT_CACHE_TTL
+from .ip_data import merge_all
+from .net_table import NetTable
+from .network_ops import plan_prefix_lengths, prefixlen_histogram
+from .pac_generator import (
+    _build_lookup_tables, _build_pac_prefix, _load_networks, _pac_tail, write_pac
+)
+from .stage_cache import StageCache, nets_digest
+
+
+class Dataset(NamedTuple):
+    """
+    Merged networks routed directly, with the metadata of their source.
+    
+    A Dataset is immutable: the networks table must not be modified once
+    the dataset is created, it is shared by every builder using it.
+    """
+    networks: NetTable
+    digest: str
+    source_date: str = ''
+    serial: int = 0
+    loaded_at: float = 0.0
+    
+    @classmethod
+    def load(cls, cache_dir: Optional[str] = None,
+             cache_ttl: float = DEFAULT_CACHE_TTL,
+             offline: bool = False,
+             snapshot: Optional[str] = None,
+             registries: Optional[List[str]] = None,
+             source: Optional[str] = None,
+             countries: Optional[List[str]] = None,
+             stage_cache: Optional[StageCache] = None) -> 'Dataset':
+        """
+        Load a dataset, from APNIC by default.
+        
+        Args:
+            cache_dir: Directory caching the delegated files, None to always
+                download
+            cache_ttl: Seconds a cached file is used without revalidation
+            offline: Only use the cached delegated files
+            snapshot: Binary range snapshot to load instead
+            registries: Names of the RIR_URLS registries to fetch instead of
+                APNIC only
+            source: Local delegated file, '-' for stdin or a directory, to
+                read instead of downloading
+            countries: ISO 3166 country codes (default: ['cn'])
+            stage_cache: StageCache reusing the merge of identical data
+        
+        Returns:
+            Dataset
+        
+        Raises:
+            ValueError: If a registry is unknown, or countries or registries
+                are combined with a binary range snapshot
+        """
+        networks, digest, header = _load_networks(cache_dir, cache_ttl, offline, snapshot,
+                                                  registries, source, countries, stage_cache)
+        return cls(networks, digest, header.get('enddate', ''), header.get('serial', 0),
+                   time.time())
+    
+    @classmethod
+    def from_networks(cls, nets: Union[NetTable, Iterable[ipaddress.IPv4Network]],
+                      source_date: str = '', serial: int = 0,
+                      stage_cache: Optional[StageCache] = None) -> 'Dataset':
+        """
+        Create a dataset from networks, which are merged.
+        
+        Args:
+            nets: NetTable or iterable of IPv4Network objects
+            source_date: Date of the source of the networks (YYYYMMDD)
+            serial: Serial of the source of the networks
+            stage_cache: StageCache reusing the merge of identical networks
+        
+        Returns:
+            Dataset
+        """
+        if not isinstance(nets, NetTable):
+            nets = NetTable.from_networks(nets)
+        if stage_cache is None:
+            stage_cache = StageCache()
+        digest = nets_digest(nets)
+        networks = stage_cache.get('merge', digest, (), lambda: merge_all(nets))
+        return cls(networks, digest, source_date, serial, time.time())
+
+
+class PacBuilder:
+    """
+    Renders PAC files of a Dataset with fixed lookup table parameters.
+    
+    The constructor builds the lookup tables and renders everything in the
+    PAC file that does not depend on the proxies, the prefix, once. A PAC
+    file is the prefix followed by a small tail holding the proxy logic, so
+    render() only renders the tail and copies the prefix. render() never
+    modifies the builder, so a builder can be shared between threads.
+    
+    Args:
+        dataset: Dataset to render
+        hash_base: Hash table size for performance tuning
+        mask_step: Network fragmentation step size
+        engine: Lookup engine, one of pac_generator.ENGINES
+        prefix_lengths: Target prefix lengths to fragment to instead of
+            multiples of mask_step, or 'auto' to plan them
+        max_probes: Probe budget for the 'auto' plan
+        max_entries: Table size budget for the 'auto' plan
+        hoist_tables: Build the lookup table once per PAC load
+        integer_match: Match candidates with integer comparisons
+        stage_cache: StageCache reusing the tables and prefix built for the
+            same dataset and parameters by other builders
+    
+    Raises:
+        ValueError: If the engine is unknown
+    """
+    
+    def __init__(self, dataset: Dataset, hash_base: int = 3011, mask_step: int = 2,
+                 engine: str = 'hash',
+                 prefix_lengths: Optional[Union[str, List[int]]] = None,
+                 max_probes: Optional[int] = None,
+                 max_entries: Optional[int] = None,
+                 hoist_tables: bool = False, integer_match: bool = False,
+                 stage_cache: Optional[StageCache] = None):
+        if prefix_lengths == 'auto':
+            prefix_lengths = plan_prefix_lengths(prefixlen_histogram(dataset.networks),
+                                                 max_probes, max_entries)
+        if stage_cache is None:
+            stage_cache = StageCache()
+        self.dataset = dataset
+        self.engine = engine
+        self.hash_base = hash_base
+        self.mask_step = mask_step
+        self.prefix_lengths = prefix_lengths
+        self.hoist_tables = hoist_tables
+        self.integer_match = integer_match
+        self.tables = _build_lookup_tables(
+            dataset.networks, dataset.digest, stage_cache, engine,
+            hash_base, mask_step, prefix_lengths, integer_match
+        )
+        self.prefix_bytes = _build_pac_prefix(
+            self.tables, dataset.digest, stage_cache, engine, hash_base, mask_step,
+            prefix_lengths, integer_match, hoist_tables
+        )
+        self.prefix = self.prefix_bytes.decode('utf-8')
+    
+    def tail(self, proxies: List[str], balance: str = 'no',
+             no_proxy: Iterable[str] = ()) -> str:
+        """
+        Render the end of a PAC file, which follows prefix.
+        
+        Args:
+            proxies: List of proxy server strings
+            balance: Proxy balancing strategy ('no', 'local_ip' or 'host')
+            no_proxy: Networks/hosts to bypass the proxy
+        
+        Returns:
+            The proxy logic of the PAC file
+        """
+        return _pac_tail(proxies, balance, list(no_proxy), self.hoist_tables)
+    
+    def render(self, proxies: List[str], balance: str = 'no',
+               no_proxy: Iterable[str] = ()) -> str:
+        """
+        Render a PAC file.
+        
+        Args:
+            proxies: List of proxy server strings
+            balance: Proxy balancing strategy ('no', 'local_ip' or 'host')
+            no_proxy: Networks/hosts to bypass the proxy
+        
+        Returns:
+            Complete PAC file content
+        """
+        return self.prefix + self.tail(proxies, balance, no_proxy)
+    
+    def render_bytes(self, proxies: List[str], balance: str = 'no',
+                     no_proxy: Iterable[str] = ()) -> bytes:
+        """Render a PAC file as UTF-8 bytes, see render"""
+        return self.prefix_bytes + self.tail(proxies, balance, no_proxy).encode('utf-8')
+    
+    def iter_chunks(self, proxies: List[str], balance: str = 'no',
+                    no_proxy: Iterable[str] = ()) -> Iterator[str]:
+        """Yield a PAC file in pieces, see render"""
+        return iter((self.prefix, self.tail(proxies, balance, no_proxy)))
+    
+    def write(self, fileobj: IO, proxies: List[str], balance: str = 'no',
+              no_proxy: Iterable[str] = ()) -> int:
+        """
+        Write a PAC file into a text or binary file object, see render and
+        pac_generator.write_pac.
+        
+        Returns:
+            Number of characters written
+        """
+        tail = self.tail(proxies, balance, no_proxy)
+        if isinstance(fileobj, io.TextIOBase):
+            return write_pac(fileobj, (self.prefix, tail))
+        # The prefix is encoded once, by the constructor
+        fileobj.write(self.prefix_bytes)
+        return len(self.prefix) + write_pac(fileobj, (tail,))
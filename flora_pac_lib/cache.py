@@ -0,0 +1,216 @@
+"""
+Snapshot Cache Module
+
+This module keeps the last downloaded copy of the RIR delegated files on
+disk and revalidates it with conditional HTTP requests, so repeated PAC
+generations do not download the whole file again. Interrupted downloads
+are retried and resumed where they stopped.
+"""
+
+import json
+import os
+import time
+from typing import TYPE_CHECKING, Optional
+
+if TYPE_CHECKING:
+    import urllib3
+
+
+DEFAULT_CACHE_DIR = os.path.join(os.path.expanduser('~'), '.cache', 'flora_pac')
+DEFAULT_CACHE_TTL = 24 * 60 * 60
+
+# Download tuning: per-request timeouts in seconds, retries with
+# exponential backoff and the size of the chunks streamed to disk
+DEFAULT_CONNECT_TIMEOUT = 10
+DEFAULT_READ_TIMEOUT = 60
+DEFAULT_RETRIES = 4
+DEFAULT_BACKOFF = 1.0
+CHUNK_SIZE = 64 * 1024
+
+
+def default_timeout() -> 'urllib3.Timeout':
+    """Return the urllib3 Timeout of DEFAULT_CONNECT_TIMEOUT and DEFAULT_READ_TIMEOUT."""
+    # urllib3 is only imported once something is downloaded, so generating
+    # from a local file or a snapshot never loads it
+    import urllib3
+    return urllib3.Timeout(connect=DEFAULT_CONNECT_TIMEOUT, read=DEFAULT_READ_TIMEOUT)
+
+
+def snapshot_path(url: str, cache_dir: str) -> str:
+    """
+    Return the path of the cached snapshot of a URL.
+    
+    Args:
+        url: URL of the delegated file
+        cache_dir: Cache directory
+        
+    Returns:
+        Path of the snapshot file (which may not exist yet)
+    """
+    return os.path.join(cache_dir, url.rstrip('/').rsplit('/', 1)[-1])
+
+
+def _read_meta(path: str) -> dict:
+    """Read the metadata stored next to a snapshot, {} if there is none."""
+    try:
+        with open(path + '.meta.json', 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def _write_meta(path: str, meta: dict) -> None:
+    """Atomically replace the metadata stored next to a snapshot."""
+    tmp_path = path + '.meta.json.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(meta, f)
+    os.replace(tmp_path, path + '.meta.json')
+
+
+class _TransientError(Exception):
+    """A download failure worth retrying"""
+
+
+def fetch_snapshot(url: str, cache_dir: str = DEFAULT_CACHE_DIR,
+                   ttl: float = DEFAULT_CACHE_TTL, offline: bool = False,
+                   http: Optional['urllib3.PoolManager'] = None,
+                   timeout: Optional['urllib3.Timeout'] = None,
+                   retries: int = DEFAULT_RETRIES, backoff: float = DEFAULT_BACKOFF) -> str:
+    """
+    Make sure a fresh copy of url is cached and return its path.
+    
+    A snapshot younger than ttl seconds is used as is. An older one is
+    revalidated with If-None-Match/If-Modified-Since and only downloaded
+    again when the server reports a change.
+    
+    Downloads are streamed into a .part file. When the transfer breaks it
+    is retried after backoff, 2 * backoff, 4 * backoff... seconds and
+    resumed from the end of the .part file with an HTTP Range request, so
+    a failure near the end does not start over. A .part file left by an
+    earlier run is resumed as well.
+    
+    Args:
+        url: URL of the delegated file
+        cache_dir: Cache directory, created if missing
+        ttl: Seconds a snapshot is used without revalidation
+        offline: Never touch the network, use whatever snapshot is cached
+        http: PoolManager to reuse, a new one is created by default
+        timeout: Connect and read timeouts of every request (default:
+            DEFAULT_CONNECT_TIMEOUT and DEFAULT_READ_TIMEOUT)
+        retries: Number of retries after a failed attempt
+        backoff: Delay before the first retry in seconds
+        
+    Returns:
+        Path of the cached snapshot
+        
+    Raises:
+        Exception: If the download fails or, offline, nothing is cached
+    """
+    path = snapshot_path(url, cache_dir)
+    meta = _read_meta(path) if os.path.exists(path) else {}
+    
+    if offline:
+        if not meta:
+            raise Exception(f"No cached snapshot of {url} in {cache_dir} for offline use")
+        return path
+    
+    if meta and meta.get('url') == url and time.time() - meta.get('fetched_at', 0) < ttl:
+        return path
+    
+    import urllib3
+    
+    print(f"Fetching {url}, please wait...")
+    if http is None:
+        http = urllib3.PoolManager()
+    if timeout is None:
+        timeout = default_timeout()
+    os.makedirs(cache_dir, exist_ok=True)
+    
+    for attempt in range(retries + 1):
+        try:
+            meta = _download(url, path, meta, http, timeout)
+            break
+        except (urllib3.exceptions.HTTPError, OSError, _TransientError) as e:
+            if attempt == retries:
+                raise Exception(f"Failed to fetch {url} after {retries + 1} attempts: {e}") from e
+            delay = backoff * 2 ** attempt
+            print(f"Warning: Download of {url} interrupted ({e}), retrying in {delay:g}s...")
+            time.sleep(delay)
+    
+    meta['fetched_at'] = time.time()
+    _write_meta(path, meta)
+    return path
+
+
+def _download(url: str, path: str, meta: dict, http: 'urllib3.PoolManager',
+              timeout: 'urllib3.Timeout') -> dict:
+    """
+    Make one attempt at downloading url into path, resuming a partial download.
+    
+    Returns:
+        The metadata of the snapshot
+    """
+    part_path = path + '.part'
+    part_meta = _read_meta(part_path) if os.path.exists(part_path) else {}
+    offset = os.path.getsize(part_path) if part_meta.get('url') == url else 0
+    
+    headers = {}
+    if offset:
+        headers['Range'] = f'bytes={offset}-'
+        # Only resume when the remote file is still the one partially downloaded
+        validator = part_meta.get('etag') or part_meta.get('last_modified')
+        if validator:
+            headers['If-Range'] = validator
+    elif meta.get('url') == url:
+        if meta.get('etag'):
+            headers['If-None-Match'] = meta['etag']
+        if meta.get('last_modified'):
+            headers['If-Modified-Since'] = meta['last_modified']
+    
+    response = http.request('GET', url, headers=headers, preload_content=False,
+                            timeout=timeout, retries=False)
+    try:
+        if response.status == 304:
+            print(f"Cached snapshot of {url} is up to date.")
+            return meta
+        if response.status == 416:
+            # The partial file no longer matches the remote one, start over
+            os.remove(part_path)
+            raise _TransientError("partial download does not match the remote file")
+        if response.status >= 500:
+            raise _TransientError(f"HTTP {response.status}")
+        if response.status not in (200, 206):
+            raise Exception(f"Failed to fetch {url}: HTTP {response.status}")
+        
+        if response.status == 200:
+            # Full body: the server ignored or rejected the Range request
+            offset = 0
+        content_length = response.headers.get('Content-Length')
+        expected = offset + int(content_length) if content_length is not None else None
+        
+        new_meta = {
+            'url': url,
+            'etag': response.headers.get('ETag'),
+            'last_modified': response.headers.get('Last-Modified'),
+        }
+        _write_meta(part_path, new_meta)
+        with open(part_path, 'r+b' if offset else 'wb') as f:
+            f.seek(offset)
+            f.truncate()
+            # read1 hands over whatever arrived, so the bytes received
+            # before a dropped connection still reach the .part file
+            while True:
+                chunk = response.read1(CHUNK_SIZE)
+                if not chunk:
+                    break
+                f.write(chunk)
+            received = f.tell()
+    finally:
+        response.release_conn()
+    
+    if expected is not None and received != expected:
+        raise _TransientError(f"received {received} of {expected} bytes")
+    
+    os.replace(part_path, path)
+    os.remove(part_path + '.meta.json')
+    return new_meta
@@ -0,0 +1,217 @@
+"""
+Snapshot Delta Module
+
+This module diffs two range snapshots and keeps the hash engine lookup
+tables as per-bucket segments, so a new snapshot only re-emits the
+buckets its changed networks hash to instead of the whole table.
+"""
+
+import os
+import pickle
+from collections import Counter
+from typing import Iterator, List, NamedTuple, Optional, Sequence, Tuple
+
+from .net_table import NetTable
+from .network_ops import fregment_nets
+# Deliberately coupled to the private hash engine renderers: the cached
+# segments must match the output of pac_generator byte for byte, so they
+# are rendered by the same code rather than a public copy of it
+from .pac_generator import (
+    _LOOKUP_TABLES_END, _generate_bucket, _generate_lookup_header, _iter_pac_content
+)
+from .snapshot import load_snapshot
+
+
+class RangeDelta(NamedTuple):
+    """Address ranges added and removed between two snapshots"""
+    added: List[Tuple[int, int]]
+    removed: List[Tuple[int, int]]
+    
+    @property
+    def addresses(self) -> int:
+        """Number of addresses added or removed"""
+        return sum(end - start + 1 for start, end in self.added + self.removed)
+
+
+class DeltaReport(NamedTuple):
+    """What a HashTableCache.update changed"""
+    ranges: RangeDelta
+    added_nets: int
+    removed_nets: int
+    changed_buckets: List[int]
+    total_buckets: int
+    
+    def __str__(self) -> str:
+        return ("Delta: +%d/-%d ranges (%d addresses), +%d/-%d networks, "
+                "%d of %d buckets re-emitted" % (
+                    len(self.ranges.added), len(self.ranges.removed), self.ranges.addresses,
+                    self.added_nets, self.removed_nets,
+                    len(self.changed_buckets), self.total_buckets))
+
+
+def diff_ranges(old: Sequence[Tuple[int, int]], new: Sequence[Tuple[int, int]]) -> RangeDelta:
+    """
+    Diff two sorted, disjoint lists of inclusive address ranges.
+    
+    Args:
+        old: Ranges of the previous snapshot
+        new: Ranges of the current snapshot
+    
+    Returns:
+        RangeDelta with the ranges only covered by new (added) and only
+        covered by old (removed)
+    """
+    return RangeDelta(_subtract_ranges(new, old), _subtract_ranges(old, new))
+
+
+def _subtract_ranges(ranges: Sequence[Tuple[int, int]],
+                     other: Sequence[Tuple[int, int]]) -> List[Tuple[int, int]]:
+    """Return the parts of ranges not covered by other, both sorted and disjoint."""
+    result = []
+    j = 0
+    for start, end in ranges:
+        # Skip the ranges of other that end before this one
+        while j < len(other) and other[j][1] < start:
+            j += 1
+        k = j
+        while start <= end:
+            if k == len(other) or other[k][0] > end:
+                result.append((start, end))
+                break
+            if other[k][0] > start:
+                result.append((start, other[k][0] - 1))
+            start = max(start, other[k][1] + 1)
+            k += 1
+    return result
+
+
+def diff_snapshots(old_path: str, new_path: str) -> RangeDelta:
+    """
+    Diff the ranges of two binary snapshot files.
+    
+    Args:
+        old_path: Previous snapshot
+        new_path: Current snapshot
+    
+    Returns:
+        RangeDelta between the two snapshots
+    """
+    return diff_ranges(load_snapshot(old_path).ranges(), load_snapshot(new_path).ranges())
+
+
+class HashTableCache:
+    """
+    Hash engine lookup tables, kept as one rendered segment per bucket.
+    
+    The merged networks of a snapshot are canonical CIDR decompositions of
+    its ranges, so networks outside the changed ranges are identical between
+    two snapshots. update() only fragments and hashes the networks that
+    differ, and only re-renders the buckets they land in.
+    """
+    
+    def __init__(self, merged: NetTable, hash_base: int = 3011, mask_step: int = 2,
+                 prefix_lengths: Optional[List[int]] = None):
+        self.hash_base = hash_base
+        self.mask_step = mask_step
+        self.prefix_lengths = prefix_lengths
+        self.merged = NetTable()
+        self.buckets = [NetTable() for _ in range(hash_base)]
+        self.segments = [_generate_bucket(bucket) for bucket in self.buckets]
+        self.prefixlen_counts = Counter()
+        self.update(merged)
+    
+    def matches(self, hash_base: int, mask_step: int,
+                prefix_lengths: Optional[List[int]] = None) -> bool:
+        """Return True if the tables were built with these parameters"""
+        return (self.hash_base, self.mask_step, self.prefix_lengths) == (
+            hash_base, mask_step, prefix_lengths)
+    
+    def update(self, merged: NetTable) -> DeltaReport:
+        """
+        Bring the tables up to date with the merged networks of a new snapshot.
+        
+        Args:
+            merged: Merged networks, e.g. merge_all of a NetTable
+        
+        Returns:
+            DeltaReport describing the change
+        """
+        old_rows = set(self.merged)
+        new_rows = set(merged)
+        removed = NetTable(*_columns(sorted(old_rows - new_rows)))
+        added = NetTable(*_columns(sorted(new_rows - old_rows)))
+        # The unchanged networks cover the same addresses in both snapshots,
+        # so the address delta only depends on the changed ones
+        ranges = diff_ranges(removed.ranges(), added.ranges())
+        
+        removed_fragments = fregment_nets(removed, self.mask_step, self.prefix_lengths)
+        added_fragments = fregment_nets(added, self.mask_step, self.prefix_lengths)
+        self.prefixlen_counts.subtract(removed_fragments.prefixlens)
+        self.prefixlen_counts.update(added_fragments.prefixlens)
+        
+        changes = {}
+        for address, prefixlen in removed_fragments:
+            changes.setdefault(address % self.hash_base, (set(), set()))[0].add((address, prefixlen))
+        for address, prefixlen in added_fragments:
+            changes.setdefault(address % self.hash_base, (set(), set()))[1].add((address, prefixlen))
+        
+        changed_buckets = []
+        for index, (bucket_removed, bucket_added) in sorted(changes.items()):
+            rows = (set(self.buckets[index]) - bucket_removed) | bucket_added
+            # Full generation emits fragments in address order
+            bucket = NetTable(*_columns(sorted(rows)))
+            if bucket != self.buckets[index]:
+                self.buckets[index] = bucket
+                self.segments[index] = _generate_bucket(bucket)
+                changed_buckets.append(index)
+        
+        self.merged = merged
+        return DeltaReport(ranges, len(added), len(removed), changed_buckets, self.hash_base)
+    
+    def tables(self) -> str:
+        """Return the hash engine lookup tables, as joined _iter_lookup_tables pieces would be"""
+        return ''.join(self.iter_tables())
+    
+    def iter_tables(self) -> Iterator[str]:
+        """Yield the hash engine lookup tables in pieces, one bucket segment at a time"""
+        prefixlens = sorted(length for length, count in self.prefixlen_counts.items() if count > 0)
+        min_prefixlen, max_prefixlen = (prefixlens[0], prefixlens[-1]) if prefixlens else (32, 0)
+        yield _generate_lookup_header(prefixlens, self.hash_base, self.mask_step,
+                                      min_prefixlen, max_prefixlen)
+        yield from self.segments
+        yield _LOOKUP_TABLES_END
+    
+    def render(self, proxies: List[str], balance: str, no_proxy: List[str],
+               hoist_tables: bool = False, integer_match: bool = False) -> str:
+        """Return the complete PAC file content"""
+        return ''.join(self.iter_chunks(proxies, balance, no_proxy, hoist_tables, integer_match))
+    
+    def iter_chunks(self, proxies: List[str], balance: str, no_proxy: List[str],
+                    hoist_tables: bool = False, integer_match: bool = False) -> Iterator[str]:
+        """Yield the complete PAC file content in pieces, see pac_generator.write_pac"""
+        return _iter_pac_content(
+            None, proxies, balance, no_proxy, self.hash_base, self.mask_step, 0, 0,
+            self.merged, hoist_tables=hoist_tables, integer_match=integer_match,
+            lookup_tables=self.iter_tables()
+        )
+    
+    def save(self, path: str) -> None:
+        """Atomically write the cache to a file"""
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'wb') as f:
+            pickle.dump(self, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, path)
+    
+    @classmethod
+    def load(cls, path: str) -> 'HashTableCache':
+        """Read a cache written by save()"""
+        with open(path, 'rb') as f:
+            cache = pickle.load(f)
+        if not isinstance(cache, cls):
+            raise ValueError(f"{path} is not a hash table cache")
+        return cache
+
+
+def _columns(rows: List[Tuple[int, int]]) -> Tuple[List[int], List[int]]:
+    """Split (address, prefixlen) rows into the two NetTable columns."""
+    return [address for address, _ in rows], [prefixlen for _, prefixlen in rows]
@@ -1,75 +1,300 @@
 """
 IP Data Fetching and Network Merging Module
 
-This module handles fetching IP range data from APNIC and merging
-adjacent networks for optimization.
+This module handles fetching IP range data from APNIC (or all regional
+registries) and merging adjacent networks for optimization.
 """
 
-import re
-import math
-import urllib3
 import ipaddress
-from typing import List
+from typing import TYPE_CHECKING, Dict, Iterable, List, NamedTuple, Optional, Tuple, Union
 
+from .cache import DEFAULT_BACKOFF, DEFAULT_CACHE_TTL, DEFAULT_RETRIES, default_timeout, fetch_snapshot
+from .net_table import NetTable, range_to_cidrs
 
-def fetch_ip_data() -> List[ipaddress.IPv4Network]:
+if TYPE_CHECKING:
+    import urllib3
+
+
+APNIC_URL = r'http://ftp.apnic.net/apnic/stats/apnic/delegated-apnic-latest'
+
+# Record statuses of address space in use
+_DELEGATED_STATUSES = (b'allocated', b'assigned')
+
+# Delegated files of the five regional internet registries
+RIR_URLS = {
+    'apnic': APNIC_URL,
+    'arin': r'http://ftp.arin.net/pub/stats/arin/delegated-arin-extended-latest',
+    'ripencc': r'http://ftp.ripe.net/pub/stats/ripencc/delegated-ripencc-latest',
+    'lacnic': r'http://ftp.lacnic.net/pub/stats/lacnic/delegated-lacnic-latest',
+    'afrinic': r'http://ftp.afrinic.net/pub/stats/afrinic/delegated-afrinic-latest',
+}
+
+
+def fetch_ip_data(cache_dir: Optional[str] = None, cache_ttl: float = DEFAULT_CACHE_TTL,
+                  offline: bool = False,
+                  header: Optional[dict] = None,
+                  as_table: bool = False,
+                  country: Union[str, Iterable[str]] = 'cn') -> Union[List[ipaddress.IPv4Network], NetTable]:
     """
     Fetch China IP ranges from APNIC and return as IPv4Network objects.
     
+    The response body is streamed and parsed line by line, so the whole
+    delegated file is never held in memory. With a cache_dir the file is
+    kept on disk and only downloaded again when it changed upstream, see
+    cache.fetch_snapshot.
+    
+    Args:
+        cache_dir: Directory caching the delegated file, None to disable
+        cache_ttl: Seconds a cached file is used without revalidation
+        offline: Only use the cached file, never touch the network
+        header: Optional dict filled with the file header, see parse_delegated
+        as_table: Return a NetTable instead of IPv4Network objects
+        country: ISO 3166 country code, or codes, to keep
+    
     Returns:
-        List of IPv4Network objects representing China IP ranges
+        List of IPv4Network objects (or NetTable) representing China IP ranges
         
     Raises:
         Exception: If network request fails or data parsing fails
     """
-    print("Fetching data from apnic.net, it might take a few minutes, please wait...")
-    url = r'http://ftp.apnic.net/apnic/stats/apnic/delegated-apnic-latest'
+    if cache_dir is None and not offline:
+        print("Fetching data from apnic.net, it might take a few minutes, please wait...")
+    results = fetch_delegated(APNIC_URL, country, cache_dir=cache_dir, cache_ttl=cache_ttl,
+                              offline=offline, header=header)
+    return results if as_table else results.to_networks()
+
+
+def fetch_delegated(url: str, country: Union[str, Iterable[str]] = 'cn', cache_dir: Optional[str] = None,
+                    cache_ttl: float = DEFAULT_CACHE_TTL, offline: bool = False,
+                    header: Optional[dict] = None,
+                    http: Optional['urllib3.PoolManager'] = None,
+                    retries: Optional[int] = None,
+                    backoff: Optional[float] = None) -> NetTable:
+    """
+    Fetch and parse the networks of a country from one RIR delegated file.
     
-    # Use PoolManager to make the request
-    http = urllib3.PoolManager()
-    response = http.request('GET', url)
+    Args:
+        url: URL of the delegated file
+        country: ISO 3166 country code, or codes, to keep
+        cache_dir: Directory caching the delegated file, None to disable
+        cache_ttl: Seconds a cached file is used without revalidation
+        offline: Only use the cached file, never touch the network
+        header: Optional dict filled with the file header, see parse_delegated
+        http: PoolManager to reuse, a new one is created by default
+        retries: Number of retries after a failed attempt, 0 to fail at once
+            (default: DEFAULT_RETRIES)
+        backoff: Delay before the first retry in seconds (default:
+            DEFAULT_BACKOFF)
     
-    if response.status != 200:
-        raise Exception(f"Failed to fetch APNIC data: HTTP {response.status}")
+    Returns:
+        NetTable of the parsed networks
+        
+    Raises:
+        Exception: If network request fails or data parsing fails
+    """
+    if retries is None:
+        retries = DEFAULT_RETRIES
+    if backoff is None:
+        backoff = DEFAULT_BACKOFF
+    if cache_dir is not None:
+        path = fetch_snapshot(url, cache_dir, cache_ttl, offline, http,
+                              retries=retries, backoff=backoff)
+        with open(path, 'rb') as f:
+            return parse_delegated(f, country, header, as_table=True)
+    if offline:
+        raise Exception("Offline mode requires a cache directory")
     
-    data = response.data.decode('utf-8')
+    # urllib3 is only needed here, importing it up front slows down every
+    # generation from local data
+    import urllib3
     
-    # Regex to match China IPv4 entries
-    cnregex = re.compile(r'apnic\|cn\|ipv4\|[0-9\.]+\|[0-9]+\|[0-9]+\|a.*', re.IGNORECASE)
-    cndata = cnregex.findall(data)
+    # Use PoolManager to make the request. Without a cache the body is parsed
+    # while it streams in, so only failures before the body are retried.
+    if http is None:
+        http = urllib3.PoolManager()
+    response = http.request('GET', url, preload_content=False, timeout=default_timeout(),
+                            retries=urllib3.Retry(retries, backoff_factor=backoff))
     
-    results = []
+    try:
+        if response.status != 200:
+            raise Exception(f"Failed to fetch {url}: HTTP {response.status}")
+        return parse_delegated(response, country, header, as_table=True)
+    finally:
+        response.release_conn()
+
+
+def fetch_registries(urls: Optional[Dict[str, str]] = None,
+                     country: Union[str, Iterable[str]] = 'cn',
+                     cache_dir: Optional[str] = None, cache_ttl: float = DEFAULT_CACHE_TTL,
+                     offline: bool = False, headers: Optional[dict] = None,
+                     as_table: bool = False) -> Union[List[ipaddress.IPv4Network], NetTable]:
+    """
+    Fetch the delegated files of several registries concurrently and merge them.
+    
+    Every file is downloaded and parsed in its own thread over a shared
+    connection pool, so the wall-clock time is that of the slowest registry
+    instead of the sum of all of them.
     
-    for item in cndata:
+    Args:
+        urls: Registry name to delegated file URL (default: RIR_URLS)
+        country: ISO 3166 country code, or codes, to keep
+        cache_dir: Directory caching the delegated files, None to disable
+        cache_ttl: Seconds a cached file is used without revalidation
+        offline: Only use the cached files, never touch the network
+        headers: Optional dict filled with the file header of every
+            registry, keyed by registry name
+        as_table: Return a NetTable instead of IPv4Network objects
+    
+    Returns:
+        Merged list of IPv4Network objects, or NetTable
+        
+    Raises:
+        Exception: If any registry fails, after all of them completed
+    """
+    if urls is None:
+        urls = RIR_URLS
+    if not urls:
+        return NetTable() if as_table else []
+    
+    import urllib3
+    from concurrent.futures import ThreadPoolExecutor
+    
+    print("Fetching data from %s, please wait..." % ', '.join(urls))
+    http = urllib3.PoolManager(maxsize=len(urls))
+    registry_headers = {name: {} for name in urls}
+    
+    with ThreadPoolExecutor(max_workers=len(urls)) as executor:
+        futures = {
+            name: executor.submit(fetch_delegated, url, country, cache_dir, cache_ttl,
+                                  offline, registry_headers[name], http)
+            for name, url in urls.items()
+        }
+    
+    combined = NetTable()
+    for name, future in futures.items():
         try:
-            unit_items = item.split('|')
-            starting_ip = unit_items[3]
-            num_ip = int(unit_items[4])
-            
-            # Calculate network mask from IP count
-            imask = 0xffffffff ^ (num_ip - 1)
-            # Convert to string
-            imask = hex(imask)[2:]
-            mask = [0] * 4
-            mask[0] = imask[0:2]
-            mask[1] = imask[2:4]
-            mask[2] = imask[4:6]
-            mask[3] = imask[6:8]
-            
-            # Convert str to int
-            mask = [int(i, 16) for i in mask]
-            mask = "%d.%d.%d.%d" % tuple(mask)
-            
-            # Create network object
-            net = ipaddress.ip_network(u"%s/%s" % (starting_ip, mask))
-            results.append(net)
+            table = future.result()
+        except Exception as e:
+            raise Exception(f"Failed to fetch {name} data: {e}") from e
+        combined.addresses.extend(table.addresses)
+        combined.prefixlens.extend(table.prefixlens)
+    
+    if headers is not None:
+        headers.update(registry_headers)
+    
+    results = merge_all(combined)
+    return results if as_table else results.to_networks()
+
+
+class CountryRanges(NamedTuple):
+    """IPv4 and IPv6 networks of one country, see parse_delegated_countries"""
+    ipv4: NetTable
+    ipv6: List[Tuple[int, int]]
+
+
+def parse_delegated(lines: Iterable[bytes], country: Union[str, Iterable[str]] = 'cn',
+                    header: Optional[dict] = None,
+                    as_table: bool = False) -> Union[List[ipaddress.IPv4Network], NetTable]:
+    """
+    Parse the IPv4 networks of a country from an RIR delegated stats file.
+    
+    Records look like ``apnic|CN|ipv4|1.0.1.0|256|20110414|allocated``. Only
+    allocated and assigned IPv4 records of the country are kept.
+    
+    Args:
+        lines: Lines of the delegated file as bytes, e.g. an HTTP response
+            or a file opened in binary mode
+        country: ISO 3166 country code to keep (case-insensitive), or
+            several codes whose networks are all kept
+        header: Optional dict filled with the 'serial' and 'enddate' of the
+            version line (``2|apnic|20230101|...|20230101|+1000``)
+        as_table: Return a NetTable instead of IPv4Network objects
+        
+    Returns:
+        List of IPv4Network objects, or NetTable
+    """
+    countries = [country] if isinstance(country, str) else list(country)
+    tables = parse_delegated_countries(lines, countries, header, ipv6=False)
+    
+    if len(tables) == 1:
+        results = next(iter(tables.values())).ipv4
+    else:
+        results = NetTable()
+        for ranges in tables.values():
+            results.addresses.extend(ranges.ipv4.addresses)
+            results.prefixlens.extend(ranges.ipv4.prefixlens)
+    return results if as_table else results.to_networks()
+
+
+def parse_delegated_countries(lines: Iterable[bytes], countries: Optional[Iterable[str]] = None,
+                              header: Optional[dict] = None,
+                              ipv6: bool = True) -> Dict[str, CountryRanges]:
+    """
+    Parse a delegated stats file once, bucketing the networks by country.
+    
+    Args:
+        lines: Lines of the delegated file as bytes
+        countries: ISO 3166 country codes to keep (case-insensitive), None
+            for every country in the file
+        header: Optional dict filled with the 'serial' and 'enddate' of the
+            version line
+        ipv6: Parse the IPv6 records too
+        
+    Returns:
+        Dict mapping each lower-case country code to its CountryRanges. The
+        IPv4 networks are a NetTable, the IPv6 ones (network, prefixlen)
+        integer tuples. Requested countries without records map to empty
+        tables.
+    """
+    tables = {}
+    if countries is not None:
+        for country in countries:
+            tables.setdefault(country.lower().encode('ascii'), CountryRanges(NetTable(), []))
+    
+    for line in lines:
+        unit_items = line.rstrip().split(b'|')
+        if header is not None and len(unit_items) >= 6 and unit_items[0][:1].isdigit():
+            # The version line, the only one starting with a number
+            header['serial'] = int(unit_items[2]) if unit_items[2].isdigit() else 0
+            header['enddate'] = unit_items[5].decode('ascii', 'replace')
+            continue
+        if len(unit_items) < 7 or unit_items[6].lower() not in _DELEGATED_STATUSES:
+            continue
+        
+        country = unit_items[1].lower()
+        ranges = tables.get(country)
+        if ranges is None:
+            if countries is not None or not country or country == b'*':
+                continue
+            ranges = tables[country] = CountryRanges(NetTable(), [])
+        
+        record_type = unit_items[2].lower()
+        try:
+            if record_type == b'ipv4':
+                octets = [int(octet) for octet in unit_items[3].split(b'.')]
+                num_ip = int(unit_items[4])
+                if len(octets) != 4 or not all(0 <= octet <= 255 for octet in octets):
+                    raise ValueError("invalid IPv4 address")
+                
+                starting_ip = (octets[0] << 24) | (octets[1] << 16) | (octets[2] << 8) | octets[3]
+                if num_ip <= 0 or starting_ip + num_ip > 1 << 32:
+                    raise ValueError(f"invalid address count {num_ip}")
+                
+                # Counts are not always powers of two (e.g. 768), and a range
+                # may not be aligned to its size, so decompose it exactly
+                for address, prefixlen in range_to_cidrs(starting_ip, starting_ip + num_ip - 1):
+                    ranges.ipv4.append(address, prefixlen)
+            elif record_type == b'ipv6' and ipv6:
+                # The value of IPv6 records is the prefix length
+                net = ipaddress.IPv6Network((unit_items[3].decode('ascii'), int(unit_items[4])))
+                ranges.ipv6.append((int(net.network_address), net.prefixlen))
             
-        except (ValueError, IndexError, TypeError) as e:
+        except ValueError as e:
             # Skip malformed entries
-            print(f"Warning: Skipping malformed entry: {item} - {e}")
+            print(f"Warning: Skipping malformed entry: {line.decode('ascii', 'replace').strip()} - {e}")
             continue
     
-    return results
+    return {country.decode('ascii'): ranges for country, ranges in tables.items()}
 
 
 def merge_nets(net1: ipaddress.IPv4Network, net2: ipaddress.IPv4Network) -> ipaddress.IPv4Network:
@@ -99,36 +324,53 @@ def merge_nets(net1: ipaddress.IPv4Network, net2: ipaddress.IPv4Network) -> ipad
     return None
 
 
-def merge_all(networks: List[ipaddress.IPv4Network]) -> List[ipaddress.IPv4Network]:
+def merge_all(networks: Union[List[ipaddress.IPv4Network], NetTable]
+              ) -> Union[List[ipaddress.IPv4Network], NetTable]:
     """
     Merge all adjacent networks in a list to optimize the network list.
     
+    The networks are converted to integer ranges, coalesced in one sorted
+    pass and decomposed back into the minimal list of CIDR networks.
+    Overlapping and duplicate networks are absorbed as well.
+    
     Args:
-        networks: List of IPv4Network objects
+        networks: List of IPv4Network objects, or NetTable
         
     Returns:
-        Optimized list with adjacent networks merged
+        Optimized list (or NetTable) with adjacent networks merged
     """
+    if isinstance(networks, NetTable):
+        return NetTable.from_ranges(networks.ranges())
     if not networks:
         return []
-        
-    # Sort networks for consistent merging
-    networks = sorted(networks)
     
-    i = 1
-    while i < len(networks):
-        if i == 0:
-            i += 1
-            continue
-            
-        merged_net = merge_nets(networks[i-1], networks[i])
-        if merged_net is None:
-            i += 1
+    # broadcast_address is a slow property, derive the end from prefixlen
+    spans = sorted(
+        (int(net.network_address), int(net.network_address) + (1 << (32 - net.prefixlen)) - 1, net)
+        for net in networks
+    )
+    
+    results = []
+    start, end, single = spans[0]
+    for span_start, span_end, net in spans[1:]:
+        if span_start <= end + 1:
+            # Overlapping or adjacent: extend the current range, networks
+            # contained in it change nothing
+            if span_end > end:
+                end = span_end
+                single = None
             continue
-            
-        networks[i-1] = merged_net
-        networks.pop(i)
-        if i > 1:
-            i -= 1
+        _append_range(results, start, end, single)
+        start, end, single = span_start, span_end, net
+    _append_range(results, start, end, single)
     
-    return networks
\ No newline at end of file
+    return results
+
+
+def _append_range(results: List[ipaddress.IPv4Network], start: int, end: int,
+                  single: ipaddress.IPv4Network) -> None:
+    """Append the CIDR networks of a coalesced range, reusing an unmerged network."""
+    if single is not None:
+        results.append(single)
+        return
+    results.extend(ipaddress.IPv4Network(cidr) for cidr in range_to_cidrs(start, end))
@@ -0,0 +1,140 @@
+"""
+Compact Network Table Module
+
+This module provides NetTable, an array-backed list of IPv4 networks used
+through the PAC generation pipeline instead of lists of IPv4Network
+objects, which cost hundreds of bytes and a property call per access.
+"""
+
+import hashlib
+import ipaddress
+from array import array
+from typing import Iterable, Iterator, List, Tuple, Union
+
+
+class NetTable:
+    """
+    Parallel arrays of network addresses (uint32) and prefix lengths (uint8).
+    
+    Row i is the network addresses[i]/prefixlens[i]. Iterating a table
+    yields (address, prefixlen) tuples.
+    """
+    
+    __slots__ = ('addresses', 'prefixlens')
+    
+    def __init__(self, addresses: Iterable[int] = (), prefixlens: Iterable[int] = ()):
+        self.addresses = array('I', addresses)
+        self.prefixlens = array('B', prefixlens)
+        if len(self.addresses) != len(self.prefixlens):
+            raise ValueError("addresses and prefixlens must have the same length")
+    
+    @classmethod
+    def from_networks(cls, nets: Iterable[ipaddress.IPv4Network]) -> 'NetTable':
+        """Build a table from IPv4Network objects"""
+        table = cls()
+        for net in nets:
+            table.append(int(net.network_address), net.prefixlen)
+        return table
+    
+    @classmethod
+    def from_ranges(cls, ranges: Iterable[Tuple[int, int]]) -> 'NetTable':
+        """Build the minimal table covering inclusive (start, end) ranges"""
+        table = cls()
+        for start, end in ranges:
+            for address, prefixlen in range_to_cidrs(start, end):
+                table.append(address, prefixlen)
+        return table
+    
+    def to_networks(self) -> List[ipaddress.IPv4Network]:
+        """Convert the table into IPv4Network objects"""
+        return [ipaddress.IPv4Network(row) for row in zip(self.addresses, self.prefixlens)]
+    
+    def append(self, address: int, prefixlen: int) -> None:
+        """Append the network address/prefixlen"""
+        self.addresses.append(address)
+        self.prefixlens.append(prefixlen)
+    
+    def ranges(self) -> List[Tuple[int, int]]:
+        """
+        Convert the table into sorted, disjoint inclusive address ranges.
+        
+        Overlapping and adjacent networks are coalesced.
+        """
+        ranges = []
+        for start, prefixlen in sorted(zip(self.addresses, self.prefixlens)):
+            end = start + (1 << (32 - prefixlen)) - 1
+            if ranges and start <= ranges[-1][1] + 1:
+                if end > ranges[-1][1]:
+                    ranges[-1] = (ranges[-1][0], end)
+            else:
+                ranges.append((start, end))
+        return ranges
+    
+    def digest(self) -> str:
+        """Return a SHA-256 hex digest of the table content"""
+        digest = hashlib.sha256(self.addresses.tobytes())
+        digest.update(self.prefixlens.tobytes())
+        return digest.hexdigest()
+    
+    def __len__(self) -> int:
+        return len(self.addresses)
+    
+    def __iter__(self) -> Iterator[Tuple[int, int]]:
+        return zip(self.addresses, self.prefixlens)
+    
+    def __eq__(self, other) -> bool:
+        if not isinstance(other, NetTable):
+            return NotImplemented
+        return self.addresses == other.addresses and self.prefixlens == other.prefixlens
+    
+    def __repr__(self) -> str:
+        return f"NetTable({len(self)} networks)"
+    
+    def __reduce__(self):
+        # Pickle the raw column bytes, the generic __slots__ state is much slower
+        return (_table_from_bytes, (self.addresses.tobytes(), self.prefixlens.tobytes()))
+
+
+def _table_from_bytes(addresses: bytes, prefixlens: bytes) -> NetTable:
+    """Rebuild a pickled NetTable from its column bytes."""
+    table = NetTable()
+    table.addresses.frombytes(addresses)
+    table.prefixlens.frombytes(prefixlens)
+    return table
+
+
+def iter_nets(nets: Union[NetTable, Iterable[ipaddress.IPv4Network]]) -> Iterator[Tuple[int, int]]:
+    """
+    Iterate (address, prefixlen) tuples of a NetTable or a list of networks.
+    
+    Args:
+        nets: NetTable or iterable of IPv4Network objects
+    
+    Returns:
+        Iterator of (network_address, prefixlen) integer tuples
+    """
+    if isinstance(nets, NetTable):
+        return iter(nets)
+    return ((int(net.network_address), net.prefixlen) for net in nets)
+
+
+def range_to_cidrs(start: int, end: int) -> List[Tuple[int, int]]:
+    """
+    Decompose an inclusive integer address range into a minimal CIDR set.
+    
+    Args:
+        start: First address of the range
+        end: Last address of the range
+    
+    Returns:
+        List of (network_address, prefixlen) tuples covering exactly the range
+    """
+    cidrs = []
+    while start <= end:
+        # Largest block aligned at start that does not run past end
+        size = start & -start if start else 1 << 32
+        while size > end - start + 1:
+            size >>= 1
+        cidrs.append((start, 33 - size.bit_length()))
+        start += size
+    return cidrs
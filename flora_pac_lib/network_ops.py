@@ -6,23 +6,35 @@ for optimizing IP lookup performance in PAC files.
 """
 
 import ipaddress
-from typing import List
+import math
+from collections import Counter
+from typing import Dict, List, Optional, Tuple, Union
 
+from .net_table import NetTable, iter_nets
 
-def fregment_net(net: ipaddress.IPv4Network, mask_step: int = 2) -> List[ipaddress.IPv4Network]:
+Nets = Union[List[ipaddress.IPv4Network], NetTable]
+
+
+def fregment_net(net: ipaddress.IPv4Network, mask_step: int = 2,
+                 prefix_lengths: Optional[List[int]] = None) -> List[ipaddress.IPv4Network]:
     """
     Fragment a network into subnets aligned to mask_step boundaries.
     
     Args:
         net: Network to fragment
         mask_step: Step size for mask alignment (default: 2)
+        prefix_lengths: Explicit target prefix lengths, e.g. from
+            plan_prefix_lengths; overrides mask_step when given
         
     Returns:
         List of fragmented networks
+        
+    Raises:
+        ValueError: If no target prefix length is >= net.prefixlen
     """
-    # Calculate the target prefix length using integer division
-    # This finds the smallest multiple of MASK_STEP that is >= net.prefixlen
-    target_prefixlen = (net.prefixlen - 1) // mask_step * mask_step + mask_step
+    target_prefixlen = _target_prefixlen(net.prefixlen, mask_step, prefix_lengths)
+    if target_prefixlen is None:
+        raise ValueError(f"No target prefix length for {net} in {sorted(prefix_lengths)}")
     
     try:
         # Fragment the network into subnets with target prefix length
@@ -34,23 +46,133 @@ def fregment_net(net: ipaddress.IPv4Network, mask_step: int = 2) -> List[ipaddre
         return [net]
 
 
-def fregment_nets(nets: List[ipaddress.IPv4Network], mask_step: int = 2) -> List[ipaddress.IPv4Network]:
+def _target_prefixlen(prefixlen: int, mask_step: int,
+                      prefix_lengths: Optional[List[int]]) -> Optional[int]:
+    """Return the prefix length a /prefixlen network is fragmented to, None if there is none."""
+    if prefix_lengths:
+        # The smallest target length that can hold the network
+        return min((length for length in prefix_lengths if length >= prefixlen), default=None)
+    # Calculate the target prefix length using integer division
+    # This finds the smallest multiple of MASK_STEP that is >= prefixlen
+    return (prefixlen - 1) // mask_step * mask_step + mask_step
+
+
+def fregment_nets(nets: Nets, mask_step: int = 2,
+                  prefix_lengths: Optional[List[int]] = None) -> Nets:
     """
     Fragment multiple networks into subnets aligned to mask_step boundaries.
     
     Args:
-        nets: List of networks to fragment
+        nets: List of networks (or NetTable) to fragment
         mask_step: Step size for mask alignment (default: 2)
+        prefix_lengths: Explicit target prefix lengths, overriding mask_step
         
     Returns:
-        List of all fragmented networks
+        List of all fragmented networks, a NetTable for a NetTable input
+        
+    Raises:
+        ValueError: If no target prefix length is >= a network's prefixlen
     """
+    if isinstance(nets, NetTable):
+        results = NetTable()
+        for address, prefixlen in nets:
+            target = _target_prefixlen(prefixlen, mask_step, prefix_lengths)
+            if target is None:
+                raise ValueError(f"No target prefix length for "
+                                 f"{ipaddress.IPv4Address(address)}/{prefixlen} in {sorted(prefix_lengths)}")
+            if target > 32:
+                # Same fallback as fregment_net: keep the original network
+                print(f"Warning: Could not fragment network {ipaddress.IPv4Address(address)}/{prefixlen}")
+                results.append(address, prefixlen)
+                continue
+            size = 1 << (32 - target)
+            for subnet in range(address, address + (1 << (32 - prefixlen)), size):
+                results.append(subnet, target)
+        return results
+    
     results = []
     for net in nets:
-        results.extend(fregment_net(net, mask_step))
+        results.extend(fregment_net(net, mask_step, prefix_lengths))
     return results
 
 
+def prefixlen_histogram(nets: Nets) -> Dict[int, int]:
+    """
+    Count networks per prefix length.
+    
+    Args:
+        nets: List of networks, or NetTable
+        
+    Returns:
+        Dict mapping each prefix length to its number of networks
+    """
+    if isinstance(nets, NetTable):
+        return dict(sorted(Counter(nets.prefixlens).items()))
+    histogram = {}
+    for net in nets:
+        histogram[net.prefixlen] = histogram.get(net.prefixlen, 0) + 1
+    return dict(sorted(histogram.items()))
+
+
+def plan_prefix_lengths(histogram: Dict[int, int], max_probes: Optional[int] = None,
+                        max_entries: Optional[int] = None) -> List[int]:
+    """
+    Choose the target prefix lengths for controlled prefix expansion.
+    
+    Every network is expanded to the smallest chosen length >= its own, a
+    /p network expanded to /t becoming 2 ** (t - p) entries. For every number
+    of probes, dynamic programming finds the target set with the fewest
+    expanded entries. Without a budget the plan minimising entries x probes
+    is returned; with max_entries the plan with the fewest probes that fits
+    it; with only max_probes the smallest plan using at most that many probes.
+    
+    Args:
+        histogram: Networks per prefix length, see prefixlen_histogram
+        max_probes: Maximum number of target lengths
+        max_entries: Maximum number of expanded entries
+        
+    Returns:
+        Sorted list of target prefix lengths
+        
+    Raises:
+        ValueError: If no plan fits the budget
+    """
+    lengths = sorted(length for length, count in histogram.items() if count)
+    if not lengths:
+        return []
+    
+    def expansion(first: int, target: int) -> int:
+        # Entries for lengths[first..target] all expanded to lengths[target]
+        return sum(histogram[lengths[i]] << (lengths[target] - lengths[i])
+                   for i in range(first, target + 1))
+    
+    # best[j] is (entries, plan) covering lengths[0..j] with the current
+    # number of probes, the last probe being lengths[j]
+    best = [(expansion(0, j), [lengths[j]]) for j in range(len(lengths))]
+    plans = [best[-1]]
+    for _ in range(1, len(lengths)):
+        best = [(math.inf, [])] + [
+            min(((best[i][0] + expansion(i + 1, j), best[i][1] + [lengths[j]])
+                 for i in range(j)), key=lambda plan: plan[0])
+            for j in range(1, len(lengths))
+        ]
+        plans.append(best[-1])
+    
+    # plans[k] uses k + 1 probes
+    candidates = [(entries, plan) for entries, plan in plans
+                  if (max_probes is None or len(plan) <= max_probes)
+                  and (max_entries is None or entries <= max_entries)]
+    if not candidates:
+        raise ValueError("No prefix length plan fits max_probes=%s, max_entries=%s"
+                         % (max_probes, max_entries))
+    
+    if max_entries is not None:
+        return min(candidates, key=lambda candidate: len(candidate[1]))[1]
+    if max_probes is not None:
+        return min(candidates, key=lambda candidate: candidate[0])[1]
+    return min(candidates, key=lambda candidate: candidate[0] * len(candidate[1]))[1]
+
+
 def hash_address(address: ipaddress.IPv4Address, mod_base: int) -> int:
     """
     Hash an IP address using modulo operation.
@@ -65,17 +187,41 @@ def hash_address(address: ipaddress.IPv4Address, mod_base: int) -> int:
     return int(address) % mod_base
 
 
-def hash_nets(nets: List[ipaddress.IPv4Network], mod_base: int) -> List[List[ipaddress.IPv4Network]]:
+def hash_multipliers(mod_base: int) -> List[int]:
+    """
+    Precompute the per-prefix-length multipliers used by the PAC hash.
+    
+    The network address of an IP masked to prefixlen is
+    (ip >> (32 - prefixlen)) * 2 ** (32 - prefixlen), so its hash_address
+    equals ((ip >> (32 - prefixlen)) % mod_base) * multipliers[prefixlen] % mod_base.
+    
+    Args:
+        mod_base: Modulo base for hashing
+        
+    Returns:
+        List of 33 multipliers, indexed by prefix length
+    """
+    return [pow(2, 32 - prefixlen, mod_base) for prefixlen in range(33)]
+
+
+def hash_nets(nets: Nets, mod_base: int) -> List[Nets]:
     """
     Distribute networks into hash buckets based on their network address.
     
     Args:
-        nets: List of networks to hash
+        nets: List of networks (or NetTable) to hash
         mod_base: Number of hash buckets
         
     Returns:
-        List of buckets, each containing networks that hash to that bucket
+        List of buckets, each containing networks that hash to that bucket.
+        The buckets are NetTables for a NetTable input.
     """
+    if isinstance(nets, NetTable):
+        hashed = [NetTable() for _ in range(mod_base)]
+        for address, prefixlen in nets:
+            hashed[address % mod_base].append(address, prefixlen)
+        return hashed
+    
     hashed = [[] for _ in range(mod_base)]
     
     for net in nets:
@@ -85,20 +231,170 @@ def hash_nets(nets: List[ipaddress.IPv4Network], mod_base: int) -> List[List[ipa
     return hashed
 
 
-def calculate_prefix_range(networks: List[ipaddress.IPv4Network]) -> tuple:
+def group_by_prefixlen(nets: Nets) -> Dict[int, List[int]]:
+    """
+    Group networks by prefix length, keyed for exact-match lookups.
+    
+    Args:
+        nets: List of networks (or NetTable), usually the output of fregment_nets
+        
+    Returns:
+        Dict mapping each prefix length to the sorted network addresses of
+        that length, shifted right by (32 - prefixlen)
+    """
+    grouped = {}
+    for address, prefixlen in iter_nets(nets):
+        grouped.setdefault(prefixlen, set()).add(address >> (32 - prefixlen))
+    return {prefixlen: sorted(keys) for prefixlen, keys in sorted(grouped.items())}
+
+
+def perfect_hash_mix(key: int, seed: int) -> int:
+    """
+    Seeded 32-bit hash used by the minimal perfect hash tables.
+    
+    This is the murmur3 finalizer applied to key ^ (seed * 0x9E3779B9),
+    using only 32-bit multiplications so the PAC can compute it exactly.
+    
+    Args:
+        key: 32-bit key
+        seed: Displacement seed
+        
+    Returns:
+        Hash value (0 <= result < 2 ** 32)
+    """
+    h = (key ^ (seed * 0x9E3779B9)) & 0xFFFFFFFF
+    h ^= h >> 16
+    h = (h * 0x85EBCA6B) & 0xFFFFFFFF
+    h ^= h >> 13
+    h = (h * 0xC2B2AE35) & 0xFFFFFFFF
+    h ^= h >> 16
+    return h
+
+
+def build_perfect_hash(keys: List[int], bucket_size: int = 3) -> Tuple[List[int], List[int]]:
+    """
+    Build a CHD style minimal perfect hash over distinct 32-bit keys.
+    
+    A key is first assigned to bucket perfect_hash_mix(key, 0) % len(displacements).
+    A bucket's displacement d > 0 places its keys at perfect_hash_mix(key, d) % n,
+    d < 0 places its single key directly at slot -d - 1.
+    
+    Args:
+        keys: Distinct keys to hash
+        bucket_size: Average number of keys per displacement bucket
+        
+    Returns:
+        Tuple of (displacements, slot_keys) where slot_keys[slot] is the key
+        stored at each of the n slots
+    """
+    n = len(keys)
+    buckets = [[] for _ in range(max(1, math.ceil(n / bucket_size)))]
+    for key in keys:
+        buckets[perfect_hash_mix(key, 0) % len(buckets)].append(key)
+    
+    displacements = [0] * len(buckets)
+    slot_keys = [None] * n
+    
+    # Place the largest buckets first while most slots are still free
+    order = sorted(range(len(buckets)), key=lambda b: len(buckets[b]), reverse=True)
+    for index in order:
+        bucket = buckets[index]
+        if len(bucket) < 2:
+            break
+        seed = 1
+        while True:
+            slots = {perfect_hash_mix(key, seed) % n for key in bucket}
+            if len(slots) == len(bucket) and all(slot_keys[slot] is None for slot in slots):
+                break
+            seed += 1
+        for key in bucket:
+            slot_keys[perfect_hash_mix(key, seed) % n] = key
+        displacements[index] = seed
+    
+    # Single key buckets take the remaining free slots directly
+    free_slots = (slot for slot in range(n) if slot_keys[slot] is None)
+    for index in order:
+        if len(buckets[index]) == 1:
+            slot = next(free_slots)
+            slot_keys[slot] = buckets[index][0]
+            displacements[index] = -slot - 1
+    
+    return displacements, slot_keys
+
+
+def calculate_prefix_range(networks: Nets) -> tuple:
     """
     Calculate the minimum and maximum prefix lengths in a network list.
     
     Args:
-        networks: List of networks
+        networks: List of networks, or NetTable
         
     Returns:
         Tuple of (min_prefixlen, max_prefixlen)
     """
     if not networks:
         return (32, 0)
+    if isinstance(networks, NetTable):
+        return (min(networks.prefixlens), max(networks.prefixlens))
     
     min_prefixlen = min(net.prefixlen for net in networks)
     max_prefixlen = max(net.prefixlen for net in networks)
     
-    return (min_prefixlen, max_prefixlen)
\ No newline at end of file
+    return (min_prefixlen, max_prefixlen)
+
+
+def net_ranges(nets: Nets) -> List[Tuple[int, int]]:
+    """
+    Convert networks into sorted, disjoint integer address ranges.
+    
+    Overlapping and adjacent networks are coalesced, so the result is the
+    smallest list of ranges covering the same addresses.
+    
+    Args:
+        nets: List of networks, or NetTable
+        
+    Returns:
+        Sorted list of inclusive (first_address, last_address) tuples
+    """
+    if isinstance(nets, NetTable):
+        return nets.ranges()
+    ranges = []
+    spans = sorted((int(net.network_address), 1 << (32 - net.prefixlen)) for net in nets)
+    for start, size in spans:
+        end = start + size - 1
+        if ranges and start <= ranges[-1][1] + 1:
+            if end > ranges[-1][1]:
+                ranges[-1] = (ranges[-1][0], end)
+        else:
+            ranges.append((start, end))
+    return ranges
+
+
+def block_map(ranges: List[Tuple[int, int]]) -> Tuple[str, Dict[int, List[Tuple[int, int]]]]:
+    """
+    Classify every /16 block of the address space against a range list.
+    
+    Args:
+        ranges: Sorted, disjoint inclusive ranges, as returned by net_ranges
+        
+    Returns:
+        Tuple of (status, mixed_blocks). status has one character per /16
+        block: '0' when no address is covered, '1' when the whole block is
+        covered, '2' when it is only partially covered. mixed_blocks maps the
+        index of every partially covered block to its covered ranges, as
+        inclusive offsets within the block.
+    """
+    status = bytearray(b'0' * 65536)
+    mixed_blocks = {}
+    
+    for start, end in ranges:
+        for block in range(start >> 16, (end >> 16) + 1):
+            first = max(start, block << 16) & 0xFFFF
+            last = min(end, (block << 16) | 0xFFFF) & 0xFFFF
+            if first == 0 and last == 0xFFFF:
+                status[block] = ord('1')
+            else:
+                status[block] = ord('2')
+                mixed_blocks.setdefault(block, []).append((first, last))
+    
+    return status.decode('ascii'), mixed_blocks
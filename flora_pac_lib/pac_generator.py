@@ -5,11 +5,27 @@ This module handles the generation of Proxy Auto-Config (PAC) files
 with embedded JavaScript for IP lookup and proxy balancing.
 """
 
+import io
 import ipaddress
-from typing import List
+import math
+import os
+import re
+from typing import IO, Dict, Iterable, Iterator, List, NamedTuple, Optional, Tuple, Union
 
-from .ip_data import fetch_ip_data, merge_all
-from .network_ops import fregment_nets, hash_nets, calculate_prefix_range
+from .cache import DEFAULT_CACHE_TTL
+from .ip_data import RIR_URLS, fetch_ip_data, fetch_registries, merge_all
+from .net_table import NetTable, iter_nets
+from .snapshot import load_snapshot, write_snapshot
+from .sources import is_snapshot_source, read_source
+from .stage_cache import StageCache, nets_digest
+from .network_ops import (
+    fregment_nets, hash_nets, hash_multipliers, calculate_prefix_range, net_ranges,
+    block_map, group_by_prefixlen, build_perfect_hash, prefixlen_histogram, plan_prefix_lengths
+)
+
+
+# Lookup engines that can be embedded into the PAC file
+ENGINES = ('hash', 'bsearch', 'bitmap', 'dict', 'mph')
 
 
 def generate_balanced_proxy(proxies: List[str], balance: str) -> str:
@@ -105,7 +121,22 @@ def generate_no_proxy(no_proxy: List[str]) -> str:
 
 def generate_pac(proxies: List[str], balance: str, no_proxy: List[str], 
                 hash_base: int = 3011, mask_step: int = 2, 
-                output_file: str = 'flora_pac.pac') -> None:
+                output_file: str = 'flora_pac.pac',
+                hoist_tables: bool = False, integer_match: bool = False,
+                engine: str = 'hash',
+                prefix_lengths: Optional[Union[str, List[int]]] = None,
+                max_probes: Optional[int] = None,
+                max_entries: Optional[int] = None,
+                cache_dir: Optional[str] = None,
+                cache_ttl: float = DEFAULT_CACHE_TTL,
+                offline: bool = False,
+                snapshot: Optional[str] = None,
+                save_snapshot: Optional[str] = None,
+                registries: Optional[List[str]] = None,
+                source: Optional[str] = None,
+                countries: Optional[List[str]] = None,
+                delta_cache: Optional[str] = None,
+                stage_cache: Optional[StageCache] = None) -> None:
     """
     Generate complete PAC file with embedded JavaScript and hash tables.
     
@@ -116,71 +147,367 @@ def generate_pac(proxies: List[str], balance: str, no_proxy: List[str],
         hash_base: Hash table size for performance tuning
         mask_step: Network fragmentation step size
         output_file: Output PAC filename
+        hoist_tables: Build the lookup table once per PAC load instead of
+            once per FindProxyForURL call
+        integer_match: Match candidates with integer comparisons instead of
+            rebuilding strings for isInNet
+        engine: Lookup engine, one of ENGINES ('hash' by default)
+        prefix_lengths: Target prefix lengths to fragment to instead of
+            multiples of mask_step, or 'auto' to plan them with
+            plan_prefix_lengths
+        max_probes: Probe budget for the 'auto' plan
+        max_entries: Table size budget for the 'auto' plan
+        cache_dir: Directory caching the APNIC file, None to always download
+        cache_ttl: Seconds a cached APNIC file is used without revalidation
+        offline: Only use the cached APNIC file
+        snapshot: Binary range snapshot to start from instead of the APNIC file
+        save_snapshot: Write the merged ranges to this binary snapshot file,
+            also when they were loaded from snapshot
+        registries: Names of the RIR_URLS registries to fetch concurrently
+            instead of APNIC only
+        source: Local delegated file (plain, gzip or xz), '-' for stdin or a
+            directory whose newest file is used, instead of downloading
+        countries: ISO 3166 codes of the countries routed directly
+            (default: ['cn']), all parsed in a single pass over the data
+        delta_cache: File keeping the hash engine tables between runs; only
+            the buckets touched by the networks changed since the previous
+            run are re-emitted (hash engine only)
+        stage_cache: StageCache reusing the merge, fragment, hash and lookup
+            table stages computed for the same data and parameters, so a
+            proxy change only renders the template. Without one the lookup
+            tables are streamed to output_file piece by piece
+    
+    Raises:
+        ValueError: If the engine is unknown, delta_cache is combined with
+            another engine than 'hash', or countries or registries with a
+            binary range snapshot
     """
-    # Fetch and process IP data
-    print("Processing IP data...")
-    results = merge_all(fetch_ip_data())
+    if engine not in ENGINES:
+        raise ValueError(f"Unknown lookup engine: {engine}")
+    if delta_cache is not None and engine != 'hash':
+        raise ValueError("--delta-cache requires the hash engine")
     
-    # Calculate prefix length range
-    min_prefixlen, max_prefixlen = calculate_prefix_range(results)
-    print("PrefixLen: [%d, %d]" % (min_prefixlen, max_prefixlen))
+    # Fetch and process IP data, kept in a compact NetTable all the way
+    if snapshot is None:
+        print("Processing IP data...")
+    results, digest, header = _load_networks(cache_dir, cache_ttl, offline, snapshot,
+                                             registries, source, countries, stage_cache)
+    if snapshot is not None:
+        print(f"Loaded {len(results)} networks from {snapshot} "
+              f"(source date {header['enddate']})")
+    if save_snapshot is not None:
+        write_snapshot(save_snapshot, net_ranges(results),
+                       header.get('enddate', ''), header.get('serial', 0))
+        print(f"Saved snapshot to {save_snapshot}")
     
-    # Fragment and hash networks
-    print("Fragmenting and hashing networks...")
-    hashed_results = hash_nets(fregment_nets(results, mask_step), hash_base)
+    if prefix_lengths == 'auto':
+        prefix_lengths = plan_prefix_lengths(prefixlen_histogram(results), max_probes, max_entries)
+        print("Planned prefix lengths: %s" % ', '.join(map(str, prefix_lengths)))
     
-    # Generate PAC file content
-    pac_content = _generate_pac_content(
-        hashed_results, proxies, balance, no_proxy,
-        hash_base, mask_step, min_prefixlen, max_prefixlen, results
-    )
+    if delta_cache is not None:
+        _generate_from_delta_cache(delta_cache, results, proxies, balance, no_proxy, hash_base,
+                                   mask_step, prefix_lengths, hoist_tables, integer_match,
+                                   output_file)
+        return
     
-    # Write PAC file
-    with open(output_file, 'w') as rfile:
-        rfile.write(pac_content)
+    # Fragment and hash networks, only the proxy logic depends on the proxies
+    if engine == 'hash':
+        print("Fragmenting and hashing networks...")
+    tables = _build_lookup_tables(results, digest, stage_cache, engine, hash_base, mask_step,
+                                  prefix_lengths, integer_match)
+    if engine == 'hash':
+        print("PrefixLen: [%d, %d]" % (tables.min_prefixlen, tables.max_prefixlen))
+    tail = _pac_tail(proxies, balance, no_proxy, hoist_tables)
+    
+    # Write PAC file, never holding more of it than the cached prefix
+    with open(output_file, 'wb') as rfile:
+        if tables.lookup_code is None:
+            # Not cached, stream the tables piece by piece
+            lookup_chunks = _iter_lookup_code(
+                tables.hashed_results, hash_base, mask_step, tables.min_prefixlen,
+                tables.max_prefixlen, results, integer_match=integer_match, engine=engine,
+                prefix_lengths=prefix_lengths, fragmented=tables.fragmented
+            )
+            pac_size = write_pac(rfile, _iter_pac_prefix(tables.lookup_vars, lookup_chunks,
+                                                         hoist_tables))
+        else:
+            # Cached, the prefix is kept encoded
+            prefix = _build_pac_prefix(tables, digest, stage_cache, engine, hash_base, mask_step,
+                                       prefix_lengths, integer_match, hoist_tables)
+            rfile.write(prefix)
+            pac_size = len(prefix)
+        pac_size += write_pac(rfile, (tail,))
     
     # Print statistics
-    _print_generation_stats(hashed_results, results, min_prefixlen, max_prefixlen, mask_step, output_file)
+    if engine == 'hash':
+        _print_generation_stats(tables.hashed_results, results, tables.min_prefixlen,
+                                tables.max_prefixlen, mask_step, output_file)
+    elif engine == 'bsearch':
+        _print_bsearch_stats(net_ranges(results), results, output_file)
+    elif engine == 'bitmap':
+        _print_bitmap_stats(block_map(net_ranges(results)), results, output_file)
+    elif engine == 'dict':
+        _print_dict_stats(_build_dict_stats(tables, digest, stage_cache, hash_base,
+                                            mask_step, prefix_lengths),
+                          results, hash_base, output_file)
+    else:
+        _print_mph_stats(tables.fragmented, pac_size, results, output_file)
 
 
-def _generate_pac_content(hashed_results: List[List[ipaddress.IPv4Network]], 
-                         proxies: List[str], balance: str, no_proxy: List[str],
-                         hash_base: int, mask_step: int, 
-                         min_prefixlen: int, max_prefixlen: int,
-                         results: List[ipaddress.IPv4Network]) -> str:
+class _LookupTables(NamedTuple):
     """
-    Generate the complete PAC file content as a string.
+    The proxy independent part of a PAC file, see _build_lookup_tables.
+    
+    lookup_code is None when the tables are left to be streamed by
+    _iter_lookup_code, from hashed_results, fragmented or the merged
+    networks.
+    """
+    lookup_vars: str
+    lookup_code: Optional[str]
+    fragmented: Optional[NetTable] = None
+    hashed_results: Optional[List[NetTable]] = None
+    min_prefixlen: int = 0
+    max_prefixlen: int = 0
+
+
+def _load_networks(cache_dir: Optional[str] = None,
+                   cache_ttl: float = DEFAULT_CACHE_TTL,
+                   offline: bool = False,
+                   snapshot: Optional[str] = None,
+                   registries: Optional[List[str]] = None,
+                   source: Optional[str] = None,
+                   countries: Optional[List[str]] = None,
+                   stage_cache: Optional[StageCache] = None) -> Tuple[NetTable, str, dict]:
+    """
+    Load and merge the networks routed directly, see generate_pac for the arguments.
     
     Returns:
-        Complete PAC file content
+        Tuple of (merged NetTable, digest of the loaded data, header dict
+        with the 'enddate' and 'serial' of the source)
+    
+    Raises:
+        ValueError: If a registry is unknown, or countries or registries are
+            combined with a binary range snapshot
+    """
+    for name in registries or []:
+        if name not in RIR_URLS:
+            raise ValueError(f"Unknown registry: {name}")
+    if (countries or registries) and (
+            snapshot is not None or (source is not None and is_snapshot_source(source))):
+        # Snapshots hold already merged ranges, without countries or registries
+        raise ValueError("--countries and --registries cannot be used with a binary range snapshot")
+    if snapshot is not None:
+        loaded = load_snapshot(snapshot)
+        # Snapshot ranges are already merged
+        results = NetTable.from_ranges(loaded.ranges())
+        return results, nets_digest(results), {'enddate': loaded.source_date,
+                                               'serial': loaded.serial}
+    
+    country = countries or 'cn'
+    if source is not None:
+        header = {}
+        fetched = read_source(source, country, header, as_table=True)
+    elif registries:
+        headers = {}
+        fetched = fetch_registries({name: RIR_URLS[name] for name in registries}, country,
+                                   cache_dir, cache_ttl, offline, headers, as_table=True)
+        # The header of the newest registry file
+        header = max(headers.values(), key=lambda h: h.get('enddate', ''), default={})
+    else:
+        header = {}
+        fetched = fetch_ip_data(cache_dir, cache_ttl, offline, header,
+                                as_table=True, country=country)
+    
+    digest = nets_digest(fetched)
+    if registries and source is None:
+        # fetch_registries already merges the registries
+        results = fetched
+    elif stage_cache is None:
+        results = merge_all(fetched)
+    else:
+        results = stage_cache.get('merge', digest, (), lambda: merge_all(fetched))
+    return results, digest, header
+
+
+def _build_lookup_tables(results: NetTable, digest: str, stage_cache: Optional[StageCache],
+                         engine: str = 'hash', hash_base: int = 3011, mask_step: int = 2,
+                         prefix_lengths: Optional[List[int]] = None,
+                         integer_match: bool = False) -> _LookupTables:
+    """
+    Build the lookup code of an engine, reusing the stages cached for digest.
+    
+    Args:
+        results: Merged networks
+        digest: Digest of the data results were merged from
+        stage_cache: Cache of the fragment, hash and tables stages, None to
+            compute the intermediate tables and leave the lookup code to
+            _iter_lookup_code
+        engine: Lookup engine, one of ENGINES
+        hash_base: Hash table size (hash engine)
+        mask_step: Network fragmentation step size
+        prefix_lengths: Explicit target prefix lengths, see fregment_nets
+        integer_match: Match candidates with integer comparisons (hash engine)
+    
+    Returns:
+        _LookupTables, with the fragments of the hash, dict and mph engines
+        and the hashed fragments of the hash engine
+    
+    Raises:
+        ValueError: If the engine is unknown
+    """
+    if engine not in ENGINES:
+        raise ValueError(f"Unknown lookup engine: {engine}")
+    
+    if stage_cache is None:
+        if engine in ('bsearch', 'bitmap'):
+            return _LookupTables(_lookup_vars(engine), None)
+        fragmented = fregment_nets(results, mask_step, prefix_lengths)
+        if engine != 'hash':
+            return _LookupTables(_lookup_vars(engine), None, fragmented)
+        min_prefixlen, max_prefixlen = calculate_prefix_range(fragmented)
+        return _LookupTables(_lookup_vars(engine), None, fragmented,
+                             hash_nets(fragmented, hash_base), min_prefixlen, max_prefixlen)
+    
+    if engine in ('bsearch', 'bitmap'):
+        lookup_vars, lookup_code = stage_cache.get(
+            'tables', digest, (engine, mask_step, prefix_lengths),
+            lambda: _generate_lookup_code(None, hash_base, mask_step, 0, 0, results,
+                                          engine=engine)
+        )
+        return _LookupTables(lookup_vars, lookup_code)
+    
+    fragmented = stage_cache.get('fragment', digest, (mask_step, prefix_lengths),
+                                 lambda: fregment_nets(results, mask_step, prefix_lengths))
+    if engine != 'hash':
+        lookup_vars, lookup_code = stage_cache.get(
+            'tables', digest, (engine, mask_step, prefix_lengths),
+            lambda: _generate_lookup_code(None, hash_base, mask_step, 0, 0, results,
+                                          engine=engine, fragmented=fragmented)
+        )
+        return _LookupTables(lookup_vars, lookup_code, fragmented)
+    
+    min_prefixlen, max_prefixlen = calculate_prefix_range(fragmented)
+    hashed_results = stage_cache.get('hash', digest, (mask_step, prefix_lengths, hash_base),
+                                     lambda: hash_nets(fragmented, hash_base))
+    lookup_vars, lookup_code = stage_cache.get(
+        'tables', digest, (engine, mask_step, prefix_lengths, hash_base, integer_match),
+        lambda: _generate_lookup_code(hashed_results, hash_base, mask_step,
+                                      min_prefixlen, max_prefixlen, results,
+                                      integer_match=integer_match)
+    )
+    return _LookupTables(lookup_vars, lookup_code, fragmented, hashed_results,
+                         min_prefixlen, max_prefixlen)
+
+
+def _build_pac_prefix(tables: _LookupTables, digest: str, stage_cache: Optional[StageCache],
+                      engine: str = 'hash', hash_base: int = 3011, mask_step: int = 2,
+                      prefix_lengths: Optional[List[int]] = None,
+                      integer_match: bool = False, hoist_tables: bool = False) -> bytes:
     """
-    # PAC file header and JavaScript functions
-    pac_content = '''
+    Render the proxy independent beginning of the PAC file once.
+    
+    A complete PAC file is this prefix followed by _pac_tail, so files for
+    other proxies only cost rendering the tail and a copy.
+    
+    Args:
+        tables: Lookup tables built by _build_lookup_tables with the same
+            arguments
+        digest: Digest of the data the tables were built from
+        stage_cache: Cache keeping the prefix, None to always render it
+        engine, hash_base, mask_step, prefix_lengths, integer_match:
+            Parameters the tables were built with
+        hoist_tables: PAC layout, see _generate_pac_content
+    
+    Returns:
+        UTF-8 encoded prefix
+    """
+    def render() -> bytes:
+        return ''.join(_iter_pac_prefix(tables.lookup_vars, (tables.lookup_code,),
+                                        hoist_tables)).encode('utf-8')
+    
+    if stage_cache is None:
+        return render()
+    params = (engine, mask_step, prefix_lengths, hash_base, integer_match, hoist_tables)
+    return stage_cache.get('prefix', digest, params, render)
+
+
+def _generate_from_delta_cache(delta_cache: str, results: List[ipaddress.IPv4Network],
+                               proxies: List[str], balance: str, no_proxy: List[str],
+                               hash_base: int, mask_step: int,
+                               prefix_lengths: Optional[List[int]],
+                               hoist_tables: bool, integer_match: bool,
+                               output_file: str) -> None:
+    """Write the hash engine PAC file, updating the tables cached in delta_cache."""
+    # delta builds on this module, import it when needed
+    from .delta import HashTableCache
+    
+    if not isinstance(results, NetTable):
+        results = NetTable.from_networks(results)
+    
+    cache = HashTableCache.load(delta_cache) if os.path.exists(delta_cache) else None
+    if cache is not None and cache.matches(hash_base, mask_step, prefix_lengths):
+        print(cache.update(results))
+    else:
+        print("Building hash tables for %s..." % delta_cache)
+        cache = HashTableCache(results, hash_base, mask_step, prefix_lengths)
+    
+    with open(output_file, 'wb') as rfile:
+        write_pac(rfile, cache.iter_chunks(proxies, balance, no_proxy, hoist_tables,
+                                           integer_match))
+    cache.save(delta_cache)
+    
+    print("Rules: %d items." % len(results))
+    print("Usage: Use the newly created %s as your web browser's automatic" % output_file)
+    print("PAC(Proxy auto-config) file.")
+
+
+_PAC_HEADER = '''
 // Flora_Pac by @leaskh
 // www.leaskh.com, i@leaskh.com
 // Optimized by @yaleh
-   
-function FindProxyForURL(url, host) {
-  var HASH_BASE, MASK_STEP, a, dot2num, hash_masked_ip, hashed_nets, i, lookup_ip, max_prefixlen, min_prefixlen, num2dot, prefixlen2mask, rebuild_net, _i, _j, _len, _len1;
+'''
+
+_LOOKUP_VARS = ("HASH_BASE, HASH_MULT, MASK_STEP, PREFIX_LENS, a, dot2num, hash_masked_ip, hashed_nets, i, lookup_ip, "
+                "max_prefixlen, min_prefixlen, num2dot, prefixlen2mask, rebuild_net, _i, _j, _len, _len1")
+
+_BSEARCH_VARS = "dot2num, lookup_ip, range_ends, range_starts"
+
+_BITMAP_VARS = "block_map, block_ranges, dot2num, lookup_ip"
+
+_DICT_VARS = "dot2num, lookup_ip, prefix_tables"
+
+_MPH_VARS = "dot2num, lookup_ip, mph_mix, mph_tables, mul32"
 
+_ENGINE_VARS = {
+    'hash': _LOOKUP_VARS,
+    'bsearch': _BSEARCH_VARS,
+    'bitmap': _BITMAP_VARS,
+    'dict': _DICT_VARS,
+    'mph': _MPH_VARS,
+}
+
+# Indentation of the lookup code inside FindProxyForURL, removed when hoisted
+_LOOKUP_INDENT = '  '
+_INDENT_RE = re.compile('^' + _LOOKUP_INDENT, re.MULTILINE)
+_WHITESPACE_LINE_RE = re.compile(r'^[ \t]+$', re.MULTILINE)
+
+_DOT2NUM = '''
   dot2num = function(dot) {
     var d;
     d = dot.split(".");
     return ((((((+d[0]) * 256) + (+d[1])) * 256) + (+d[2])) * 256) + (+d[3]);
   };
+'''
 
-  num2dot = function(ip) {
-    return [ip >>> 24, ip >>> 16 & 0xFF, ip >>> 8 & 0xFF, ip & 0xFF].join(".");
+_HASH_FUNCTIONS = '''
+  hash_masked_ip = function(ip, mask_len) {
+    return (ip >>> (32 - mask_len)) % HASH_BASE * HASH_MULT[mask_len] % HASH_BASE;
   };
+'''
 
-  hash_masked_ip = function(ip, mask_len, mod_base) {
-    var i, net, offset, _i;
-    offset = 32 - mask_len;
-    net = ip >>> offset;
-    for (i = _i = 0; 0 <= offset ? _i < offset : _i > offset; i = 0 <= offset ? ++_i : --_i) {
-      net *= 2;
-    }
-    return net % mod_base;
+_IS_IN_NET_LOOKUP = '''
+  num2dot = function(ip) {
+    return [ip >>> 24, ip >>> 16 & 0xFF, ip >>> 8 & 0xFF, ip & 0xFF].join(".");
   };
 
   prefixlen2mask = function(prefixlen) {
@@ -198,11 +525,11 @@ function FindProxyForURL(url, host) {
   };
 
   lookup_ip = function(ip) {
-    var i, k, len, n, n_ip, _i, _len, _ref;
-    len = min_prefixlen;
+    var i, k, len, n, n_ip, _i, _j, _len, _len1, _ref;
     n_ip = dot2num(ip);
-    while (len <= max_prefixlen) {
-      k = hash_masked_ip(n_ip, len, HASH_BASE);
+    for (_j = 0, _len1 = PREFIX_LENS.length; _j < _len1; _j++) {
+      len = PREFIX_LENS[_j];
+      k = hash_masked_ip(n_ip, len);
       _ref = hashed_nets[k];
       for (_i = 0, _len = _ref.length; _i < _len; _i++) {
         i = _ref[_i];
@@ -211,64 +538,534 @@ function FindProxyForURL(url, host) {
           return true;
         }
       }
-      len += MASK_STEP;
     }
     return false;
   };
 '''
+
+# Candidates are stored as [network >> (32 - prefixlen), prefixlen], so the
+# shifted address can be compared with the stored integer directly
+_INTEGER_LOOKUP = '''
+  lookup_ip = function(ip) {
+    var i, k, len, n_ip, _i, _j, _len, _len1, _ref;
+    n_ip = dot2num(ip);
+    for (_j = 0, _len1 = PREFIX_LENS.length; _j < _len1; _j++) {
+      len = PREFIX_LENS[_j];
+      k = hash_masked_ip(n_ip, len);
+      _ref = hashed_nets[k];
+      for (_i = 0, _len = _ref.length; _i < _len; _i++) {
+        i = _ref[_i];
+        if ((n_ip >>> (32 - i[1])) === i[0]) {
+          return true;
+        }
+      }
+    }
+    return false;
+  };
+'''
+
+# range_starts/range_ends hold sorted, disjoint inclusive address ranges
+_BSEARCH_LOOKUP = '''
+  lookup_ip = function(ip) {
+    var hi, lo, mid, n_ip;
+    n_ip = dot2num(ip);
+    lo = 0;
+    hi = range_starts.length - 1;
+    while (lo <= hi) {
+      mid = (lo + hi) >>> 1;
+      if (n_ip < range_starts[mid]) {
+        hi = mid - 1;
+      } else if (n_ip > range_ends[mid]) {
+        lo = mid + 1;
+      } else {
+        return true;
+      }
+    }
+    return false;
+  };
+'''
+
+# block_map has one character per /16 block: '0' (char code 48) for non-CN,
+# '1' (49) for fully CN and '2' (50) for mixed blocks, whose CN ranges are
+# listed in block_ranges as flat [first, last, ...] offsets within the block
+_BITMAP_LOOKUP = '''
+  lookup_ip = function(ip) {
+    var b, i, n_ip, r, status, _len;
+    n_ip = dot2num(ip);
+    b = n_ip >>> 16;
+    status = block_map.charCodeAt(b);
+    if (status !== 50) {
+      return status === 49;
+    }
+    r = block_ranges[b];
+    n_ip = n_ip & 0xFFFF;
+    for (i = 0, _len = r.length; i < _len; i += 2) {
+      if (n_ip >= r[i] && n_ip <= r[i + 1]) {
+        return true;
+      }
+    }
+    return false;
+  };
+'''
+
+# prefix_tables holds one [prefixlen, object] pair per fragmented prefix
+# length, the object being keyed by network >> (32 - prefixlen)
+_DICT_LOOKUP = '''
+  lookup_ip = function(ip) {
+    var i, n_ip, t, _len;
+    n_ip = dot2num(ip);
+    for (i = 0, _len = prefix_tables.length; i < _len; i++) {
+      t = prefix_tables[i];
+      if (t[1][n_ip >>> (32 - t[0])] === 1) {
+        return true;
+      }
+    }
+    return false;
+  };
+'''
+
+# mph_mix mirrors network_ops.perfect_hash_mix. mph_tables holds one
+# [prefixlen, displacements, slot_keys] entry per fragmented prefix length,
+# see network_ops.build_perfect_hash for the displacement encoding
+_MPH_LOOKUP = '''
+  mul32 = Math.imul || function(a, b) {
+    return ((((a >>> 16) * (b & 0xFFFF) + (a & 0xFFFF) * (b >>> 16)) << 16) + (a & 0xFFFF) * (b & 0xFFFF)) | 0;
+  };
+
+  mph_mix = function(key, seed) {
+    var h;
+    h = key ^ mul32(seed, 0x9E3779B9);
+    h ^= h >>> 16;
+    h = mul32(h, 0x85EBCA6B);
+    h ^= h >>> 13;
+    h = mul32(h, 0xC2B2AE35);
+    h ^= h >>> 16;
+    return h >>> 0;
+  };
+
+  lookup_ip = function(ip) {
+    var d, i, key, n_ip, slot, t, _len;
+    n_ip = dot2num(ip);
+    for (i = 0, _len = mph_tables.length; i < _len; i++) {
+      t = mph_tables[i];
+      key = n_ip >>> (32 - t[0]);
+      d = t[1][mph_mix(key, 0) % t[1].length];
+      slot = d < 0 ? -d - 1 : mph_mix(key, d) % t[2].length;
+      if (t[2][slot] === key) {
+        return true;
+      }
+    }
+    return false;
+  };
+'''
+
+
+def _generate_pac_content(hashed_results: List[List[ipaddress.IPv4Network]], 
+                         proxies: List[str], balance: str, no_proxy: List[str],
+                         hash_base: int, mask_step: int, 
+                         min_prefixlen: int, max_prefixlen: int,
+                         results: List[ipaddress.IPv4Network],
+                         hoist_tables: bool = False,
+                         integer_match: bool = False,
+                         engine: str = 'hash',
+                         prefix_lengths: Optional[List[int]] = None,
+                         lookup_tables: Optional[str] = None) -> str:
+    """
+    Generate the complete PAC file content as a string.
     
+    By default the lookup table and its helper functions are declared inside
+    FindProxyForURL. With hoist_tables they are emitted at the top level of
+    the script instead, so the browser builds them once per PAC load rather
+    than once per proxy decision.
+    
+    With integer_match, lookup_ip compares the shifted address against the
+    stored network integers instead of rebuilding dotted-quad strings for
+    isInNet on every candidate.
+    
+    The 'bsearch' and 'bitmap' engines ignore the hash table arguments and
+    work on the merged results: 'bsearch' emits sorted range arrays searched
+    with a binary search, 'bitmap' emits a per /16 block status string that
+    answers most lookups with a single charCodeAt. The 'dict' engine
+    fragments the merged results with mask_step and emits one object per
+    prefix length, so each probe is a single property lookup. The 'mph'
+    engine replaces those objects with minimal perfect hash tables, so each
+    probe touches exactly one slot. prefix_lengths replaces the mask_step
+    fragmentation of these two engines with explicit target lengths.
+    
+    lookup_tables replaces the hash engine tables generated from
+    hashed_results with pre-rendered ones, see delta.HashTableCache.
+    
+    Returns:
+        Complete PAC file content
+    """
+    return ''.join(_iter_pac_content(
+        hashed_results, proxies, balance, no_proxy, hash_base, mask_step,
+        min_prefixlen, max_prefixlen, results, hoist_tables=hoist_tables,
+        integer_match=integer_match, engine=engine, prefix_lengths=prefix_lengths,
+        lookup_tables=lookup_tables
+    ))
+
+
+def _iter_pac_content(hashed_results: List[List[ipaddress.IPv4Network]],
+                      proxies: List[str], balance: str, no_proxy: List[str],
+                      hash_base: int, mask_step: int,
+                      min_prefixlen: int, max_prefixlen: int,
+                      results: List[ipaddress.IPv4Network],
+                      hoist_tables: bool = False,
+                      integer_match: bool = False,
+                      engine: str = 'hash',
+                      prefix_lengths: Optional[List[int]] = None,
+                      lookup_tables: Optional[Union[str, Iterable[str]]] = None) -> Iterator[str]:
+    """
+    Yield the PAC file content in pieces, see _generate_pac_content.
+    
+    The hash engine tables are yielded one bucket at a time, so writing the
+    pieces with write_pac never holds more than a bucket of the tables.
+    lookup_tables may also be given as pieces, which are yielded as they
+    come, see delta.HashTableCache.iter_tables.
+    
+    Raises:
+        ValueError: If the engine is unknown
+    """
+    lookup_vars = _lookup_vars(engine)
+    lookup_chunks = _iter_lookup_code(
+        hashed_results, hash_base, mask_step, min_prefixlen, max_prefixlen, results,
+        integer_match=integer_match, engine=engine, prefix_lengths=prefix_lengths,
+        lookup_tables=lookup_tables
+    )
+    return _iter_pac(lookup_vars, lookup_chunks, proxies, balance, no_proxy, hoist_tables)
+
+
+def write_pac(fileobj: IO, chunks: Iterable[str]) -> int:
+    """
+    Write PAC content pieces to a file object as they are generated.
+    
+    Args:
+        fileobj: Text file object (file, sys.stdout, io.StringIO), or binary
+            one (HTTP response, gzip.GzipFile, io.BytesIO) receiving UTF-8
+        chunks: Pieces of PAC content, e.g. PacBuilder.iter_chunks
+    
+    Returns:
+        Number of characters written
+    """
+    binary = not isinstance(fileobj, io.TextIOBase)
+    written = 0
+    for chunk in chunks:
+        fileobj.write(chunk.encode('utf-8') if binary else chunk)
+        written += len(chunk)
+    return written
+
+
+def _lookup_vars(engine: str) -> str:
+    """Return the comma separated lookup variable names of an engine."""
+    try:
+        return _ENGINE_VARS[engine]
+    except KeyError:
+        raise ValueError(f"Unknown lookup engine: {engine}") from None
+
+
+def _generate_lookup_code(hashed_results: List[List[ipaddress.IPv4Network]],
+                          hash_base: int, mask_step: int,
+                          min_prefixlen: int, max_prefixlen: int,
+                          results: List[ipaddress.IPv4Network],
+                          integer_match: bool = False,
+                          engine: str = 'hash',
+                          prefix_lengths: Optional[List[int]] = None,
+                          lookup_tables: Optional[str] = None,
+                          fragmented: Optional[NetTable] = None) -> Tuple[str, str]:
+    """
+    Generate the lookup variables and code of an engine, see _generate_pac_content.
+    
+    This is everything in the PAC file that does not depend on the proxies.
+    fragmented replaces the fragmentation of results by the 'dict' and
+    'mph' engines when the fragments are already known.
+    
+    Returns:
+        Tuple of (comma separated lookup variable names, lookup code)
+    """
+    return _lookup_vars(engine), ''.join(_iter_lookup_code(
+        hashed_results, hash_base, mask_step, min_prefixlen, max_prefixlen, results,
+        integer_match=integer_match, engine=engine, prefix_lengths=prefix_lengths,
+        lookup_tables=lookup_tables, fragmented=fragmented
+    ))
+
+
+def _iter_lookup_code(hashed_results: List[List[ipaddress.IPv4Network]],
+                      hash_base: int, mask_step: int,
+                      min_prefixlen: int, max_prefixlen: int,
+                      results: List[ipaddress.IPv4Network],
+                      integer_match: bool = False,
+                      engine: str = 'hash',
+                      prefix_lengths: Optional[List[int]] = None,
+                      lookup_tables: Optional[Union[str, Iterable[str]]] = None,
+                      fragmented: Optional[NetTable] = None) -> Iterator[str]:
+    """Yield the lookup code of an engine in pieces, see _generate_lookup_code."""
+    if engine in ('dict', 'mph') and fragmented is None:
+        fragmented = fregment_nets(results, mask_step, prefix_lengths)
+    
+    if engine == 'bsearch':
+        yield _DOT2NUM + _BSEARCH_LOOKUP
+        yield _generate_range_tables(net_ranges(results))
+    elif engine == 'bitmap':
+        yield _DOT2NUM + _BITMAP_LOOKUP
+        yield from _iter_block_tables(block_map(net_ranges(results)))
+    elif engine == 'dict':
+        yield _DOT2NUM + _DICT_LOOKUP
+        yield from _iter_prefix_tables(group_by_prefixlen(fragmented))
+    elif engine == 'mph':
+        yield _DOT2NUM + _MPH_LOOKUP
+        yield from _iter_mph_tables(group_by_prefixlen(fragmented))
+    elif engine == 'hash':
+        yield _DOT2NUM + _HASH_FUNCTIONS
+        yield _INTEGER_LOOKUP if integer_match else _IS_IN_NET_LOOKUP
+        if lookup_tables is None:
+            yield from _iter_lookup_tables(
+                hashed_results, hash_base, mask_step, min_prefixlen, max_prefixlen
+            )
+        elif isinstance(lookup_tables, str):
+            yield lookup_tables
+        else:
+            yield from lookup_tables
+    else:
+        raise ValueError(f"Unknown lookup engine: {engine}")
+
+
+def _iter_pac(lookup_vars: str, lookup_chunks: Iterable[str], proxies: List[str],
+              balance: str, no_proxy: List[str], hoist_tables: bool = False) -> Iterator[str]:
+    """Yield the PAC file wrapped around pieces of lookup code, see _iter_pac_content."""
+    tail = _pac_tail(proxies, balance, no_proxy, hoist_tables)
+    yield from _iter_pac_prefix(lookup_vars, lookup_chunks, hoist_tables)
+    yield tail
+
+
+def _iter_pac_prefix(lookup_vars: str, lookup_chunks: Iterable[str],
+                     hoist_tables: bool = False) -> Iterator[str]:
+    """
+    Yield the beginning of the PAC file, up to the proxy logic.
+    
+    Everything but the tail returned by _pac_tail is the same for every
+    proxy setting, see _build_pac_prefix.
+    """
+    if hoist_tables:
+        yield _PAC_HEADER + f"""
+var {lookup_vars};
+"""
+        yield from _dedent_chunks(lookup_chunks)
+        return
+    
+    yield _PAC_HEADER + f"""   
+function FindProxyForURL(url, host) {{
+  var {lookup_vars};
+"""
+    yield from lookup_chunks
+
+
+def _pac_tail(proxies: List[str], balance: str, no_proxy: List[str],
+              hoist_tables: bool = False) -> str:
+    """Generate the end of the PAC file following _iter_pac_prefix."""
+    main_code = _generate_main_logic(proxies, balance, no_proxy)
+    
+    if hoist_tables:
+        return f"""
+function FindProxyForURL(url, host) {{
+{main_code}
+}}
+"""
+    
+    return f"""
+{main_code}
+}}
+"""
+
+
+def _dedent_chunks(chunks: Iterable[str]) -> Iterator[str]:
+    """
+    Move pieces of lookup code to the top level of the script.
+    
+    Same as textwrap.dedent of the joined pieces, whose common margin is
+    always _LOOKUP_INDENT, but only holds one piece and a partial line.
+    """
+    partial = ''
+    for chunk in chunks:
+        text = partial + chunk
+        cut = text.rfind('\n') + 1
+        partial = text[cut:]
+        if cut:
+            yield _dedent_lines(text[:cut])
+    if partial:
+        yield _dedent_lines(partial)
+
+
+def _dedent_lines(text: str) -> str:
+    """Remove the _LOOKUP_INDENT margin from whole lines, emptying blank ones."""
+    return _INDENT_RE.sub('', _WHITESPACE_LINE_RE.sub('', text))
+
+
+def _iter_lookup_tables(hashed_results: List[List[ipaddress.IPv4Network]],
+                        hash_base: int, mask_step: int,
+                        min_prefixlen: int, max_prefixlen: int) -> Iterator[str]:
+    """Yield the lookup constants, then hashed_nets one bucket at a time."""
+    # lookup_ip only probes the prefix lengths present in the table
+    prefixlens = sorted({prefixlen for bucket in hashed_results for _, prefixlen in iter_nets(bucket)})
+    
+    yield _generate_lookup_header(prefixlens, hash_base, mask_step, min_prefixlen, max_prefixlen)
+    for bucket in hashed_results:
+        yield _generate_bucket(bucket)
+    yield _LOOKUP_TABLES_END
+
+
+def _generate_lookup_header(prefixlens: List[int], hash_base: int, mask_step: int,
+                            min_prefixlen: int, max_prefixlen: int) -> str:
+    """Generate the lookup constants preceding the hashed_nets buckets."""
     # Add configuration constants
-    pac_content += f"""
+    table_code = f"""
 
   HASH_BASE = {hash_base};
+  HASH_MULT = [{', '.join(map(str, hash_multipliers(hash_base)))}];
   MASK_STEP = {mask_step};
+  PREFIX_LENS = [{', '.join(map(str, prefixlens))}];
   min_prefixlen = {min_prefixlen};
   max_prefixlen = {max_prefixlen};
 
 """
     
-    # Add mask step variables
-    for i in range(min_prefixlen, max_prefixlen + 1, mask_step):
-        pac_content += f"""    var m{i} = {i};
-"""
+    # Add prefix length variables for every length present in the table
+    table_code += ''.join(f"""  var m{i} = {i};
+""" for i in prefixlens)
     
     # Add hashed networks data
-    pac_content += """    var empty_array = [];
-    var hashed_nets = [
+    table_code += """  var empty_array = [];
+  var hashed_nets = [
 """
+    return table_code
+
+
+def _generate_bucket(bucket: List[ipaddress.IPv4Network]) -> str:
+    """Generate the hashed_nets entry of one bucket."""
+    if len(bucket) == 0:
+        return "\n    empty_array,"
+    rows = ''.join(f"\n      [{address >> (32 - prefixlen)}, m{prefixlen}],"
+                   for address, prefixlen in iter_nets(bucket))
+    return "\n    [" + rows + "\n    ],"
+
+
+_LOOKUP_TABLES_END = """
+  ];
+"""
+
+
+def _generate_range_tables(ranges: List[Tuple[int, int]]) -> str:
+    """
+    Generate the sorted range arrays searched by the 'bsearch' engine.
     
-    for i in range(len(hashed_results)):
-        if len(hashed_results[i]) > 0:
-            pac_content += "\n        ["
-            for net in hashed_results[i]:
-                pac_content += f"\n            [{int(net.network_address) >> (32 - net.prefixlen)}, m{net.prefixlen}],"
-            pac_content += "\n        ],"
-        else:
-            pac_content += "\n        empty_array,"
-    
-    # Add main PAC logic
-    pac_content += f"""
-    ];
+    Returns:
+        JavaScript code assigning range_starts and range_ends
+    """
+    return f"""
+  range_starts = [{_format_int_array([start for start, _ in ranges])}];
+  range_ends = [{_format_int_array([end for _, end in ranges])}];
+"""
 
-    if (isPlainHostName(host)
-     || (host == '127.0.0.1')
-     || (host == 'localhost')
-     ) {{
-        return 'DIRECT';
-    }}
 
-    var ip = dnsResolve(host);
+def _iter_block_tables(blocks: Tuple[str, Dict[int, List[Tuple[int, int]]]]) -> Iterator[str]:
+    """
+    Yield the /16 block status string and mixed block ranges of the
+    'bitmap' engine.
+    
+    Returns:
+        Pieces of JavaScript code assigning block_map and block_ranges
+    """
+    status, mixed_blocks = blocks
+    
+    # One line of the status string per /8
+    status_lines = "' +\n    '".join(status[i:i + 256] for i in range(0, len(status), 256))
+    yield f"""
+  block_map = '{status_lines}';
+  block_ranges = {{"""
+    
+    for block, ranges in sorted(mixed_blocks.items()):
+        flat = [offset for block_range in ranges for offset in block_range]
+        yield f"\n    {block}: [{', '.join(map(str, flat))}],"
+    
+    yield """
+  };
+"""
 
-    if (ip == null || ip == '' || {generate_no_proxy(no_proxy)} lookup_ip(ip)) {{
-        return 'DIRECT';
-    }}
 
-    {generate_balanced_proxy(proxies, balance)}
+def _iter_prefix_tables(grouped: Dict[int, List[int]]) -> Iterator[str]:
+    """
+    Yield the per prefix length exact-match objects of the 'dict' engine.
+    
+    Returns:
+        Pieces of JavaScript code assigning prefix_tables
+    """
+    yield """
+  prefix_tables = ["""
+    
+    for prefixlen, keys in grouped.items():
+        entries = ',\n      '.join(
+            ', '.join(f'{key}: 1' for key in keys[i:i + 16]) for i in range(0, len(keys), 16)
+        )
+        yield f"\n    [{prefixlen}, {{\n      {entries}\n    }}],"
+    
+    yield """
+  ];
+"""
+
 
-}}
+def _iter_mph_tables(grouped: Dict[int, List[int]]) -> Iterator[str]:
+    """
+    Yield the per prefix length minimal perfect hash tables of the
+    'mph' engine.
+    
+    Returns:
+        Pieces of JavaScript code assigning mph_tables
+    """
+    yield """
+  mph_tables = ["""
+    
+    for prefixlen, keys in grouped.items():
+        displacements, slot_keys = build_perfect_hash(keys)
+        yield f"""
+    [{prefixlen}, [
+      {_format_int_array(displacements, indent='      ')}
+    ], [
+      {_format_int_array(slot_keys, indent='      ')}
+    ]],"""
+    
+    yield """
+  ];
 """
+
+
+def _format_int_array(values: List[int], per_line: int = 16, indent: str = '    ') -> str:
+    """Format integers as the body of a JavaScript array literal"""
+    lines = [', '.join(map(str, values[i:i + per_line])) for i in range(0, len(values), per_line)]
+    return (',\n' + indent).join(lines)
+
+
+def _generate_main_logic(proxies: List[str], balance: str, no_proxy: List[str]) -> str:
+    """
+    Generate the per-request body of FindProxyForURL.
     
-    return pac_content
+    Returns:
+        JavaScript code deciding between DIRECT and the proxies
+    """
+    return f"""  if (isPlainHostName(host)
+   || (host == '127.0.0.1')
+   || (host == 'localhost')
+   ) {{
+    return 'DIRECT';
+  }}
+
+  var ip = dnsResolve(host);
+
+  if (ip == null || ip == '' || {generate_no_proxy(no_proxy)} lookup_ip(ip)) {{
+    return 'DIRECT';
+  }}
+
+  {generate_balanced_proxy(proxies, balance)}
+"""
 
 
 def _print_generation_stats(hashed_results: List[List[ipaddress.IPv4Network]], 
@@ -278,11 +1075,99 @@ def _print_generation_stats(hashed_results: List[List[ipaddress.IPv4Network]],
     """Print generation statistics."""
     none_empty_count = sum(1 for bucket in hashed_results if len(bucket) > 0)
     avg_len = float(len(results)) / none_empty_count if none_empty_count > 0 else 0
-    steps = (max_prefixlen - min_prefixlen) / mask_step + 1
+    steps = len({prefixlen for bucket in hashed_results for _, prefixlen in iter_nets(bucket)})
     
     print("Average matching length: %f" % avg_len)
     print("Steps to match: %d" % steps)
     print("Matching cost est.: %f" % (avg_len * steps))
     print("Rules: %d items." % len(results))
     print(f"Usage: Use the newly created {output_file} as your web browser's "
-          "automatic proxy configuration (.pac) file.")
\ No newline at end of file
+          "automatic proxy configuration (.pac) file.")
+
+
+def _print_bsearch_stats(ranges: List[Tuple[int, int]],
+                         results: List[ipaddress.IPv4Network],
+                         output_file: str) -> None:
+    """Print generation statistics of the 'bsearch' engine."""
+    print("Ranges: %d" % len(ranges))
+    print("Steps to match: %d" % math.ceil(math.log2(len(ranges) + 1)))
+    print("Rules: %d items." % len(results))
+    print(f"Usage: Use the newly created {output_file} as your web browser's "
+          "automatic proxy configuration (.pac) file.")
+
+
+def _print_bitmap_stats(blocks: Tuple[str, Dict[int, List[Tuple[int, int]]]],
+                        results: List[ipaddress.IPv4Network],
+                        output_file: str) -> None:
+    """Print generation statistics of the 'bitmap' engine."""
+    status, mixed_blocks = blocks
+    
+    print("Blocks (/16): %d CN, %d non-CN, %d mixed" % (
+        status.count('1'), status.count('0'), len(mixed_blocks)))
+    print("Direct hits: %.2f%% of blocks resolve with a single lookup" % (
+        100.0 * (len(status) - len(mixed_blocks)) / len(status)))
+    print("Mixed block ranges: %d" % sum(len(ranges) for ranges in mixed_blocks.values()))
+    print("Rules: %d items." % len(results))
+    print(f"Usage: Use the newly created {output_file} as your web browser's "
+          "automatic proxy configuration (.pac) file.")
+
+
+def _dict_stats(fragmented: NetTable, hash_base: int,
+                mask_step: int) -> Tuple[List[int], int, int]:
+    """
+    Measure the 'dict' engine tables against the hash layout of the same fragments.
+    
+    Returns:
+        Tuple of (prefix lengths, size of the dict tables, size of the hash
+        engine tables with hash_base)
+    """
+    grouped = group_by_prefixlen(fragmented)
+    min_prefixlen, max_prefixlen = calculate_prefix_range(fragmented)
+    dict_size = sum(map(len, _iter_prefix_tables(grouped)))
+    hash_size = sum(map(len, _iter_lookup_tables(
+        hash_nets(fragmented, hash_base), hash_base, mask_step, min_prefixlen, max_prefixlen
+    )))
+    return list(grouped), dict_size, hash_size
+
+
+def _build_dict_stats(tables: _LookupTables, digest: str, stage_cache: Optional[StageCache],
+                      hash_base: int, mask_step: int,
+                      prefix_lengths: Optional[List[int]] = None) -> Tuple[List[int], int, int]:
+    """Measure the 'dict' engine tables once per data and parameters, see _dict_stats."""
+    def compute() -> Tuple[List[int], int, int]:
+        return _dict_stats(tables.fragmented, hash_base, mask_step)
+    
+    if stage_cache is None:
+        return compute()
+    return stage_cache.get('stats', digest, ('dict', mask_step, prefix_lengths, hash_base),
+                           compute)
+
+
+def _print_dict_stats(stats: Tuple[List[int], int, int],
+                      results: List[ipaddress.IPv4Network],
+                      hash_base: int, output_file: str) -> None:
+    """Print generation statistics of the 'dict' engine, see _dict_stats."""
+    prefixlens, dict_size, hash_size = stats
+    
+    print("Prefix lengths: %s" % ', '.join(map(str, prefixlens)))
+    print("Steps to match: %d" % len(prefixlens))
+    print("Table size: %d bytes (hash layout with hash_base %d: %d bytes, %+.1f%%)" % (
+        dict_size, hash_base, hash_size,
+        100.0 * (dict_size - hash_size) / hash_size if hash_size else 0))
+    print("Rules: %d items." % len(results))
+    print(f"Usage: Use the newly created {output_file} as your web browser's "
+          "automatic proxy configuration (.pac) file.")
+
+
+def _print_mph_stats(fragmented: List[ipaddress.IPv4Network], pac_size: int,
+                     results: List[ipaddress.IPv4Network], output_file: str) -> None:
+    """Print generation statistics of the 'mph' engine."""
+    grouped = group_by_prefixlen(fragmented)
+    
+    print("Prefix lengths: %s" % ', '.join(map(str, grouped)))
+    print("Steps to match: %d (one slot per step)" % len(grouped))
+    print("Slots: %d" % sum(len(keys) for keys in grouped.values()))
+    print("PAC size: %d bytes" % pac_size)
+    print("Rules: %d items." % len(results))
+    print(f"Usage: Use the newly created {output_file} as your web browser's "
+          "automatic proxy configuration (.pac) file.")
@@ -0,0 +1,115 @@
+"""
+Binary Range Snapshot Module
+
+This module persists the parsed and merged China IP ranges as a packed
+binary file, so later runs can start from it instead of downloading and
+re-parsing the delegated text file.
+
+File layout (all integers little-endian):
+
+    magic    4s   b'FPRS'
+    version  u16  SNAPSHOT_VERSION
+    reserved u16  0
+    date     8s   source date of the delegated file, ASCII YYYYMMDD
+    serial   u32  serial of the delegated file
+    count    u32  number of ranges
+    ranges   count * (u32 start, u32 end), inclusive, sorted and disjoint
+"""
+
+import mmap
+import os
+import struct
+import sys
+from array import array
+from typing import List, NamedTuple, Sequence, Tuple, Union
+
+
+SNAPSHOT_MAGIC = b'FPRS'
+SNAPSHOT_VERSION = 1
+
+_HEADER = struct.Struct('<4sHH8sII')
+
+
+class Snapshot(NamedTuple):
+    """A loaded binary snapshot, values is a flat start, end, start, end... view"""
+    source_date: str
+    serial: int
+    values: Union[memoryview, array]
+    
+    @property
+    def count(self) -> int:
+        return len(self.values) // 2
+    
+    def ranges(self) -> List[Tuple[int, int]]:
+        """Return the ranges as inclusive (start, end) tuples"""
+        values = self.values
+        return list(zip(values[0::2], values[1::2]))
+
+
+def write_snapshot(path: str, ranges: Sequence[Tuple[int, int]],
+                   source_date: str = '', serial: int = 0) -> None:
+    """
+    Write ranges to a binary snapshot file.
+    
+    The file is written next to path and renamed over it, so readers never
+    see a partial snapshot.
+    
+    Args:
+        path: Snapshot file path
+        ranges: Sorted, disjoint inclusive (start, end) tuples, e.g. from
+            network_ops.net_ranges
+        source_date: Date of the delegated file (YYYYMMDD)
+        serial: Serial of the delegated file
+    """
+    values = array('I', [value for start_end in ranges for value in start_end])
+    if sys.byteorder == 'big':
+        values.byteswap()
+    
+    header = _HEADER.pack(SNAPSHOT_MAGIC, SNAPSHOT_VERSION, 0,
+                          source_date.encode('ascii')[:8], serial, len(ranges))
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'wb') as f:
+        f.write(header)
+        values.tofile(f)
+    os.replace(tmp_path, path)
+
+
+def load_snapshot(path: str) -> Snapshot:
+    """
+    Memory-map a binary snapshot file.
+    
+    On little-endian hosts the ranges are a zero-copy memoryview into the
+    mapping, so loading costs a few syscalls regardless of the file size.
+    
+    Args:
+        path: Snapshot file path
+    
+    Returns:
+        Snapshot tuple
+    
+    Raises:
+        ValueError: If the file is not a valid snapshot
+    """
+    with open(path, 'rb') as f:
+        size = os.fstat(f.fileno()).st_size
+        if size < _HEADER.size:
+            raise ValueError(f"{path} is not a Flora PAC snapshot")
+        mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    
+    magic, version, _, source_date, serial, count = _HEADER.unpack_from(mapped)
+    if magic != SNAPSHOT_MAGIC:
+        raise ValueError(f"{path} is not a Flora PAC snapshot")
+    if version != SNAPSHOT_VERSION:
+        raise ValueError(f"Unsupported snapshot version {version} in {path}")
+    if size != _HEADER.size + count * 8:
+        raise ValueError(f"Truncated snapshot {path}: expected {count} ranges")
+    
+    data = memoryview(mapped)[_HEADER.size:]
+    if sys.byteorder == 'little':
+        values = data.cast('I')
+    else:
+        values = array('I')
+        values.frombytes(data)
+        values.byteswap()
+    
+    return Snapshot(source_date.rstrip(b'\0').decode('ascii'), serial, values)
@@ -0,0 +1,208 @@
+"""
+Pipeline Stage Cache Module
+
+This module memoizes the outputs of the PAC generation stages (merge,
+fragment, hash, lookup tables) in memory and optionally on disk. Entries
+are content addressed: the key is the digest of the input data plus the
+parameters of the stage, so changing only the proxies or the balancing
+mode reuses every stage and only renders the final template.
+"""
+
+import hashlib
+import ipaddress
+import os
+import pickle
+import tempfile
+import threading
+from collections import OrderedDict
+from typing import Any, Callable, Iterable, Optional, Union
+
+from .net_table import NetTable
+
+
+# Part of every cache key: bump it whenever a stage output or a rendered
+# template changes, so entries written by an older version are not reused
+STAGE_FORMAT_VERSION = 2
+
+
+def nets_digest(nets: Union[NetTable, Iterable[ipaddress.IPv4Network]]) -> str:
+    """
+    Return the content digest of a NetTable or a list of networks.
+    
+    Args:
+        nets: NetTable or iterable of IPv4Network objects
+    
+    Returns:
+        SHA-256 hex digest, equal for a list and the NetTable built from it
+    """
+    if not isinstance(nets, NetTable):
+        nets = NetTable.from_networks(nets)
+    return nets.digest()
+
+
+class StageCache:
+    """
+    Memory (LRU) and optional on-disk cache of pipeline stage outputs.
+    
+    A cache can be shared between threads. A missing output is computed by
+    one thread while the others wanting the same output wait for it; other
+    outputs are still served meanwhile.
+    
+    The on-disk entries are pickles, loading one can run arbitrary code:
+    cache_dir must only be writable by trusted users.
+    
+    Args:
+        cache_dir: Directory of the on-disk entries, None to only keep them
+            in memory
+        max_entries: Entries kept in memory, and on disk
+    """
+    
+    def __init__(self, cache_dir: Optional[str] = None, max_entries: int = 32):
+        self.cache_dir = cache_dir
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._memory = OrderedDict()
+        # Guards _memory, the counters and _key_locks, never held while an
+        # output is computed or loaded
+        self._lock = threading.Lock()
+        # One lock per output being computed or loaded
+        self._key_locks = {}
+    
+    @staticmethod
+    def key(stage: str, digest: str, params: tuple = ()) -> str:
+        """
+        Return the cache key of a stage output.
+        
+        Args:
+            stage: Stage name
+            digest: Digest of the data the pipeline started from
+            params: Parameters the stage output depends on (hashable, with a
+                stable repr)
+        
+        Returns:
+            Hex key, also depending on STAGE_FORMAT_VERSION
+        """
+        key = f"{STAGE_FORMAT_VERSION}|{stage}|{digest}|{params!r}"
+        return hashlib.sha256(key.encode('utf-8')).hexdigest()
+    
+    def get(self, stage: str, digest: str, params: tuple, compute: Callable[[], Any]) -> Any:
+        """
+        Return the cached output of a stage, computing and storing it if missing.
+        
+        Args:
+            stage: Stage name
+            digest: Digest of the data the pipeline started from
+            params: Parameters the stage output depends on
+            compute: Function computing the output
+        
+        Returns:
+            The stage output. Cached outputs are shared, callers must not
+            modify them.
+        """
+        key = self.key(stage, digest, params)
+        
+        with self._lock:
+            if key in self._memory:
+                return self._memory_hit(key)
+            key_lock = self._key_locks.setdefault(key, threading.Lock())
+        
+        with key_lock:
+            try:
+                with self._lock:
+                    # Computed by another thread while this one waited
+                    if key in self._memory:
+                        return self._memory_hit(key)
+                
+                value = self._load(key)
+                loaded = value is not None
+                if not loaded:
+                    value = compute()
+                    self._store(key, value)
+                
+                with self._lock:
+                    if loaded:
+                        self.hits += 1
+                    else:
+                        self.misses += 1
+                    self._memory[key] = value
+                    while len(self._memory) > self.max_entries:
+                        self._memory.popitem(last=False)
+                return value
+            finally:
+                with self._lock:
+                    if self._key_locks.get(key) is key_lock:
+                        del self._key_locks[key]
+    
+    def _memory_hit(self, key: str) -> Any:
+        """Return an in-memory entry, the caller holds _lock."""
+        self._memory.move_to_end(key)
+        self.hits += 1
+        return self._memory[key]
+    
+    def clear(self) -> None:
+        """Drop the in-memory entries"""
+        with self._lock:
+            self._memory.clear()
+    
+    def _path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, key + '.pickle')
+    
+    def _load(self, key: str) -> Any:
+        """
+        Read an on-disk entry, None if there is none or it is unreadable.
+        
+        An entry that cannot be unpickled, e.g. one referring to a class
+        that was renamed since, is removed. Unpickling trusts the content
+        of cache_dir, see StageCache.
+        """
+        if self.cache_dir is None:
+            return None
+        path = self._path(key)
+        try:
+            f = open(path, 'rb')
+        except OSError:
+            return None
+        try:
+            with f:
+                return pickle.load(f)
+        except Exception:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            return None
+    
+    def _store(self, key: str, value: Any) -> None:
+        """Atomically write an on-disk entry and evict the oldest ones."""
+        if self.cache_dir is None:
+            return
+        os.makedirs(self.cache_dir, exist_ok=True)
+        # A temporary file of its own: other processes may be writing the
+        # same key into the shared directory
+        fd, tmp_path = tempfile.mkstemp(suffix='.tmp', dir=self.cache_dir)
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                pickle.dump(value, f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp_path, self._path(key))
+        except BaseException:
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
+            raise
+        
+        # Other threads and processes may be pruning the same directory
+        entries = []
+        for entry in os.scandir(self.cache_dir):
+            if entry.name.endswith('.pickle'):
+                try:
+                    entries.append((entry.stat().st_mtime, entry.path))
+                except FileNotFoundError:
+                    pass
+        entries.sort()
+        for _, entry_path in entries[:-self.max_entries]:
+            try:
+                os.remove(entry_path)
+            except FileNotFoundError:
+                pass
@@ -7,18 +7,118 @@ visual configuration and real-time preview.
 
 import tempfile
 import os
+import threading
+import time
 from typing import List, Tuple, Optional
 import gradio as gr
-from .ip_data import fetch_ip_data, merge_all
-from .network_ops import fregment_nets, hash_nets
-from .pac_generator import generate_balanced_proxy, generate_no_proxy, _generate_pac_content
+from .builder import Dataset, PacBuilder
+from .cache import DEFAULT_CACHE_TTL
+from .ip_data import fetch_ip_data
+from .pac_generator import generate_balanced_proxy, generate_no_proxy
+from .stage_cache import StageCache
 
 
 class FloraPacWebUI:
-    """Web UI controller for Flora PAC generator"""
+    """
+    Web UI controller for Flora PAC generator
     
-    def __init__(self):
+    The networks are loaded once into a Dataset shared by every request.
+    launch() warms it in a background thread, which reloads it every
+    dataset_ttl seconds and swaps the new dataset in, so requests only
+    fragment, hash and render.
+    """
+    
+    def __init__(self, snapshot_path: Optional[str] = None,
+                 dataset_ttl: float = DEFAULT_CACHE_TTL):
         self.temp_files = []
+        # Binary range snapshot to start from instead of fetching APNIC data
+        self.snapshot_path = snapshot_path
+        # Tables of earlier requests, so changing the proxies only re-renders
+        self.stage_cache = StageCache()
+        # Seconds a loaded dataset is served before it is reloaded
+        self.dataset_ttl = dataset_ttl
+        self._dataset = None
+        # Held while loading, so concurrent requests never load twice
+        self._dataset_lock = threading.Lock()
+        self._refresh_thread = None
+        self._refresh_stop = threading.Event()
+    
+    def _load_dataset(self) -> Dataset:
+        """Load the networks from the snapshot, or fetch them from APNIC."""
+        if self.snapshot_path:
+            return Dataset.load(snapshot=self.snapshot_path, stage_cache=self.stage_cache)
+        header = {}
+        china_nets = fetch_ip_data(header=header, as_table=True)
+        return Dataset.from_networks(china_nets, header.get('enddate', ''),
+                                     header.get('serial', 0), stage_cache=self.stage_cache)
+    
+    def _is_stale(self, dataset: Dataset) -> bool:
+        return time.time() - dataset.loaded_at >= self.dataset_ttl
+    
+    def _refresh_running(self) -> bool:
+        return self._refresh_thread is not None and self._refresh_thread.is_alive()
+    
+    def get_dataset(self) -> Dataset:
+        """
+        Return the current dataset, loading it if there is none yet.
+        
+        While the background refresh runs, a stale dataset is still served
+        until its replacement is loaded. Without it, a stale dataset is
+        reloaded by the first request that sees it.
+        
+        Returns:
+            Dataset
+        """
+        dataset = self._dataset
+        if dataset is not None and (self._refresh_running() or not self._is_stale(dataset)):
+            return dataset
+        with self._dataset_lock:
+            # Another request may have loaded it while this one waited
+            dataset = self._dataset
+            if dataset is None or (not self._refresh_running() and self._is_stale(dataset)):
+                dataset = self._dataset = self._load_dataset()
+            return dataset
+    
+    def refresh_dataset(self) -> Dataset:
+        """
+        Reload the dataset and swap it in.
+        
+        Requests keep using the previous dataset until the new one is
+        loaded. If loading fails the previous dataset is kept.
+        
+        Returns:
+            The new Dataset
+        """
+        with self._dataset_lock:
+            dataset = self._dataset = self._load_dataset()
+            return dataset
+    
+    def start_refresh(self) -> None:
+        """Load the dataset in a background thread and reload it every dataset_ttl seconds"""
+        if self._refresh_running():
+            return
+        self._refresh_stop.clear()
+        self._refresh_thread = threading.Thread(target=self._refresh_loop,
+                                                name='flora-pac-dataset-refresh', daemon=True)
+        self._refresh_thread.start()
+    
+    def stop_refresh(self) -> None:
+        """Stop the background refresh started by start_refresh"""
+        self._refresh_stop.set()
+        if self._refresh_running() and self._refresh_thread is not threading.current_thread():
+            self._refresh_thread.join()
+        self._refresh_thread = None
+    
+    def _refresh_loop(self) -> None:
+        while True:
+            try:
+                dataset = self.refresh_dataset()
+                print(f"Loaded {len(dataset.networks)} networks (source date {dataset.source_date or 'unknown'})")
+            except Exception as e:
+                # Keep serving the previous dataset, retry at the next refresh
+                print(f"Error refreshing IP data: {e}")
+            if self._refresh_stop.wait(self.dataset_ttl):
+                return
     
     def generate_pac_file(
         self,
@@ -45,33 +145,17 @@ class FloraPacWebUI:
             if no_proxy_networks.strip():
                 no_proxy_list = [n.strip() for n in no_proxy_networks.split('\n') if n.strip()]
             
-            # Fetch and process IP data
-            status_msg = "Fetching China IP ranges..."
-            china_nets = fetch_ip_data()
-            merged_nets = merge_all(china_nets)
-            
-            # Fragment networks
-            fragmented_nets = fregment_nets(merged_nets, mask_step)
-            
-            # Generate hash tables  
-            hash_tables = hash_nets(fragmented_nets, hash_base)
+            # Use the loaded IP data, only fetched on the first request
+            # when the background refresh is not running
+            dataset = self.get_dataset()
+            merged_nets = dataset.networks
             
-            # Calculate prefix range for PAC generation
-            from .network_ops import calculate_prefix_range
-            min_prefixlen, max_prefixlen = calculate_prefix_range(merged_nets)
+            # Fragment and hash networks, reusing the tables of earlier requests
+            builder = PacBuilder(dataset, hash_base, mask_step, stage_cache=self.stage_cache)
+            fragmented_nets = builder.tables.fragmented
             
-            # Generate final PAC content using the internal function
-            pac_content = _generate_pac_content(
-                hash_tables, 
-                proxies,
-                balance_mode,
-                no_proxy_list,
-                hash_base, 
-                mask_step,
-                min_prefixlen,
-                max_prefixlen,
-                merged_nets
-            )
+            # Generate final PAC content
+            pac_content = builder.render(proxies, balance_mode, no_proxy_list)
             
             # Save PAC file to current directory for easy access
             try:
@@ -88,7 +172,8 @@ class FloraPacWebUI:
                     self.temp_files.append(output_path)
             
             stats = f"Generated PAC file successfully!\n"
-            stats += f"- China networks: {len(china_nets)}\n"
+            stats += f"- Data source date: {dataset.source_date or 'unknown'}\n"
+            stats += f"- Data age: {_format_age(time.time() - dataset.loaded_at)}\n"
             stats += f"- Merged networks: {len(merged_nets)}\n"
             stats += f"- Fragmented networks: {len(fragmented_nets)}\n"
             stats += f"- Hash base: {hash_base}\n"
@@ -270,7 +355,8 @@ class FloraPacWebUI:
         share: bool = False,
         **kwargs
     ):
-        """Launch the web interface"""
+        """Launch the web interface, loading the IP data in the background"""
+        self.start_refresh()
         interface = self.create_interface()
         return interface.launch(
             server_name=server_name,
@@ -280,7 +366,8 @@ class FloraPacWebUI:
         )
     
     def cleanup(self):
-        """Clean up temporary files"""
+        """Stop the background refresh and clean up temporary files"""
+        self.stop_refresh()
         for temp_file in self.temp_files:
             try:
                 os.unlink(temp_file)
@@ -289,9 +376,20 @@ class FloraPacWebUI:
         self.temp_files.clear()
 
 
-def create_web_ui() -> FloraPacWebUI:
+def _format_age(seconds: float) -> str:
+    """Format a duration in seconds as e.g. '42s', '5m 3s' or '2h 10m'."""
+    seconds = int(seconds)
+    if seconds < 60:
+        return f"{seconds}s"
+    if seconds < 3600:
+        return f"{seconds // 60}m {seconds % 60}s"
+    return f"{seconds // 3600}h {seconds % 3600 // 60}m"
+
+
+def create_web_ui(snapshot_path: Optional[str] = None,
+                  dataset_ttl: float = DEFAULT_CACHE_TTL) -> FloraPacWebUI:
     """Factory function to create web UI instance"""
-    return FloraPacWebUI()
+    return FloraPacWebUI(snapshot_path, dataset_ttl)
 
 
 # For backwards compatibility and direct import
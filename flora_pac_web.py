@@ -12,6 +12,7 @@ import os
 # Add current directory to path for development
 sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
 
+from flora_pac_lib.cache import DEFAULT_CACHE_TTL
 from flora_pac_lib.web_ui import create_web_ui
 
 
@@ -48,6 +49,18 @@ Examples:
         help='Create public Gradio share link'
     )
     
+    parser.add_argument(
+        '--snapshot',
+        help='Binary range snapshot to start from instead of fetching APNIC data'
+    )
+    
+    parser.add_argument(
+        '--refresh-interval',
+        type=float,
+        default=DEFAULT_CACHE_TTL,
+        help='Seconds between reloads of the IP data in the background (default: %(default)s)'
+    )
+    
     parser.add_argument(
         '--debug',
         action='store_true',
@@ -67,7 +80,7 @@ Examples:
     
     try:
         # Create and launch web UI
-        ui = create_web_ui()
+        ui = create_web_ui(args.snapshot, args.refresh_interval)
         
         print(f"Starting web server on {args.host}:{args.port}")
         if args.share:
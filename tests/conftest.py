@@ -0,0 +1,180 @@
+"""
+Shared fixtures for the Flora PAC test suite
+"""
+import hashlib
+import http.server
+import ipaddress
+import json
+import os
+import shutil
+import subprocess
+import tempfile
+import threading
+import time
+
+import pytest
+
+from flora_pac_lib.network_ops import calculate_prefix_range, fregment_nets, hash_nets
+from flora_pac_lib.pac_generator import _generate_pac_content
+
+
+# A few CN networks, some of them adjacent, shared by the pipeline tests
+NETWORKS = [ipaddress.IPv4Network(n) for n in [
+    '1.0.1.0/24', '1.0.2.0/23', '14.0.0.0/21', '14.0.8.0/22', '27.8.0.0/13', '223.255.252.0/23'
+]]
+
+
+def full_pac(merged, proxies, balance='no', no_proxy=(), hash_base=3011, mask_step=2, **kwargs):
+    """PAC content of the one-shot hash engine pipeline over merged networks"""
+    fragmented = fregment_nets(merged, mask_step)
+    min_prefixlen, max_prefixlen = calculate_prefix_range(fragmented)
+    return _generate_pac_content(
+        hash_nets(fragmented, hash_base), proxies, balance, list(no_proxy), hash_base, mask_step,
+        min_prefixlen, max_prefixlen, merged, **kwargs
+    )
+
+
+# Minimal PAC runtime: the host functions a browser provides to a PAC script
+_PAC_RUNNER_JS = r"""
+var fs = require('fs');
+var vm = require('vm');
+
+function convert_addr(ipchars) {
+  var bytes = ipchars.split('.');
+  return (((bytes[0] & 0xff) << 24) | ((bytes[1] & 0xff) << 16)
+          | ((bytes[2] & 0xff) << 8) | (bytes[3] & 0xff)) >>> 0;
+}
+
+global.isInNet = function(ipaddr, pattern, maskstr) {
+  var mask = convert_addr(maskstr);
+  return ((convert_addr(ipaddr) & mask) >>> 0) === ((convert_addr(pattern) & mask) >>> 0);
+};
+global.isPlainHostName = function(host) { return host.indexOf('.') < 0; };
+global.dnsResolve = function(host) { return host; };
+global.myIpAddress = function() { return '192.168.0.2'; };
+
+vm.runInThisContext(fs.readFileSync(process.argv[2], 'utf8'));
+var hosts = JSON.parse(fs.readFileSync(process.argv[3], 'utf8'));
+console.log(JSON.stringify(hosts.map(function(host) {
+  return FindProxyForURL('http://' + host + '/', host);
+})));
+"""
+
+
+@pytest.fixture
+def run_pac():
+    """Evaluate PAC content with node and return FindProxyForURL results per host"""
+    node = shutil.which('node')
+    if node is None:
+        pytest.skip("node is required to evaluate generated PAC files")
+    
+    def _run(pac_content, hosts):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            paths = {}
+            for name, content in (('runner.js', _PAC_RUNNER_JS),
+                                  ('flora.pac', pac_content),
+                                  ('hosts.json', json.dumps(list(hosts)))):
+                paths[name] = os.path.join(tmp_dir, name)
+                with open(paths[name], 'w') as f:
+                    f.write(content)
+            
+            result = subprocess.run(
+                [node, paths['runner.js'], paths['flora.pac'], paths['hosts.json']],
+                capture_output=True, text=True, timeout=60
+            )
+            assert result.returncode == 0, result.stderr
+            return json.loads(result.stdout)
+    
+    return _run
+
+
+
+@pytest.fixture(autouse=True)
+def no_fetch_retries(monkeypatch):
+    """Make fetch_delegated fail at once instead of backing off for seconds,
+    the suite runs offline. cache.fetch_snapshot keeps its retries."""
+    monkeypatch.setattr('flora_pac_lib.ip_data.DEFAULT_RETRIES', 0)
+
+
+class _StandInHandler(http.server.BaseHTTPRequestHandler):
+    """Serve the bodies registered on the server, by path"""
+    
+    def do_GET(self):
+        with self.server.lock:
+            self.server.requests.append(self)
+            self.server.in_flight += 1
+            self.server.peak_in_flight = max(self.server.peak_in_flight, self.server.in_flight)
+        try:
+            if self.server.barrier is not None:
+                try:
+                    self.server.barrier.wait(timeout=5)
+                except threading.BrokenBarrierError:
+                    pass
+            self._respond()
+        finally:
+            with self.server.lock:
+                self.server.in_flight -= 1
+    
+    def _respond(self):
+        time.sleep(self.server.delays.get(self.path, 0))
+        body = self.server.bodies.get(self.path)
+        if body is None:
+            self.send_error(404)
+            return
+        etag = '"%s"' % hashlib.sha1(body).hexdigest()[:16]
+        if self.headers.get('If-None-Match') == etag:
+            self.send_response(304)
+            self.end_headers()
+            return
+        
+        start = 0
+        range_header = self.headers.get('Range')
+        if range_header and self.headers.get('If-Range') in (None, etag):
+            start = int(range_header.split('=')[1].split('-')[0])
+            if start >= len(body):
+                self.send_error(416)
+                return
+            self.send_response(206)
+            self.send_header('Content-Range', 'bytes %d-%d/%d' % (start, len(body) - 1, len(body)))
+        else:
+            self.send_response(200)
+        payload = body[start:]
+        self.send_header('ETag', etag)
+        self.send_header('Content-Length', str(len(payload)))
+        self.end_headers()
+        
+        # Drop the connection after the next scheduled number of bytes
+        drops = self.server.drops.get(self.path)
+        if drops:
+            self.wfile.write(payload[:drops.pop(0)])
+            self.wfile.flush()
+            self.close_connection = True
+            return
+        self.wfile.write(payload)
+    
+    def log_message(self, format, *args):
+        pass
+
+
+@pytest.fixture
+def http_server():
+    """Local HTTP stand-in for the RIR servers; register bodies in .bodies,
+    optional response delays in seconds in .delays and, in .drops, lists of
+    byte counts after which successive responses drop the connection. With
+    a threading.Barrier in .barrier, requests wait for each other before
+    being answered; .peak_in_flight counts the most concurrent requests"""
+    server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), _StandInHandler)
+    server.bodies = {}
+    server.delays = {}
+    server.drops = {}
+    server.requests = []
+    server.barrier = None
+    server.lock = threading.Lock()
+    server.in_flight = 0
+    server.peak_in_flight = 0
+    server.url = 'http://127.0.0.1:%d' % server.server_address[1]
+    thread = threading.Thread(target=server.serve_forever, args=(0.05,), daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
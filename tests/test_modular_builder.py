@@ -0,0 +1,165 @@
+"""
+Tests for the modular builder module
+"""
+import io
+import os
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from unittest.mock import patch
+
+import pytest
+
+# Add parent directory to path to import flora_pac_lib
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from flora_pac_lib import Dataset, PacBuilder
+from flora_pac_lib.ip_data import merge_all
+from flora_pac_lib.net_table import NetTable
+from flora_pac_lib.network_ops import net_ranges
+from flora_pac_lib.snapshot import write_snapshot
+from flora_pac_lib.stage_cache import StageCache
+from tests.conftest import NETWORKS, full_pac
+
+
+PROXIES = ['SOCKS5 127.0.0.1:1984', 'SOCKS5 127.0.0.1:1989']
+
+
+class TestModularBuilder:
+    """Test loading a Dataset once and rendering it with a PacBuilder"""
+    
+    def test_dataset_from_networks(self):
+        """Test networks are merged and the dataset is immutable"""
+        dataset = Dataset.from_networks(NETWORKS, source_date='20240101', serial=7)
+        
+        assert dataset.networks == merge_all(NetTable.from_networks(NETWORKS))
+        assert dataset.digest == NetTable.from_networks(NETWORKS).digest()
+        assert (dataset.source_date, dataset.serial) == ('20240101', 7)
+        assert dataset.loaded_at > 0
+        with pytest.raises(AttributeError):
+            dataset.serial = 8
+    
+    def test_dataset_load_snapshot(self, tmp_path):
+        """Test a dataset loaded from a snapshot keeps its metadata"""
+        path = str(tmp_path / 'ranges.bin')
+        merged = merge_all(NetTable.from_networks(NETWORKS))
+        write_snapshot(path, net_ranges(merged), '20240102', 42)
+        
+        dataset = Dataset.load(snapshot=path)
+        
+        assert dataset.networks == merged
+        assert (dataset.source_date, dataset.serial) == ('20240102', 42)
+    
+    def test_dataset_load_source(self, tmp_path):
+        """Test a dataset loaded from a local delegated file"""
+        path = tmp_path / 'delegated'
+        path.write_bytes(
+            b'2|apnic|20240103|2|19830613|20240103|+1000\n'
+            b'apnic|CN|ipv4|1.0.1.0|256|20110414|allocated\n'
+            b'apnic|CN|ipv4|1.0.2.0|512|20110414|allocated\n'
+        )
+        
+        dataset = Dataset.load(source=str(path))
+        
+        assert dataset.networks.to_networks() == NETWORKS[:2]
+        assert dataset.source_date == '20240103'
+    
+    def test_dataset_load_unknown_registry(self):
+        """Test unknown registries are rejected before fetching"""
+        with pytest.raises(ValueError, match="Unknown registry"):
+            Dataset.load(registries=['nowhere'])
+    
+    @pytest.mark.parametrize('balance,hoist_tables', [
+        ('no', False), ('host', True), ('local_ip', False)
+    ])
+    def test_render_matches_pipeline(self, balance, hoist_tables):
+        """Test rendering produces the one-shot PAC content"""
+        builder = PacBuilder(Dataset.from_networks(NETWORKS), hoist_tables=hoist_tables)
+        no_proxy = ['10.0.0.0/8', 'localhost']
+        
+        content = builder.render(PROXIES, balance, no_proxy)
+        
+        assert content == full_pac(merge_all(NetTable.from_networks(NETWORKS)), PROXIES, balance,
+                                   no_proxy, hoist_tables=hoist_tables)
+        assert builder.render_bytes(PROXIES, balance, no_proxy) == content.encode('utf-8')
+        stream, binary = io.StringIO(), io.BytesIO()
+        builder.write(stream, PROXIES, balance, no_proxy)
+        builder.write(binary, PROXIES, balance, no_proxy)
+        assert stream.getvalue() == content
+        assert binary.getvalue() == content.encode('utf-8')
+    
+    def test_render_other_engine(self):
+        """Test non-hash engines render through the builder"""
+        builder = PacBuilder(Dataset.from_networks(NETWORKS), engine='bsearch')
+        
+        content = builder.render(PROXIES)
+        
+        assert 'range_starts' in content
+        assert builder.tables.hashed_results is None
+    
+    def test_unknown_engine(self):
+        """Test unknown engines are rejected"""
+        with pytest.raises(ValueError, match="Unknown lookup engine"):
+            PacBuilder(Dataset.from_networks(NETWORKS), engine='nope')
+    
+    def test_render_does_not_rebuild(self):
+        """Test rendering many PACs never fragments or hashes again"""
+        builder = PacBuilder(Dataset.from_networks(NETWORKS))
+        
+        with patch('flora_pac_lib.pac_generator.fregment_nets') as mock_fregment, \
+                patch('flora_pac_lib.pac_generator.hash_nets') as mock_hash:
+            contents = {builder.render([f'PROXY 10.0.{i // 256}.{i % 256}:8080'])
+                        for i in range(1000)}
+        
+        assert len(contents) == 1000
+        mock_fregment.assert_not_called()
+        mock_hash.assert_not_called()
+    
+    @pytest.mark.parametrize('hoist_tables', [False, True])
+    def test_prefix_and_tail(self, hoist_tables):
+        """Test a PAC is the cached prefix followed by the rendered tail"""
+        builder = PacBuilder(Dataset.from_networks(NETWORKS), hoist_tables=hoist_tables)
+        
+        tail = builder.tail(PROXIES, 'host', ['localhost'])
+        
+        assert builder.render(PROXIES, 'host', ['localhost']) == builder.prefix + tail
+        assert builder.prefix_bytes == builder.prefix.encode('utf-8')
+        assert 'hashed_nets = [' in builder.prefix
+        assert 'hashed_nets' not in tail
+        assert "host == 'localhost'" in tail
+        assert len(tail) < 1024
+    
+    def test_render_does_not_render_prefix(self):
+        """Test rendering only renders the tail"""
+        builder = PacBuilder(Dataset.from_networks(NETWORKS), hoist_tables=True)
+        
+        with patch('flora_pac_lib.pac_generator._iter_pac_prefix') as mock_prefix, \
+                patch('flora_pac_lib.pac_generator._dedent_chunks') as mock_dedent:
+            builder.render_bytes(PROXIES)
+        
+        mock_prefix.assert_not_called()
+        mock_dedent.assert_not_called()
+    
+    def test_builders_share_stage_cache(self):
+        """Test a second builder reuses the tables of the first one"""
+        cache = StageCache()
+        dataset = Dataset.from_networks(NETWORKS, stage_cache=cache)
+        first = PacBuilder(dataset, stage_cache=cache)
+        
+        second = PacBuilder(dataset, stage_cache=cache, hoist_tables=True)
+        
+        third = PacBuilder(dataset, stage_cache=cache)
+        
+        assert second.tables is not first.tables
+        assert second.tables.lookup_code is first.tables.lookup_code
+        assert second.prefix_bytes != first.prefix_bytes
+        assert third.prefix_bytes is first.prefix_bytes
+    
+    def test_concurrent_render(self):
+        """Test a builder renders from many threads at once"""
+        builder = PacBuilder(Dataset.from_networks(NETWORKS))
+        proxies = [[f'PROXY 10.0.0.{i}:8080'] for i in range(64)]
+        
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            contents = list(executor.map(builder.render, proxies))
+        
+        assert contents == [builder.render(p) for p in proxies]
@@ -0,0 +1,162 @@
+"""
+Tests for the modular cache module
+"""
+import os
+import sys
+from unittest.mock import patch
+
+import pytest
+
+# Add parent directory to path to import flora_pac_lib
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from flora_pac_lib.cache import fetch_snapshot, snapshot_path
+from flora_pac_lib.ip_data import fetch_ip_data
+
+
+DELEGATED = b"""2|apnic|20230101|3|19830101|20230101|+1000
+apnic|CN|ipv4|1.0.1.0|256|20110414|allocated
+apnic|CN|ipv4|1.0.2.0|512|20110414|allocated
+"""
+
+
+class TestModularCache:
+    """Test the delegated file snapshot cache"""
+    
+    def test_fetch_snapshot_downloads_once_within_ttl(self, http_server, tmp_path):
+        """Test that a fresh snapshot is reused without any request"""
+        http_server.bodies['/delegated-apnic-latest'] = DELEGATED
+        url = http_server.url + '/delegated-apnic-latest'
+        
+        path = fetch_snapshot(url, str(tmp_path))
+        path_again = fetch_snapshot(url, str(tmp_path))
+        
+        assert path == path_again == snapshot_path(url, str(tmp_path))
+        with open(path, 'rb') as f:
+            assert f.read() == DELEGATED
+        assert len(http_server.requests) == 1
+    
+    def test_fetch_snapshot_revalidates_after_ttl(self, http_server, tmp_path):
+        """Test conditional revalidation of an expired snapshot"""
+        http_server.bodies['/delegated-apnic-latest'] = DELEGATED
+        url = http_server.url + '/delegated-apnic-latest'
+        
+        fetch_snapshot(url, str(tmp_path), ttl=0)
+        path = fetch_snapshot(url, str(tmp_path), ttl=0)
+        
+        # The second request was conditional and answered with 304
+        assert len(http_server.requests) == 2
+        assert http_server.requests[1].headers.get('If-None-Match') is not None
+        with open(path, 'rb') as f:
+            assert f.read() == DELEGATED
+    
+    def test_fetch_snapshot_downloads_changed_file(self, http_server, tmp_path):
+        """Test that a changed upstream file replaces the snapshot"""
+        http_server.bodies['/delegated-apnic-latest'] = DELEGATED
+        url = http_server.url + '/delegated-apnic-latest'
+        fetch_snapshot(url, str(tmp_path), ttl=0)
+        
+        changed = DELEGATED + b"apnic|CN|ipv4|27.8.0.0|1024|20110414|allocated\n"
+        http_server.bodies['/delegated-apnic-latest'] = changed
+        path = fetch_snapshot(url, str(tmp_path), ttl=0)
+        
+        with open(path, 'rb') as f:
+            assert f.read() == changed
+    
+    def test_fetch_snapshot_offline(self, http_server, tmp_path):
+        """Test that offline mode uses a stale snapshot and never connects"""
+        http_server.bodies['/delegated-apnic-latest'] = DELEGATED
+        url = http_server.url + '/delegated-apnic-latest'
+        
+        with pytest.raises(Exception, match='offline'):
+            fetch_snapshot(url, str(tmp_path), offline=True)
+        
+        fetch_snapshot(url, str(tmp_path))
+        path = fetch_snapshot(url, str(tmp_path), ttl=0, offline=True)
+        
+        assert os.path.exists(path)
+        assert len(http_server.requests) == 1
+    
+    def test_fetch_snapshot_http_error(self, http_server, tmp_path):
+        """Test that failed downloads raise and leave no snapshot behind"""
+        url = http_server.url + '/delegated-apnic-latest'
+        
+        with pytest.raises(Exception, match='HTTP 404'):
+            fetch_snapshot(url, str(tmp_path))
+        
+        assert not os.path.exists(snapshot_path(url, str(tmp_path)))
+    
+    def test_fetch_ip_data_repeat_from_cache(self, http_server, tmp_path, monkeypatch):
+        """Test that repeated fetch_ip_data calls are served from the cache"""
+        http_server.bodies['/delegated-apnic-latest'] = DELEGATED
+        monkeypatch.setattr('flora_pac_lib.ip_data.APNIC_URL',
+                            http_server.url + '/delegated-apnic-latest')
+        
+        first = fetch_ip_data(cache_dir=str(tmp_path))
+        with patch('flora_pac_lib.cache.time.sleep') as mock_sleep:
+            second = fetch_ip_data(cache_dir=str(tmp_path))
+        
+        assert first == second
+        assert [str(net) for net in second] == ['1.0.1.0/24', '1.0.2.0/23']
+        # The second call neither reached the server nor backed off
+        assert len(http_server.requests) == 1
+        mock_sleep.assert_not_called()
+    
+    def test_fetch_snapshot_resumes_dropped_transfer(self, http_server, tmp_path):
+        """Test that a transfer dropped mid-way is resumed with Range requests"""
+        body = DELEGATED * 200
+        http_server.bodies['/delegated-apnic-latest'] = body
+        http_server.drops['/delegated-apnic-latest'] = [len(body) // 3, len(body) // 3]
+        url = http_server.url + '/delegated-apnic-latest'
+        
+        path = fetch_snapshot(url, str(tmp_path), backoff=0)
+        
+        with open(path, 'rb') as f:
+            assert f.read() == body
+        assert [request.headers.get('Range') for request in http_server.requests] == [
+            None, 'bytes=%d-' % (len(body) // 3), 'bytes=%d-' % (len(body) // 3 * 2)
+        ]
+        assert not os.path.exists(path + '.part')
+    
+    def test_fetch_snapshot_resumes_earlier_partial_download(self, http_server, tmp_path):
+        """Test that a .part file left by an earlier run is resumed"""
+        http_server.bodies['/delegated-apnic-latest'] = DELEGATED
+        http_server.drops['/delegated-apnic-latest'] = [40]
+        url = http_server.url + '/delegated-apnic-latest'
+        
+        with pytest.raises(Exception, match='after 1 attempts'):
+            fetch_snapshot(url, str(tmp_path), retries=0)
+        assert os.path.getsize(snapshot_path(url, str(tmp_path)) + '.part') == 40
+        
+        path = fetch_snapshot(url, str(tmp_path), retries=0)
+        
+        with open(path, 'rb') as f:
+            assert f.read() == DELEGATED
+        assert http_server.requests[-1].headers.get('Range') == 'bytes=40-'
+    
+    def test_fetch_snapshot_restarts_when_remote_changed(self, http_server, tmp_path):
+        """Test that a partial download of an outdated file is not resumed"""
+        http_server.bodies['/delegated-apnic-latest'] = DELEGATED
+        http_server.drops['/delegated-apnic-latest'] = [40]
+        url = http_server.url + '/delegated-apnic-latest'
+        with pytest.raises(Exception):
+            fetch_snapshot(url, str(tmp_path), retries=0)
+        
+        changed = DELEGATED.replace(b'1.0.2.0', b'1.0.4.0')
+        http_server.bodies['/delegated-apnic-latest'] = changed
+        path = fetch_snapshot(url, str(tmp_path), retries=0)
+        
+        with open(path, 'rb') as f:
+            assert f.read() == changed
+    
+    def test_fetch_snapshot_gives_up_after_retries(self, http_server, tmp_path):
+        """Test the bounded number of attempts"""
+        http_server.bodies['/delegated-apnic-latest'] = DELEGATED
+        http_server.drops['/delegated-apnic-latest'] = [10, 10, 10]
+        url = http_server.url + '/delegated-apnic-latest'
+        
+        with pytest.raises(Exception, match='after 3 attempts'):
+            fetch_snapshot(url, str(tmp_path), retries=2, backoff=0)
+        
+        assert len(http_server.requests) == 3
+        assert not os.path.exists(snapshot_path(url, str(tmp_path)))
@@ -0,0 +1,158 @@
+"""
+Tests for the modular delta module
+"""
+import ipaddress
+import os
+import random
+import subprocess
+import sys
+
+import pytest
+
+# Add parent directory to path to import flora_pac_lib
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from flora_pac_lib.delta import HashTableCache, diff_ranges, diff_snapshots
+from flora_pac_lib.ip_data import merge_all
+from flora_pac_lib.net_table import NetTable
+from flora_pac_lib.pac_generator import generate_pac
+from flora_pac_lib.snapshot import write_snapshot
+from tests.conftest import full_pac
+
+
+PROXIES = ['SOCKS5 127.0.0.1:1984']
+
+FLORA_PAC = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'flora_pac.py')
+
+
+def _random_ranges(rng, count):
+    """Sorted, disjoint random ranges"""
+    ranges = []
+    address = 1 << 24
+    for _ in range(count):
+        address += rng.randrange(1, 64) << 8
+        size = rng.choice([256, 512, 768, 1024, 4096, 65536])
+        ranges.append((address, address + size - 1))
+        address += size
+    return ranges
+
+
+class TestModularDelta:
+    """Test snapshot deltas and incremental table regeneration"""
+    
+    def test_diff_ranges(self):
+        """Test added and removed ranges"""
+        old = [(0, 99), (200, 299), (400, 499)]
+        new = [(0, 149), (250, 299), (400, 419), (430, 499), (600, 609)]
+        
+        delta = diff_ranges(old, new)
+        
+        assert delta.added == [(100, 149), (600, 609)]
+        assert delta.removed == [(200, 249), (420, 429)]
+        assert delta.addresses == 50 + 10 + 50 + 10
+        assert diff_ranges(new, new) == ([], [])
+    
+    def test_diff_snapshots(self, tmp_path):
+        """Test diffing two snapshot files"""
+        write_snapshot(str(tmp_path / 'old.bin'), [(0, 255), (1024, 2047)])
+        write_snapshot(str(tmp_path / 'new.bin'), [(0, 511), (1024, 2047)])
+        
+        delta = diff_snapshots(str(tmp_path / 'old.bin'), str(tmp_path / 'new.bin'))
+        
+        assert delta.added == [(256, 511)]
+        assert delta.removed == []
+    
+    def test_update_matches_full_regeneration(self):
+        """Test that incremental updates give the full regeneration output"""
+        rng = random.Random(5)
+        ranges = _random_ranges(rng, 300)
+        cache = HashTableCache(NetTable.from_ranges(ranges), hash_base=101, mask_step=2)
+        
+        for _ in range(3):
+            # Drop a few ranges, grow a few others and add new ones
+            ranges = [r for r in ranges if rng.random() > 0.02]
+            ranges = [(start, end + 256 if rng.random() < 0.02 else end) for start, end in ranges]
+            ranges.append((ranges[-1][1] + 4096, ranges[-1][1] + 4096 + 1023))
+            merged = merge_all(NetTable.from_ranges(ranges))
+            
+            report = cache.update(merged)
+            
+            assert report.changed_buckets
+            assert len(report.changed_buckets) < 101
+            for hoist_tables in (False, True):
+                assert cache.render(PROXIES, 'no', [], hoist_tables=hoist_tables) == \
+                    full_pac(merged, PROXIES, hash_base=101, hoist_tables=hoist_tables)
+    
+    def test_update_without_change(self):
+        """Test that an unchanged snapshot re-emits nothing"""
+        merged = NetTable.from_ranges(_random_ranges(random.Random(1), 50))
+        cache = HashTableCache(merged, hash_base=101)
+        
+        report = cache.update(NetTable.from_ranges(merged.ranges()))
+        
+        assert report.changed_buckets == []
+        assert report.ranges == ([], [])
+        assert 'Delta: +0/-0 ranges (0 addresses)' in str(report)
+    
+    def test_iter_chunks_streams_segments(self):
+        """Test the tables are yielded one bucket segment at a time"""
+        merged = NetTable.from_ranges(_random_ranges(random.Random(3), 50))
+        cache = HashTableCache(merged, hash_base=101)
+        
+        tables = list(cache.iter_tables())
+        chunks = list(cache.iter_chunks(PROXIES, 'no', []))
+        
+        assert ''.join(tables) == cache.tables()
+        assert len(tables) == len(cache.segments) + 2
+        assert max(map(len, chunks)) < len(cache.tables())
+        assert ''.join(chunks) == cache.render(PROXIES, 'no', [])
+    
+    def test_save_and_load(self, tmp_path):
+        """Test persisting the cache between runs"""
+        merged = NetTable.from_ranges(_random_ranges(random.Random(2), 50))
+        cache = HashTableCache(merged, hash_base=101, mask_step=3)
+        path = str(tmp_path / 'tables.cache')
+        
+        cache.save(path)
+        loaded = HashTableCache.load(path)
+        
+        assert loaded.matches(101, 3)
+        assert not loaded.matches(101, 2)
+        assert loaded.tables() == cache.tables()
+    
+    def test_generate_pac_with_delta_cache(self, tmp_path):
+        """Test that a second run with a delta cache gives the full output"""
+        delegated = tmp_path / 'delegated'
+        cache_file = str(tmp_path / 'tables.cache')
+        output_file = str(tmp_path / 'flora_pac.pac')
+        delegated.write_bytes(b"apnic|CN|ipv4|1.0.1.0|256|20110414|allocated\n"
+                              b"apnic|CN|ipv4|27.8.0.0|1024|20110414|allocated\n")
+        generate_pac(PROXIES, 'no', [], hash_base=101, output_file=output_file,
+                     source=str(delegated), delta_cache=cache_file)
+        
+        delegated.write_bytes(b"apnic|CN|ipv4|1.0.1.0|256|20110414|allocated\n"
+                              b"apnic|CN|ipv4|1.0.2.0|512|20110414|allocated\n"
+                              b"apnic|CN|ipv4|27.8.0.0|1024|20110414|allocated\n")
+        generate_pac(PROXIES, 'no', [], hash_base=101, output_file=output_file,
+                     source=str(delegated), delta_cache=cache_file)
+        
+        merged = NetTable.from_networks([ipaddress.IPv4Network(n) for n in (
+            '1.0.1.0/24', '1.0.2.0/23', '27.8.0.0/22')])
+        with open(output_file) as f:
+            assert f.read() == full_pac(merged, PROXIES, hash_base=101)
+    
+    @pytest.mark.parametrize('engine', ['bsearch', 'bitmap', 'dict', 'mph'])
+    def test_delta_cache_requires_hash_engine(self, tmp_path, engine):
+        """Test that a delta cache is rejected with the other engines"""
+        cache_file = str(tmp_path / 'tables.cache')
+        
+        with pytest.raises(ValueError, match='requires the hash engine'):
+            generate_pac(PROXIES, 'no', [], output_file=str(tmp_path / 'flora_pac.pac'),
+                         engine=engine, delta_cache=cache_file)
+        assert not os.path.exists(cache_file)
+        
+        result = subprocess.run([sys.executable, FLORA_PAC, '-e', engine,
+                                 '--delta-cache', cache_file, '-o', str(tmp_path / 'cli.pac')],
+                                capture_output=True, text=True, timeout=60)
+        assert result.returncode == 2
+        assert '--delta-cache requires the hash engine' in result.stderr
@@ -0,0 +1,106 @@
+"""
+Tests for the import cost of flora_pac_lib
+"""
+import os
+import re
+import subprocess
+import sys
+
+import pytest
+
+# Add parent directory to path to import flora_pac_lib
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_ROOT)
+
+# Cumulative import time of flora_pac_lib, in microseconds. Loading gradio
+# eagerly took about 3 seconds, the package alone takes well under 50ms.
+IMPORT_BUDGET_US = 500000
+
+# Heavy modules only the web UI or downloads need
+HEAVY_MODULES = ('gradio', 'urllib3')
+
+
+def _run_python(*args, code=None):
+    """Run a fresh interpreter in the repository root and return its result."""
+    command = [sys.executable, *args]
+    if code is not None:
+        command += ['-c', code]
+    return subprocess.run(command, cwd=REPO_ROOT, capture_output=True, text=True, timeout=120)
+
+
+def _loaded_heavy_modules(code):
+    """Run code in a fresh interpreter and return the heavy modules it loaded."""
+    result = _run_python(code=code + "\nimport sys\n"
+                         f"print('loaded:' + ','.join(m for m in {HEAVY_MODULES!r} if m in sys.modules))")
+    assert result.returncode == 0, result.stderr
+    loaded = result.stdout.rsplit('loaded:', 1)[1].strip()
+    return loaded.split(',') if loaded else []
+
+
+class TestImportTime:
+    """Test that importing the package stays cheap"""
+    
+    def test_import_within_budget(self):
+        """Test the cumulative import time of flora_pac_lib"""
+        result = _run_python('-X', 'importtime', code="import flora_pac_lib")
+        assert result.returncode == 0, result.stderr
+        match = re.search(r'^import time:\s+\d+ \|\s+(\d+) \| flora_pac_lib$',
+                          result.stderr, re.MULTILINE)
+        assert match is not None
+        assert int(match.group(1)) < IMPORT_BUDGET_US
+    
+    def test_package_does_not_load_heavy_modules(self):
+        """Test that the generation modules load neither gradio nor urllib3"""
+        code = ("import flora_pac_lib\n"
+                "import flora_pac_lib.builder, flora_pac_lib.pac_generator, flora_pac_lib.sources")
+        assert _loaded_heavy_modules(code) == []
+    
+    def test_cli_help_does_not_load_heavy_modules(self):
+        """Test that the CLI parses its arguments without the heavy modules"""
+        code = ("import runpy, sys\n"
+                "sys.argv = ['flora_pac.py', '--help']\n"
+                "try:\n"
+                "    runpy.run_path('flora_pac.py', run_name='__main__')\n"
+                "except SystemExit:\n"
+                "    pass")
+        assert _loaded_heavy_modules(code) == []
+    
+    def test_import_without_gradio(self):
+        """Test that the package imports when gradio is not installed"""
+        result = _run_python(code="import sys\n"
+                             "sys.modules['gradio'] = None\n"
+                             "import flora_pac_lib\n"
+                             "print(flora_pac_lib.PacBuilder.__name__)")
+        assert result.returncode == 0, result.stderr
+        assert result.stdout.strip() == 'PacBuilder'
+
+
+class TestLazyAttributes:
+    """Test the attributes loaded on first access"""
+    
+    def test_web_ui_attributes(self):
+        """Test that the web UI functions are still exported"""
+        pytest.importorskip('gradio')
+        import flora_pac_lib
+        from flora_pac_lib import web_ui
+        
+        assert flora_pac_lib.create_web_ui is web_ui.create_web_ui
+        assert flora_pac_lib.launch_web_ui is web_ui.launch_web_ui
+        assert 'create_web_ui' in dir(flora_pac_lib)
+    
+    def test_unknown_attribute(self):
+        """Test that unknown attributes still raise AttributeError"""
+        import flora_pac_lib
+        
+        with pytest.raises(AttributeError):
+            flora_pac_lib.no_such_attribute
+    
+    def test_default_timeout(self):
+        """Test that cache.default_timeout builds the default urllib3 Timeout"""
+        urllib3 = pytest.importorskip('urllib3')
+        from flora_pac_lib import cache
+        
+        timeout = cache.default_timeout()
+        assert isinstance(timeout, urllib3.Timeout)
+        assert timeout.connect_timeout == cache.DEFAULT_CONNECT_TIMEOUT
+        assert timeout.read_timeout == cache.DEFAULT_READ_TIMEOUT
@@ -1,16 +1,36 @@
 """
 Tests for the modular ip_data module
 """
+import io
 import pytest
 import responses
 import ipaddress
+import random
+import threading
+from unittest.mock import patch
 import sys
 import os
 
 # Add parent directory to path to import flora_pac_lib
 sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
-from flora_pac_lib.ip_data import fetch_ip_data, merge_nets, merge_all
+from flora_pac_lib.ip_data import (
+    fetch_delegated, fetch_ip_data, fetch_registries, parse_delegated, parse_delegated_countries,
+    merge_nets, merge_all, range_to_cidrs
+)
+from flora_pac_lib.net_table import NetTable
+
+
+SAMPLE_DELEGATED = b"""2|apnic|20230101|46214|19830101|20230101|+1000
+apnic|*|ipv4|*|52371|summary
+apnic|CN|ipv4|1.0.1.0|256|20110414|allocated
+apnic|CN|ipv4|1.0.2.0|512|20110414|allocated
+apnic|cn|ipv4|27.8.0.0|1024|20110414|assigned
+apnic|CN|ipv4|36.0.0.0|4096|20110414|reserved
+apnic|JP|ipv4|1.0.16.0|4096|20110414|allocated
+apnic|CN|ipv6|2001:250::|35|20000426|allocated
+apnic|CN|asn|4134|1|20090423|allocated
+"""
 
 
 class TestModularIPData:
@@ -83,4 +103,220 @@ apnic|JP|ipv4|1.0.16.0|4096|20110414|allocated"""
         # Should merge into two /24 networks
         result_strs = sorted([str(net) for net in result])
         expected = ['192.168.0.0/24', '192.168.1.0/24']
-        assert result_strs == expected
\ No newline at end of file
+        assert result_strs == expected
+    
+    def test_merge_all_modular_matches_collapse_addresses(self):
+        """Test merge_all against the stdlib on a synthetic range set"""
+        rnd = random.Random(5)
+        networks = []
+        address = 1 << 24
+        while len(networks) < 5000:
+            prefixlen = rnd.randint(20, 28)
+            size = 1 << (32 - prefixlen)
+            address = (address + size - 1) // size * size
+            networks.append(ipaddress.ip_network((address, prefixlen)))
+            address += size * rnd.choice([1, 1, 1, 2, 3])
+        rnd.shuffle(networks)
+        
+        result = merge_all(networks)
+        
+        assert result == list(ipaddress.collapse_addresses(networks))
+    
+    def test_merge_all_modular_overlapping_networks(self):
+        """Test that contained and duplicate networks are absorbed"""
+        networks = [
+            ipaddress.ip_network('10.0.0.0/16'),
+            ipaddress.ip_network('10.0.4.0/24'),
+            ipaddress.ip_network('10.0.0.0/16'),
+            ipaddress.ip_network('10.2.0.0/17'),
+        ]
+        
+        result = merge_all(networks)
+        
+        assert [str(net) for net in result] == ['10.0.0.0/16', '10.2.0.0/17']
+        # Networks that needed no merging are passed through unchanged
+        assert result[0] is networks[0] or result[0] is networks[2]
+    
+    def test_range_to_cidrs(self):
+        """Test minimal CIDR decomposition of integer ranges"""
+        start = int(ipaddress.ip_address('1.0.1.0'))
+        
+        assert range_to_cidrs(start, start + 255) == [(start, 24)]
+        # 768 addresses from 1.0.2.0 are a /23 followed by a /24
+        assert range_to_cidrs(start + 256, start + 256 + 767) == [(start + 256, 23), (start + 768, 24)]
+        # ...and a /24 followed by a /23 from 1.0.1.0
+        assert range_to_cidrs(start, start + 767) == [(start, 24), (start + 256, 23)]
+        assert range_to_cidrs(0, 0xFFFFFFFF) == [(0, 0)]
+        assert range_to_cidrs(5, 4) == []
+
+    
+    def test_parse_delegated_modular(self):
+        """Test parsing CN IPv4 records from a delegated file stream"""
+        result = parse_delegated(io.BytesIO(SAMPLE_DELEGATED))
+        
+        assert [str(net) for net in result] == ['1.0.1.0/24', '1.0.2.0/23', '27.8.0.0/22']
+    
+    def test_parse_delegated_modular_other_country(self):
+        """Test selecting another country code"""
+        result = parse_delegated(io.BytesIO(SAMPLE_DELEGATED), country='JP')
+        
+        assert [str(net) for net in result] == ['1.0.16.0/20']
+    
+    def test_parse_delegated_modular_malformed_entries(self):
+        """Test that malformed records are skipped with a warning"""
+        data = [
+            b'apnic|CN|ipv4|1.0.1.0|256|20110414|allocated\n',
+            b'apnic|CN|ipv4|1.0.1|256|20110414|allocated\n',       # bad address
+            b'apnic|CN|ipv4|1.0.300.0|256|20110414|allocated\n',   # bad octet
+            b'apnic|CN|ipv4|1.0.4.0|abc|20110414|allocated\n',     # bad count
+            b'apnic|CN|ipv4|1.0.5.0|0|20110414|allocated\n',       # empty range
+            b'apnic|CN|ipv4|255.255.255.0|512|20110414|allocated\n',  # past the end
+        ]
+        
+        with patch('builtins.print') as mock_print:
+            result = parse_delegated(data)
+        
+        assert [str(net) for net in result] == ['1.0.1.0/24']
+        assert mock_print.call_count == 5
+    
+    def test_parse_delegated_modular_non_power_of_two_counts(self):
+        """Test that counts like 768 and 1536 are decomposed exactly"""
+        data = [
+            b'apnic|CN|ipv4|1.0.8.0|768|20110414|allocated\n',
+            b'apnic|CN|ipv4|1.0.16.0|1536|20110414|allocated\n',
+            b'apnic|CN|ipv4|1.0.32.128|256|20110414|allocated\n',  # unaligned start
+        ]
+        
+        with patch('builtins.print') as mock_print:
+            result = parse_delegated(data)
+        
+        assert [str(net) for net in result] == [
+            '1.0.8.0/23', '1.0.10.0/24',
+            '1.0.16.0/22', '1.0.20.0/23',
+            '1.0.32.128/25', '1.0.33.0/25',
+        ]
+        assert sum(net.num_addresses for net in result) == 768 + 1536 + 256
+        mock_print.assert_not_called()
+    
+    def test_fetch_ip_data_modular_streams_response(self, http_server):
+        """Test fetching from a local stand-in for the APNIC server"""
+        http_server.bodies['/delegated-apnic-latest'] = SAMPLE_DELEGATED
+        
+        with patch('flora_pac_lib.ip_data.APNIC_URL', http_server.url + '/delegated-apnic-latest'):
+            result = fetch_ip_data()
+        
+        assert [str(net) for net in result] == ['1.0.1.0/24', '1.0.2.0/23', '27.8.0.0/22']
+    
+    def test_fetch_ip_data_modular_http_error(self, http_server):
+        """Test that HTTP errors are raised"""
+        with patch('flora_pac_lib.ip_data.APNIC_URL', http_server.url + '/missing'):
+            with pytest.raises(Exception, match='HTTP 404'):
+                fetch_ip_data()
+    
+    def test_fetch_delegated_retries(self):
+        """Test that connection failures are retried with the given backoff"""
+        import socket
+        with socket.socket() as sock:
+            sock.bind(('127.0.0.1', 0))
+            url = 'http://127.0.0.1:%d/delegated' % sock.getsockname()[1]
+        
+        # The port is closed now, every attempt is refused
+        with patch('urllib3.util.retry.Retry.sleep') as mock_sleep:
+            with pytest.raises(Exception):
+                fetch_delegated(url, retries=2, backoff=0.25)
+            assert mock_sleep.call_count == 2
+            mock_sleep.reset_mock()
+            with pytest.raises(Exception):
+                fetch_delegated(url, retries=0)
+            mock_sleep.assert_not_called()
+    
+    def test_fetch_registries_merges_all_files(self, http_server):
+        """Test that the files of several registries are merged into one set"""
+        http_server.bodies['/apnic'] = SAMPLE_DELEGATED
+        http_server.bodies['/arin'] = (b"2|arin|20230102|2|19830101|20230102|-0500\n"
+                                       b"arin|CN|ipv4|1.0.4.0|1024|20110414|allocated\n"
+                                       b"arin|US|ipv4|3.0.0.0|16777216|19880223|allocated\n")
+        http_server.bodies['/ripencc'] = b"ripencc|CN|ipv4|5.10.0.0|256|20120101|assigned\n"
+        urls = {name: http_server.url + '/' + name for name in ('apnic', 'arin', 'ripencc')}
+        headers = {}
+        
+        result = fetch_registries(urls, headers=headers)
+        
+        # 1.0.2.0/23 (APNIC) and 1.0.4.0/22 (ARIN) are merged across files
+        assert [str(net) for net in result] == [
+            '1.0.1.0/24', '1.0.2.0/23', '1.0.4.0/22', '5.10.0.0/24', '27.8.0.0/22'
+        ]
+        assert headers['apnic']['enddate'] == '20230101'
+        assert headers['arin']['enddate'] == '20230102'
+        assert isinstance(fetch_registries(urls, as_table=True), NetTable)
+    
+    def test_fetch_registries_concurrently(self, http_server):
+        """Test that the registries are all requested at the same time"""
+        names = ('apnic', 'arin', 'ripencc', 'lacnic', 'afrinic')
+        for name in names:
+            http_server.bodies['/' + name] = SAMPLE_DELEGATED
+        # Every response waits for the requests of all the registries
+        http_server.barrier = threading.Barrier(len(names))
+        urls = {name: http_server.url + '/' + name for name in names}
+        
+        result = fetch_registries(urls)
+        
+        assert len(http_server.requests) == len(names)
+        assert [str(net) for net in result] == ['1.0.1.0/24', '1.0.2.0/23', '27.8.0.0/22']
+        assert http_server.peak_in_flight == len(names)
+    
+    def test_fetch_registries_http_error(self, http_server):
+        """Test that a failing registry is reported by name"""
+        http_server.bodies['/apnic'] = SAMPLE_DELEGATED
+        urls = {'apnic': http_server.url + '/apnic', 'lacnic': http_server.url + '/missing'}
+        
+        with pytest.raises(Exception, match='lacnic.*HTTP 404'):
+            fetch_registries(urls)
+    
+    def test_parse_delegated_countries_single_pass(self):
+        """Test bucketing every IPv4 and IPv6 record by country"""
+        lines = SAMPLE_DELEGATED.splitlines(keepends=True) + [
+            b'apnic|HK|ipv4|1.32.0.0|1024|20110414|allocated\n',
+            b'apnic|HK|ipv6|2001:df0::|32|20110414|assigned\n',
+            b'apnic||ipv4|1.64.0.0|256||available\n',
+        ]
+        header = {}
+        
+        tables = parse_delegated_countries(iter(lines), header=header)
+        
+        assert sorted(tables) == ['cn', 'hk', 'jp']
+        assert [str(net) for net in tables['cn'].ipv4.to_networks()] == [
+            '1.0.1.0/24', '1.0.2.0/23', '27.8.0.0/22'
+        ]
+        assert tables['cn'].ipv6 == [(int(ipaddress.IPv6Address('2001:250::')), 35)]
+        assert [str(net) for net in tables['hk'].ipv4.to_networks()] == ['1.32.0.0/22']
+        assert tables['hk'].ipv6 == [(int(ipaddress.IPv6Address('2001:df0::')), 32)]
+        assert len(tables['jp'].ipv4) == 1
+        assert header['serial'] == 20230101
+    
+    def test_parse_delegated_countries_selected(self):
+        """Test selecting countries, including one without records"""
+        tables = parse_delegated_countries(SAMPLE_DELEGATED.splitlines(), ['CN', 'mo'], ipv6=False)
+        
+        assert sorted(tables) == ['cn', 'mo']
+        assert len(tables['cn'].ipv4) == 3
+        assert tables['cn'].ipv6 == []
+        assert len(tables['mo'].ipv4) == 0
+    
+    def test_parse_delegated_several_countries(self):
+        """Test that parse_delegated keeps the union of several countries"""
+        result = parse_delegated(SAMPLE_DELEGATED.splitlines(), ['cn', 'jp'])
+        
+        assert sorted(str(net) for net in result) == [
+            '1.0.1.0/24', '1.0.16.0/20', '1.0.2.0/23', '27.8.0.0/22'
+        ]
+    
+    def test_parse_delegated_countries_malformed_ipv6(self):
+        """Test that malformed IPv6 records are skipped with a warning"""
+        lines = [b'apnic|CN|ipv6|2001:250::1|35|20000426|allocated\n']
+        
+        with patch('builtins.print') as mock_print:
+            tables = parse_delegated_countries(lines)
+        
+        assert len(tables['cn'].ipv4) == 0 and tables['cn'].ipv6 == []
+        assert 'Skipping malformed entry' in mock_print.call_args[0][0]
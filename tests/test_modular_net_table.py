@@ -0,0 +1,100 @@
+"""
+Tests for the modular net_table module
+"""
+import ipaddress
+import os
+import pickle
+import sys
+
+import pytest
+
+# Add parent directory to path to import flora_pac_lib
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from flora_pac_lib.ip_data import merge_all, parse_delegated
+from flora_pac_lib.net_table import NetTable, iter_nets
+from flora_pac_lib.network_ops import (
+    calculate_prefix_range, fregment_nets, group_by_prefixlen, hash_nets,
+    net_ranges, prefixlen_histogram
+)
+from tests.conftest import NETWORKS, full_pac
+
+
+class TestModularNetTable:
+    """Test the array-backed network table"""
+    
+    def test_round_trip(self):
+        """Test conversion from and back to IPv4Network objects"""
+        table = NetTable.from_networks(NETWORKS)
+        
+        assert len(table) == len(NETWORKS)
+        assert table.addresses.typecode == 'I'
+        assert table.prefixlens.typecode == 'B'
+        assert table.to_networks() == NETWORKS
+        assert list(table) == list(iter_nets(NETWORKS))
+    
+    def test_mismatched_arrays(self):
+        """Test that both arrays must have the same length"""
+        with pytest.raises(ValueError):
+            NetTable([1, 2], [24])
+    
+    def test_from_ranges_is_minimal(self):
+        """Test that from_ranges decomposes ranges into the fewest networks"""
+        start = int(ipaddress.IPv4Address('1.0.2.0'))
+        table = NetTable.from_ranges([(start, start + 767)])
+        
+        assert [str(net) for net in table.to_networks()] == ['1.0.2.0/23', '1.0.4.0/24']
+    
+    def test_pipeline_matches_list_pipeline(self):
+        """Test that every pipeline step gives the list results for a table"""
+        table = NetTable.from_networks(NETWORKS)
+        
+        merged = merge_all(table)
+        assert isinstance(merged, NetTable)
+        assert merged.to_networks() == merge_all(NETWORKS)
+        assert net_ranges(merged) == net_ranges(merge_all(NETWORKS))
+        assert prefixlen_histogram(merged) == prefixlen_histogram(merge_all(NETWORKS))
+        
+        for kwargs in ({'mask_step': 2}, {'mask_step': 3}, {'prefix_lengths': [16, 24]}):
+            fragmented = fregment_nets(merged, **kwargs)
+            assert fragmented.to_networks() == fregment_nets(merge_all(NETWORKS), **kwargs)
+            assert calculate_prefix_range(fragmented) == calculate_prefix_range(fragmented.to_networks())
+            assert group_by_prefixlen(fragmented) == group_by_prefixlen(fragmented.to_networks())
+            
+            buckets = hash_nets(fragmented, 101)
+            assert [bucket.to_networks() for bucket in buckets] == hash_nets(fragmented.to_networks(), 101)
+    
+    def test_fregment_nets_without_target(self):
+        """Test that a table network without target length is rejected"""
+        with pytest.raises(ValueError, match='No target prefix length'):
+            fregment_nets(NetTable.from_networks(NETWORKS), prefix_lengths=[8])
+    
+    def test_parse_delegated_as_table(self):
+        """Test parsing straight into a table"""
+        lines = [
+            b'apnic|CN|ipv4|1.0.1.0|256|20110414|allocated\n',
+            b'apnic|CN|ipv4|1.0.2.0|768|20110414|allocated\n',
+        ]
+        
+        table = parse_delegated(lines, as_table=True)
+        
+        assert isinstance(table, NetTable)
+        assert table.to_networks() == parse_delegated(lines)
+    
+    def test_digest_and_pickle(self):
+        """Test that the digest follows the content and pickling keeps it"""
+        table = NetTable.from_networks(NETWORKS)
+        
+        restored = pickle.loads(pickle.dumps(table))
+        
+        assert restored == table
+        assert restored.digest() == table.digest()
+        assert NetTable.from_networks(NETWORKS[:-1]).digest() != table.digest()
+    
+    def test_pac_content_identical(self):
+        """Test that table and list pipelines generate the same PAC file"""
+        def build(nets):
+            return full_pac(merge_all(nets), ['SOCKS5 127.0.0.1:1984'], hash_base=101,
+                            hoist_tables=True)
+        
+        assert build(NetTable.from_networks(NETWORKS)) == build(NETWORKS)
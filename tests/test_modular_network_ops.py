@@ -3,6 +3,8 @@ Tests for the modular network_ops module
 """
 import pytest
 import ipaddress
+import itertools
+import random
 import sys
 import os
 
@@ -10,7 +12,9 @@ import os
 sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
 from flora_pac_lib.network_ops import (
-    fregment_net, fregment_nets, hash_address, hash_nets, calculate_prefix_range
+    fregment_net, fregment_nets, hash_address, hash_nets, hash_multipliers,
+    calculate_prefix_range, net_ranges, block_map, group_by_prefixlen,
+    perfect_hash_mix, build_perfect_hash, prefixlen_histogram, plan_prefix_lengths
 )
 
 
@@ -114,6 +118,19 @@ class TestModularNetworkOps:
         for bucket in result:
             assert bucket == []
     
+    def test_hash_multipliers_match_hash_address(self):
+        """Test that the closed-form PAC hash is bit-exact with hash_address"""
+        for mod_base in (3, 1009, 3011, 9973):
+            multipliers = hash_multipliers(mod_base)
+            assert len(multipliers) == 33
+            
+            for ip in (0, 1, 0x01000107, 0x7F000001, 0xCBD02809, 0xFFFFFFFF):
+                for prefixlen in range(1, 33):
+                    offset = 32 - prefixlen
+                    closed_form = (ip >> offset) % mod_base * multipliers[prefixlen] % mod_base
+                    network = ipaddress.ip_network((ip >> offset << offset, prefixlen))
+                    assert closed_form == hash_address(network.network_address, mod_base)
+    
     def test_calculate_prefix_range_modular(self):
         """Test calculate_prefix_range function"""
         networks = [
@@ -142,4 +159,147 @@ class TestModularNetworkOps:
         min_prefix, max_prefix = calculate_prefix_range(networks)
         
         assert min_prefix == 24
-        assert max_prefix == 24
\ No newline at end of file
+        assert max_prefix == 24
+    
+    def test_net_ranges_coalesces_adjacent_and_overlapping(self):
+        """Test that net_ranges returns sorted, disjoint ranges"""
+        networks = [
+            ipaddress.ip_network('10.0.1.0/24'),
+            ipaddress.ip_network('10.0.0.0/24'),    # adjacent, not a buddy merge
+            ipaddress.ip_network('10.0.1.128/25'),  # contained
+            ipaddress.ip_network('10.0.4.0/24'),
+        ]
+        
+        assert net_ranges(networks) == [
+            (int(ipaddress.ip_address('10.0.0.0')), int(ipaddress.ip_address('10.0.1.255'))),
+            (int(ipaddress.ip_address('10.0.4.0')), int(ipaddress.ip_address('10.0.4.255'))),
+        ]
+        assert net_ranges([]) == []
+
+    
+    def test_block_map_classifies_blocks(self):
+        """Test that block_map marks full, empty and mixed /16 blocks"""
+        ranges = net_ranges([
+            ipaddress.ip_network('10.0.0.0/15'),     # two full blocks
+            ipaddress.ip_network('10.2.1.0/24'),     # part of one block
+            ipaddress.ip_network('10.2.8.0/22'),
+        ])
+        
+        status, mixed_blocks = block_map(ranges)
+        
+        assert len(status) == 65536
+        assert status[(10 << 8) + 0] == '1'
+        assert status[(10 << 8) + 1] == '1'
+        assert status[(10 << 8) + 2] == '2'
+        assert status[(10 << 8) + 3] == '0'
+        assert status.count('0') == 65536 - 3
+        assert mixed_blocks == {(10 << 8) + 2: [(0x0100, 0x01FF), (0x0800, 0x0BFF)]}
+
+    
+    def test_group_by_prefixlen(self):
+        """Test that networks are grouped into shifted keys per prefix length"""
+        networks = fregment_nets([
+            ipaddress.ip_network('10.0.0.0/15'),
+            ipaddress.ip_network('192.168.1.0/24'),
+        ], mask_step=8)
+        
+        grouped = group_by_prefixlen(networks)
+        
+        assert list(grouped) == [16, 24]
+        assert grouped[16] == [(10 << 8) + 0, (10 << 8) + 1]
+        assert grouped[24] == [(192 << 16) + (168 << 8) + 1]
+
+    
+    def test_build_perfect_hash_is_minimal_and_exact(self):
+        """Test that every key lands in its own slot and n keys use n slots"""
+        keys = random.Random(7).sample(range(1 << 24), 5000)
+        
+        displacements, slot_keys = build_perfect_hash(keys)
+        
+        assert sorted(slot_keys) == sorted(keys)
+        for key in keys:
+            d = displacements[perfect_hash_mix(key, 0) % len(displacements)]
+            slot = -d - 1 if d < 0 else perfect_hash_mix(key, d) % len(slot_keys)
+            assert slot_keys[slot] == key
+    
+    def test_build_perfect_hash_small_inputs(self):
+        """Test perfect hash construction with zero, one and two keys"""
+        assert build_perfect_hash([]) == ([0], [])
+        
+        displacements, slot_keys = build_perfect_hash([42])
+        assert slot_keys == [42]
+        
+        displacements, slot_keys = build_perfect_hash([1, 2])
+        assert sorted(slot_keys) == [1, 2]
+    
+    def test_build_perfect_hash_apnic_size(self):
+        """Test a table the size of the APNIC CN set maps every key to its own slot"""
+        keys = random.Random(11).sample(range(1 << 24), 10000)
+        
+        displacements, slot_keys = build_perfect_hash(keys)
+        
+        slots = set()
+        for key in keys:
+            d = displacements[perfect_hash_mix(key, 0) % len(displacements)]
+            slot = -d - 1 if d < 0 else perfect_hash_mix(key, d) % len(slot_keys)
+            assert slot_keys[slot] == key
+            slots.add(slot)
+        assert len(slots) == len(keys) == len(slot_keys)
+    
+    def test_fregment_net_explicit_prefix_lengths(self):
+        """Test fragmentation to the smallest explicit target length"""
+        net = ipaddress.ip_network('10.0.0.0/17')
+        
+        result = fregment_net(net, prefix_lengths=[16, 19, 24])
+        
+        assert len(result) == 4
+        assert all(subnet.prefixlen == 19 for subnet in result)
+        
+        with pytest.raises(ValueError):
+            fregment_net(ipaddress.ip_network('10.0.0.0/25'), prefix_lengths=[16, 24])
+    
+    def test_prefixlen_histogram(self):
+        """Test counting networks per prefix length"""
+        networks = [
+            ipaddress.ip_network('10.0.0.0/16'),
+            ipaddress.ip_network('10.1.0.0/24'),
+            ipaddress.ip_network('10.2.0.0/24'),
+        ]
+        
+        assert prefixlen_histogram(networks) == {16: 1, 24: 2}
+    
+    def test_plan_prefix_lengths_is_optimal(self):
+        """Test the planner against a brute force search over all target sets"""
+        def entries(histogram, plan):
+            return sum(count << (min(t for t in plan if t >= length) - length)
+                       for length, count in histogram.items())
+        
+        rnd = random.Random(3)
+        for _ in range(50):
+            lengths = sorted(rnd.sample(range(8, 25), rnd.randint(1, 6)))
+            histogram = {length: rnd.randint(1, 300) for length in lengths}
+            
+            for probes in range(1, len(lengths) + 1):
+                brute_force = min(
+                    entries(histogram, list(targets) + [lengths[-1]])
+                    for targets in itertools.combinations(lengths[:-1], probes - 1)
+                )
+                plan = plan_prefix_lengths(histogram, max_probes=probes)
+                
+                assert len(plan) <= probes
+                assert plan[-1] == lengths[-1]
+                assert entries(histogram, plan) == brute_force
+    
+    def test_plan_prefix_lengths_budgets(self):
+        """Test the default objective and the entry budget"""
+        histogram = {8: 1, 16: 10, 24: 1000}
+        
+        # 2 probes x 1266 entries beats 3 probes x 1011 and 1 probe x 69096
+        assert plan_prefix_lengths(histogram) == [16, 24]
+        # Fewest probes whose expansion fits the budget
+        assert plan_prefix_lengths(histogram, max_entries=1100) == [8, 16, 24]
+        assert plan_prefix_lengths(histogram, max_probes=1) == [24]
+        assert plan_prefix_lengths({}) == []
+        
+        with pytest.raises(ValueError):
+            plan_prefix_lengths(histogram, max_probes=1, max_entries=1000)
@@ -1,8 +1,11 @@
 """
 Tests for the modular pac_generator module
 """
+import gzip
+import io
 import pytest
 import tempfile
+import textwrap
 import os
 from unittest.mock import patch, mock_open, MagicMock
 import ipaddress
@@ -13,8 +16,44 @@ sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
 from flora_pac_lib.pac_generator import (
     generate_balanced_proxy, generate_no_proxy, generate_pac,
-    _generate_pac_content, _print_generation_stats
+    _generate_pac_content, _print_generation_stats, _print_dict_stats, _dict_stats, write_pac,
+    _iter_pac_content
 )
+from flora_pac_lib.network_ops import fregment_nets, hash_nets, calculate_prefix_range
+
+
+SAMPLE_NETWORKS = [
+    ipaddress.ip_network('1.0.1.0/24'),
+    ipaddress.ip_network('1.0.2.0/23'),
+    ipaddress.ip_network('27.8.0.0/13'),
+    ipaddress.ip_network('36.0.0.0/10'),
+    ipaddress.ip_network('203.208.32.0/19'),
+]
+
+SAMPLE_HOSTS = [
+    '1.0.1.7', '1.0.2.200', '1.0.3.255', '1.0.4.1', '27.15.255.255', '27.16.0.0',
+    '36.63.1.1', '36.64.0.1', '203.208.40.9', '203.208.64.1', '8.8.8.8', '192.168.0.9',
+]
+
+
+def _build_pac(networks=SAMPLE_NETWORKS, hash_base=101, mask_step=2, **kwargs):
+    """Run the fragment/hash pipeline on networks and render a PAC"""
+    fragmented = fregment_nets(networks, mask_step, kwargs.get('prefix_lengths'))
+    min_prefixlen, max_prefixlen = calculate_prefix_range(fragmented)
+    return _generate_pac_content(
+        hash_nets(fragmented, hash_base), ['SOCKS5 127.0.0.1:1984'], 'no', ['192.168.0.0/24'],
+        hash_base, mask_step, min_prefixlen, max_prefixlen, networks, **kwargs
+    )
+
+
+def _expected_decisions(networks=SAMPLE_NETWORKS, hosts=SAMPLE_HOSTS):
+    """Decisions a correct PAC must make for hosts"""
+    direct_nets = list(networks) + [ipaddress.ip_network('192.168.0.0/24')]
+    return [
+        'DIRECT' if any(ipaddress.ip_address(h) in net for net in direct_nets)
+        else 'SOCKS5 127.0.0.1:1984'
+        for h in hosts
+    ]
 
 
 class TestModularPACGenerator:
@@ -218,4 +257,270 @@ class TestModularPACGenerator:
         assert any('Average matching length' in content for content in printed_content)
         assert any('Steps to match' in content for content in printed_content)
         assert any('Rules: 1 items' in content for content in printed_content)
-        assert any('test.pac' in content for content in printed_content)
\ No newline at end of file
+        assert any('test.pac' in content for content in printed_content)
+    
+    def test_generate_pac_content_hoisted_structure(self):
+        """Test that hoisted tables and helpers sit outside FindProxyForURL"""
+        content = _build_pac(hoist_tables=True)
+        
+        table_pos = content.index('var hashed_nets = [')
+        function_pos = content.index('function FindProxyForURL(url, host) {')
+        
+        # Table, constants and helpers are all declared before the function
+        assert table_pos < function_pos
+        assert content.index('lookup_ip = function(ip)') < function_pos
+        assert content.index('HASH_BASE = 101') < function_pos
+        
+        # The function body only holds the per-request logic
+        body = content[function_pos:]
+        assert 'hashed_nets' not in body
+        assert 'lookup_ip(ip)' in body
+        assert "return 'SOCKS5 127.0.0.1:1984'" in body
+        
+        # Top level helpers must not be indented like function locals
+        assert '\nlookup_ip = function(ip) {' in content
+    
+    def test_generate_pac_content_inline_structure(self):
+        """Test that the default layout keeps the table inside FindProxyForURL"""
+        content = _build_pac()
+        
+        function_pos = content.index('function FindProxyForURL(url, host) {')
+        assert function_pos < content.index('var hashed_nets = [')
+        assert function_pos < content.index('lookup_ip = function(ip)')
+    
+    def test_generate_pac_content_hoisted_same_decisions(self, run_pac):
+        """Test that hoisting the tables does not change any proxy decision"""
+        expected = _expected_decisions()
+        
+        assert run_pac(_build_pac(), SAMPLE_HOSTS) == expected
+        assert run_pac(_build_pac(hoist_tables=True), SAMPLE_HOSTS) == expected
+
+    
+    def test_generate_pac_content_integer_match_structure(self):
+        """Test that integer matching drops the string rebuilding helpers"""
+        content = _build_pac(integer_match=True)
+        lookup = content[content.index('lookup_ip = function(ip)'):]
+        lookup = lookup[:lookup.index('};')]
+        
+        assert '(n_ip >>> (32 - i[1])) === i[0]' in lookup
+        assert 'rebuild_net = function' not in content
+        assert 'num2dot = function' not in content
+        assert 'prefixlen2mask = function' not in content
+        
+        # isInNet is still used for the user's no-proxy networks
+        assert "isInNet(ip, '192.168.0.0', '255.255.255.0')" in content
+    
+    def test_generate_pac_content_integer_match_same_decisions(self, run_pac):
+        """Test that integer matching makes the same decisions as isInNet"""
+        expected = _expected_decisions()
+        
+        assert run_pac(_build_pac(integer_match=True), SAMPLE_HOSTS) == expected
+        assert run_pac(_build_pac(integer_match=True, hoist_tables=True), SAMPLE_HOSTS) == expected
+
+    
+    def test_generate_pac_content_bsearch_structure(self):
+        """Test that the bsearch engine emits sorted range arrays"""
+        content = _build_pac(engine='bsearch')
+        
+        assert 'range_starts = [16777472, 453509120, 603979776, 3419414528];' in content
+        assert 'range_ends = [16778239, 454033407, 608174079, 3419422719];' in content
+        assert 'hashed_nets' not in content
+        assert 'HASH_BASE' not in content
+    
+    def test_generate_pac_content_bsearch_same_decisions(self, run_pac):
+        """Test that the bsearch engine makes the same decisions as the hash engine"""
+        expected = _expected_decisions()
+        
+        assert run_pac(_build_pac(engine='bsearch'), SAMPLE_HOSTS) == expected
+        assert run_pac(_build_pac(engine='bsearch', hoist_tables=True), SAMPLE_HOSTS) == expected
+    
+    def test_generate_pac_content_unknown_engine(self):
+        """Test that unknown engines are rejected"""
+        with pytest.raises(ValueError):
+            _build_pac(engine='linear')
+
+    
+    def test_generate_pac_content_bitmap_structure(self):
+        """Test that the bitmap engine emits one status character per /16"""
+        content = _build_pac(engine='bitmap')
+        
+        block_map = content[content.index("block_map = '") + len("block_map = '"):]
+        block_map = block_map[:block_map.index("';")].replace("' +\n    '", '')
+        assert len(block_map) == 65536
+        
+        # 27.8.0.0/13 covers whole /16 blocks, 1.0.1.0/24 only part of one
+        assert block_map[(27 << 8) + 8] == '1'
+        assert block_map[(27 << 8) + 16] == '0'
+        assert block_map[1 << 8] == '2'
+        assert '\n    256: [256, 1023],' in content
+        assert 'hashed_nets' not in content
+    
+    def test_generate_pac_content_bitmap_same_decisions(self, run_pac):
+        """Test that the bitmap engine makes the same decisions as the hash engine"""
+        expected = _expected_decisions()
+        
+        assert run_pac(_build_pac(engine='bitmap'), SAMPLE_HOSTS) == expected
+        assert run_pac(_build_pac(engine='bitmap', hoist_tables=True), SAMPLE_HOSTS) == expected
+
+    
+    def test_generate_pac_content_dict_structure(self):
+        """Test that the dict engine emits one exact-match object per prefix length"""
+        content = _build_pac(engine='dict')
+        
+        assert '[24, {\n      65537: 1, 65538: 1, 65539: 1\n    }],' in content
+        assert '[10, {\n      144: 1\n    }],' in content
+        assert 'hashed_nets' not in content
+        assert 'HASH_BASE' not in content
+    
+    def test_generate_pac_content_dict_same_decisions(self, run_pac):
+        """Test that the dict engine makes the same decisions as the hash engine"""
+        expected = _expected_decisions()
+        
+        assert run_pac(_build_pac(engine='dict'), SAMPLE_HOSTS) == expected
+        assert run_pac(_build_pac(engine='dict', hoist_tables=True), SAMPLE_HOSTS) == expected
+    
+    @patch('builtins.print')
+    def test_print_dict_stats_reports_hash_layout_size(self, mock_print):
+        """Test that the dict engine stats compare against the hash layout"""
+        fragmented = fregment_nets(SAMPLE_NETWORKS, 2)
+        
+        _print_dict_stats(_dict_stats(fragmented, 101, 2), SAMPLE_NETWORKS, 101, 'test.pac')
+        
+        printed_content = [str(call) for call in mock_print.call_args_list]
+        assert any('Prefix lengths: 10, 14, 20, 24' in content for content in printed_content)
+        assert any('hash layout with hash_base 101' in content for content in printed_content)
+
+    
+    def test_generate_pac_content_mph_structure(self):
+        """Test that the mph engine emits displacement and slot tables"""
+        content = _build_pac(engine='mph')
+        
+        assert 'mph_tables = [' in content
+        assert 'mph_mix = function(key, seed)' in content
+        assert '\n    [24, [' in content
+        assert 'hashed_nets' not in content
+        assert 'HASH_BASE' not in content
+    
+    def test_generate_pac_content_mph_same_decisions(self, run_pac):
+        """Test that the mph engine makes the same decisions as the hash engine"""
+        expected = _expected_decisions()
+        
+        assert run_pac(_build_pac(engine='mph'), SAMPLE_HOSTS) == expected
+        assert run_pac(_build_pac(engine='mph', hoist_tables=True), SAMPLE_HOSTS) == expected
+    
+    def test_generate_pac_content_mph_many_networks(self, run_pac):
+        """Test the mph engine on buckets with many keys per prefix length"""
+        networks = [ipaddress.ip_network((0x0A000000 + (i * 7919 << 8), 24)) for i in range(300)]
+        networks = sorted(set(networks))
+        hosts = [str(net.network_address + 17) for net in networks[::7]]
+        hosts += [str(net.network_address + 256 * 3) for net in networks[::11]]
+        
+        content = _build_pac(networks=networks, engine='mph')
+        
+        assert run_pac(content, hosts) == _expected_decisions(networks, hosts)
+
+    
+    def test_generate_pac_content_probes_only_table_lengths(self):
+        """Test that lookup_ip probes exactly the prefix lengths in the table"""
+        content = _build_pac(prefix_lengths=[12, 19, 24])
+        
+        assert 'PREFIX_LENS = [12, 19, 24];' in content
+        assert 'var m12 = 12;' in content
+        assert 'var m10 = 10;' not in content
+    
+    @pytest.mark.parametrize('engine', ['hash', 'dict', 'mph'])
+    def test_generate_pac_content_planned_lengths_same_decisions(self, run_pac, engine):
+        """Test that planned prefix lengths keep the decisions of every engine"""
+        from flora_pac_lib.network_ops import plan_prefix_lengths, prefixlen_histogram
+        prefix_lengths = plan_prefix_lengths(prefixlen_histogram(SAMPLE_NETWORKS), max_probes=2)
+        
+        content = _build_pac(engine=engine, prefix_lengths=prefix_lengths, integer_match=True)
+        
+        assert run_pac(content, SAMPLE_HOSTS) == _expected_decisions()
+    
+    @pytest.mark.parametrize('engine', ['hash', 'bsearch', 'bitmap', 'dict', 'mph'])
+    @pytest.mark.parametrize('integer_match', [False, True])
+    def test_streamed_hoisted_content_matches_dedent(self, engine, integer_match):
+        """Test that hoisting streamed pieces equals dedenting the joined lookup code"""
+        content = _build_pac(engine=engine, integer_match=integer_match)
+        hoisted = _build_pac(engine=engine, integer_match=integer_match, hoist_tables=True)
+        
+        start = content.index('  var ')
+        lookup_vars, _, rest = content[start + len('  var '):].partition(';\n')
+        lookup_code = rest[:rest.index('\n  if (isPlainHostName(host)')]
+        
+        assert f"var {lookup_vars};\n{textwrap.dedent(lookup_code)}\nfunction" in hoisted
+    
+    def test_iter_pac_content_yields_buckets(self):
+        """Test that the hash tables are streamed one bucket at a time"""
+        fragmented = fregment_nets(SAMPLE_NETWORKS, 2)
+        min_prefixlen, max_prefixlen = calculate_prefix_range(fragmented)
+        args = (hash_nets(fragmented, 101), ['SOCKS5 127.0.0.1:1984'], 'no', [], 101, 2,
+                min_prefixlen, max_prefixlen, SAMPLE_NETWORKS)
+        
+        chunks = list(_iter_pac_content(*args))
+        
+        assert ''.join(chunks) == _generate_pac_content(*args)
+        assert len(chunks) > 101
+        assert sum(1 for chunk in chunks if chunk == '\n    empty_array,') > 50
+    
+    def test_write_pac_text_and_binary(self):
+        """Test writing pieces to text, binary and gzip file objects"""
+        chunks = ['// Flora ', 'PAC ', '\u00e9\n']
+        text, binary, compressed = io.StringIO(), io.BytesIO(), io.BytesIO()
+        
+        assert write_pac(text, chunks) == 15
+        write_pac(binary, chunks)
+        with gzip.GzipFile(fileobj=compressed, mode='wb') as gz:
+            write_pac(gz, iter(chunks))
+        
+        assert text.getvalue() == '// Flora PAC \u00e9\n'
+        assert binary.getvalue() == text.getvalue().encode('utf-8')
+        assert gzip.decompress(compressed.getvalue()) == binary.getvalue()
+    
+    @patch('builtins.print')
+    @pytest.mark.parametrize('hoist_tables', [False, True])
+    @pytest.mark.parametrize('engine', ['hash', 'bsearch', 'bitmap', 'dict', 'mph'])
+    def test_generate_pac_streams_without_stage_cache(self, mock_print, engine, hoist_tables,
+                                                      tmp_path):
+        """Test that streamed and cached generation write the same file"""
+        from flora_pac_lib.stage_cache import StageCache
+        streamed, cached = str(tmp_path / 'streamed.pac'), str(tmp_path / 'cached.pac')
+        
+        with patch('flora_pac_lib.pac_generator.fetch_ip_data', return_value=SAMPLE_NETWORKS):
+            # Streaming never joins the lookup code into one string
+            with patch('flora_pac_lib.pac_generator._generate_lookup_code',
+                       side_effect=AssertionError("lookup code joined")):
+                generate_pac(['SOCKS5 127.0.0.1:1984'], 'no', ['192.168.0.0/24'], hash_base=101,
+                             output_file=streamed, engine=engine, hoist_tables=hoist_tables)
+            generate_pac(['SOCKS5 127.0.0.1:1984'], 'no', ['192.168.0.0/24'], hash_base=101,
+                         output_file=cached, engine=engine, hoist_tables=hoist_tables,
+                         stage_cache=StageCache())
+        
+        # The sample networks are already merged
+        expected = _build_pac(engine=engine, hoist_tables=hoist_tables)
+        with open(streamed) as f, open(cached) as g:
+            assert f.read() == expected
+            assert g.read() == expected
+    
+    @patch('builtins.print')
+    @pytest.mark.parametrize('engine', ['hash', 'mph'])
+    def test_generate_pac_cached_prefix(self, mock_print, engine, tmp_path):
+        """Test that a proxy change reuses the cached prefix of the PAC file"""
+        from flora_pac_lib.stage_cache import StageCache
+        cache = StageCache()
+        first, second = str(tmp_path / 'first.pac'), str(tmp_path / 'second.pac')
+        
+        with patch('flora_pac_lib.pac_generator.fetch_ip_data', return_value=SAMPLE_NETWORKS):
+            generate_pac(['SOCKS5 127.0.0.1:1984'], 'no', [], output_file=first, engine=engine,
+                         stage_cache=cache)
+            with patch('flora_pac_lib.pac_generator._iter_pac_prefix') as mock_prefix:
+                generate_pac(['PROXY 10.0.0.1:8080'], 'host', [], output_file=second,
+                             engine=engine, stage_cache=cache)
+        
+        mock_prefix.assert_not_called()
+        with open(first) as f, open(second) as g:
+            first_content, second_content = f.read(), g.read()
+        head = first_content[:first_content.index('  if (isPlainHostName(host)')]
+        assert second_content.startswith(head)
+        assert 'PROXY 10.0.0.1:8080' in second_content
@@ -0,0 +1,119 @@
+"""
+Tests for the modular snapshot module
+"""
+import ipaddress
+import os
+import sys
+from unittest.mock import patch
+
+import pytest
+
+# Add parent directory to path to import flora_pac_lib
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from flora_pac_lib.ip_data import parse_delegated
+from flora_pac_lib.network_ops import net_ranges
+from flora_pac_lib.pac_generator import generate_pac
+from flora_pac_lib.snapshot import load_snapshot, write_snapshot
+from tests.conftest import NETWORKS
+
+
+class TestModularSnapshot:
+    """Test the binary range snapshot format"""
+    
+    def test_round_trip(self, tmp_path):
+        """Test that ranges and header survive a write and load"""
+        path = str(tmp_path / 'ranges.bin')
+        ranges = net_ranges(NETWORKS)
+        
+        write_snapshot(path, ranges, '20230101', 20230101)
+        snapshot = load_snapshot(path)
+        
+        assert snapshot.source_date == '20230101'
+        assert snapshot.serial == 20230101
+        assert snapshot.count == len(ranges)
+        assert snapshot.ranges() == ranges
+        assert os.path.getsize(path) == 24 + 8 * len(ranges)
+    
+    def test_values_are_zero_copy(self, tmp_path):
+        """Test that the loaded values are a view of the mapped file"""
+        if sys.byteorder != 'little':
+            pytest.skip("zero copy loading needs a little-endian host")
+        path = str(tmp_path / 'ranges.bin')
+        write_snapshot(path, net_ranges(NETWORKS))
+        
+        values = load_snapshot(path).values
+        
+        assert isinstance(values, memoryview)
+        assert values.format == 'I'
+        assert values[0] == int(ipaddress.IPv4Address('1.0.1.0'))
+    
+    def test_empty_snapshot(self, tmp_path):
+        """Test a snapshot without ranges"""
+        path = str(tmp_path / 'ranges.bin')
+        write_snapshot(path, [])
+        
+        snapshot = load_snapshot(path)
+        
+        assert snapshot.count == 0
+        assert snapshot.ranges() == []
+    
+    def test_invalid_files(self, tmp_path):
+        """Test that foreign and truncated files are rejected"""
+        foreign = tmp_path / 'foreign.bin'
+        foreign.write_bytes(b'not a snapshot at all, really')
+        with pytest.raises(ValueError, match='not a Flora PAC snapshot'):
+            load_snapshot(str(foreign))
+        
+        path = tmp_path / 'ranges.bin'
+        write_snapshot(str(path), net_ranges(NETWORKS))
+        path.write_bytes(path.read_bytes()[:-4])
+        with pytest.raises(ValueError, match='Truncated'):
+            load_snapshot(str(path))
+    
+    def test_parse_delegated_header(self):
+        """Test that the version line fills the header dict"""
+        header = {}
+        lines = [
+            b'2|apnic|20230101|3|19830101|20221231|+1000\n',
+            b'apnic|*|ipv4|*|1|summary\n',
+            b'apnic|CN|ipv4|1.0.1.0|256|20110414|allocated\n',
+        ]
+        
+        nets = parse_delegated(lines, header=header)
+        
+        assert header == {'serial': 20230101, 'enddate': '20221231'}
+        assert [str(net) for net in nets] == ['1.0.1.0/24']
+    
+    def test_generate_pac_from_snapshot(self, tmp_path):
+        """Test that a saved snapshot reproduces the same PAC file"""
+        snapshot_file = str(tmp_path / 'ranges.bin')
+        fetched_pac = str(tmp_path / 'fetched.pac')
+        snapshot_pac = str(tmp_path / 'snapshot.pac')
+        
+        with patch('flora_pac_lib.pac_generator.fetch_ip_data', return_value=NETWORKS):
+            generate_pac(['SOCKS5 127.0.0.1:1984'], 'no', [], output_file=fetched_pac,
+                         save_snapshot=snapshot_file)
+        with patch('flora_pac_lib.pac_generator.fetch_ip_data') as mock_fetch:
+            generate_pac(['SOCKS5 127.0.0.1:1984'], 'no', [], output_file=snapshot_pac,
+                         snapshot=snapshot_file)
+            mock_fetch.assert_not_called()
+        
+        with open(fetched_pac) as f1, open(snapshot_pac) as f2:
+            assert f1.read() == f2.read()
+    
+    def test_save_snapshot_from_snapshot(self, tmp_path):
+        """Test that save_snapshot also writes the ranges loaded from a snapshot"""
+        snapshot_file = str(tmp_path / 'ranges.bin')
+        copy_file = str(tmp_path / 'copy.bin')
+        
+        with patch('flora_pac_lib.pac_generator.fetch_ip_data', return_value=NETWORKS):
+            generate_pac(['SOCKS5 127.0.0.1:1984'], 'no', [],
+                         output_file=str(tmp_path / 'fetched.pac'), save_snapshot=snapshot_file)
+        generate_pac(['SOCKS5 127.0.0.1:1984'], 'no', [], output_file=str(tmp_path / 'copy.pac'),
+                     snapshot=snapshot_file, save_snapshot=copy_file)
+        
+        original = load_snapshot(snapshot_file)
+        copy = load_snapshot(copy_file)
+        assert copy.ranges() == original.ranges()
+        assert (copy.source_date, copy.serial) == (original.source_date, original.serial)
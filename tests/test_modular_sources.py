@@ -0,0 +1,147 @@
+"""
+Tests for the modular sources module
+"""
+import gzip
+import io
+import lzma
+import os
+import sys
+import time
+from unittest.mock import patch
+
+import pytest
+
+# Add parent directory to path to import flora_pac_lib
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from flora_pac_lib.net_table import NetTable
+from flora_pac_lib.network_ops import net_ranges
+from flora_pac_lib.pac_generator import generate_pac
+from flora_pac_lib.snapshot import write_snapshot
+from flora_pac_lib.sources import is_snapshot_source, read_source, resolve_source
+
+
+DELEGATED = b"""2|apnic|20230101|3|19830101|20221231|+1000
+apnic|*|ipv4|*|3|summary
+apnic|CN|ipv4|1.0.1.0|256|20110414|allocated
+apnic|CN|ipv4|1.0.2.0|512|20110414|allocated
+apnic|JP|ipv4|1.0.16.0|4096|20110414|allocated
+"""
+
+EXPECTED = ['1.0.1.0/24', '1.0.2.0/23']
+
+
+class TestModularSources:
+    """Test reading delegated files from local sources"""
+    
+    @pytest.mark.parametrize('name, compress', [
+        ('delegated', lambda data: data),
+        ('delegated.gz', gzip.compress),
+        ('delegated.xz', lzma.compress),
+        # Compression is detected from the content, not the name
+        ('delegated.txt', gzip.compress),
+    ])
+    def test_read_file(self, tmp_path, name, compress):
+        """Test plain and compressed files"""
+        path = tmp_path / name
+        path.write_bytes(compress(DELEGATED))
+        header = {}
+        
+        result = read_source(str(path), header=header)
+        
+        assert [str(net) for net in result] == EXPECTED
+        assert header == {'serial': 20230101, 'enddate': '20221231'}
+    
+    def test_read_stdin(self, monkeypatch):
+        """Test reading a compressed file from stdin"""
+        monkeypatch.setattr(sys, 'stdin', io.TextIOWrapper(io.BytesIO(gzip.compress(DELEGATED))))
+        
+        result = read_source('-', as_table=True)
+        
+        assert isinstance(result, NetTable)
+        assert [str(net) for net in result.to_networks()] == EXPECTED
+    
+    def test_directory_newest_file_wins(self, tmp_path):
+        """Test that a directory source reads its most recent file"""
+        old = tmp_path / 'delegated-20220101'
+        old.write_bytes(b"apnic|CN|ipv4|27.8.0.0|1024|20110414|allocated\n")
+        os.utime(old, (time.time() - 3600, time.time() - 3600))
+        (tmp_path / 'delegated-20230101.gz').write_bytes(gzip.compress(DELEGATED))
+        (tmp_path / 'delegated-20230101.gz.meta.json').write_text('{}')
+        
+        assert resolve_source(str(tmp_path)) == str(tmp_path / 'delegated-20230101.gz')
+        assert [str(net) for net in read_source(str(tmp_path))] == EXPECTED
+    
+    def test_directory_skips_partial_download(self, tmp_path):
+        """Test that a directory source never reads a partial cache download"""
+        complete = tmp_path / 'delegated-apnic-latest'
+        complete.write_bytes(DELEGATED)
+        os.utime(complete, (time.time() - 3600, time.time() - 3600))
+        # Truncated mid-line, newer than the complete file
+        (tmp_path / 'delegated-apnic-latest.part').write_bytes(DELEGATED[:len(DELEGATED) // 2])
+        (tmp_path / 'delegated-apnic-latest.part.meta.json').write_text('{}')
+        
+        assert resolve_source(str(tmp_path)) == str(complete)
+        assert [str(net) for net in read_source(str(tmp_path))] == EXPECTED
+    
+    def test_empty_directory(self, tmp_path):
+        """Test that a directory without files is rejected"""
+        with pytest.raises(ValueError, match='No input file'):
+            read_source(str(tmp_path))
+    
+    def test_read_binary_snapshot(self, tmp_path):
+        """Test that binary range snapshots are recognised"""
+        plain = tmp_path / 'delegated'
+        plain.write_bytes(DELEGATED)
+        path = tmp_path / 'ranges.bin'
+        write_snapshot(str(path), net_ranges(read_source(str(plain))), '20221231', 20230101)
+        header = {}
+        
+        result = read_source(str(path), header=header)
+        
+        assert [str(net) for net in result] == EXPECTED
+        assert header == {'serial': 20230101, 'enddate': '20221231'}
+    
+    def test_generate_pac_from_source(self, tmp_path):
+        """Test that generate_pac reads a local source without fetching"""
+        path = tmp_path / 'delegated.xz'
+        path.write_bytes(lzma.compress(DELEGATED))
+        output_file = str(tmp_path / 'flora_pac.pac')
+        
+        with patch('flora_pac_lib.pac_generator.fetch_ip_data') as mock_fetch:
+            generate_pac(['SOCKS5 127.0.0.1:1984'], 'no', [], output_file=output_file,
+                         source=str(path))
+            mock_fetch.assert_not_called()
+        
+        with open(output_file) as f:
+            assert 'FindProxyForURL' in f.read()
+    
+    def test_countries_rejected_with_snapshot(self, tmp_path):
+        """Test that countries and registries are not ignored for snapshots"""
+        path = tmp_path / 'ranges.bin'
+        write_snapshot(str(path), [(0, 255)])
+        output_file = str(tmp_path / 'flora_pac.pac')
+        
+        assert is_snapshot_source(str(path))
+        assert not is_snapshot_source('-')
+        for kwargs in ({'snapshot': str(path), 'countries': ['hk']},
+                       {'source': str(path), 'countries': ['hk']},
+                       {'source': str(tmp_path), 'registries': ['arin']}):
+            with pytest.raises(ValueError, match='binary range snapshot'):
+                generate_pac(['SOCKS5 127.0.0.1:1984'], 'no', [], output_file=output_file,
+                             **kwargs)
+        assert not os.path.exists(output_file)
+    
+    def test_generate_pac_for_countries(self, tmp_path):
+        """Test that generate_pac routes every selected country directly"""
+        path = tmp_path / 'delegated'
+        path.write_bytes(DELEGATED)
+        output_file = str(tmp_path / 'flora_pac.pac')
+        
+        generate_pac(['SOCKS5 127.0.0.1:1984'], 'no', [], output_file=output_file,
+                     engine='bsearch', source=str(path), countries=['cn', 'jp'])
+        
+        with open(output_file) as f:
+            content = f.read()
+        # 1.0.1.0/24, 1.0.2.0/23 and 1.0.16.0/20 form two ranges
+        assert 'range_starts = [%d, %d]' % (0x01000100, 0x01001000) in content.replace('\n', '').replace('    ', '')
@@ -0,0 +1,271 @@
+"""
+Tests for the modular stage_cache module
+"""
+import os
+import sys
+import threading
+import time
+from unittest.mock import patch
+
+import pytest
+
+# Add parent directory to path to import flora_pac_lib
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from flora_pac_lib import pac_generator
+from flora_pac_lib.ip_data import merge_all
+from flora_pac_lib.net_table import NetTable
+from flora_pac_lib.pac_generator import generate_pac
+from flora_pac_lib.stage_cache import StageCache, nets_digest
+from tests.conftest import NETWORKS, full_pac
+
+
+class TestModularStageCache:
+    """Test the content-addressed pipeline stage cache"""
+    
+    def test_get_computes_once(self):
+        """Test a stage is computed on the first get only"""
+        cache = StageCache()
+        calls = []
+        
+        def compute():
+            calls.append(1)
+            return 'value'
+        
+        assert cache.get('stage', 'digest', (2,), compute) == 'value'
+        assert cache.get('stage', 'digest', (2,), compute) == 'value'
+        assert len(calls) == 1
+        assert (cache.hits, cache.misses) == (1, 1)
+    
+    def test_concurrent_gets_compute_once(self):
+        """Test threads wanting the same missing output wait for one computation"""
+        cache = StageCache()
+        calls = []
+        
+        def compute():
+            calls.append(1)
+            time.sleep(0.1)
+            return 'value'
+        
+        results = []
+        threads = [threading.Thread(target=lambda: results.append(
+            cache.get('stage', 'digest', (), compute))) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        
+        assert results == ['value'] * 8
+        assert len(calls) == 1
+        assert (cache.hits, cache.misses) == (7, 1)
+    
+    def test_slow_computation_does_not_block_other_keys(self):
+        """Test a hit is served while another output is being computed"""
+        cache = StageCache()
+        cache.get('stage', 'digest', (1,), lambda: 'cached')
+        computing = threading.Event()
+        release = threading.Event()
+        
+        def slow_compute():
+            computing.set()
+            release.wait(5)
+            return 'slow'
+        
+        results = []
+        
+        def other_gets():
+            results.append(cache.get('stage', 'digest', (1,), lambda: 'recomputed'))
+            results.append(cache.get('stage', 'digest', (3,), lambda: 'other'))
+        
+        thread = threading.Thread(target=cache.get, args=('stage', 'digest', (2,), slow_compute))
+        thread.start()
+        try:
+            assert computing.wait(5)
+            # The slow computation is only released once the other gets returned
+            other = threading.Thread(target=other_gets)
+            other.start()
+            other.join(5)
+            assert results == ['cached', 'other']
+            assert thread.is_alive()
+        finally:
+            release.set()
+            thread.join()
+        assert cache.get('stage', 'digest', (2,), lambda: 'recomputed') == 'slow'
+    
+    def test_failed_computation_is_retried(self):
+        """Test a computation that raised is run again by the next get"""
+        cache = StageCache()
+        
+        def fail():
+            raise RuntimeError("stage failed")
+        
+        with pytest.raises(RuntimeError):
+            cache.get('stage', 'digest', (), fail)
+        
+        assert cache.get('stage', 'digest', (), lambda: 'value') == 'value'
+        assert cache._key_locks == {}
+    
+    def test_key_depends_on_stage_digest_and_params(self):
+        """Test every key component separates entries"""
+        key = StageCache.key('hash', 'abc', (2, None, 3011))
+        
+        assert key == StageCache.key('hash', 'abc', (2, None, 3011))
+        assert key != StageCache.key('fragment', 'abc', (2, None, 3011))
+        assert key != StageCache.key('hash', 'abd', (2, None, 3011))
+        assert key != StageCache.key('hash', 'abc', (2, None, 5003))
+    
+    def test_key_depends_on_format_version(self):
+        """Test entries of another format version are not reused"""
+        key = StageCache.key('tables', 'abc', ())
+        
+        with patch('flora_pac_lib.stage_cache.STAGE_FORMAT_VERSION', 0):
+            assert StageCache.key('tables', 'abc', ()) != key
+    
+    def test_memory_lru_eviction(self):
+        """Test the least recently used entry is evicted"""
+        cache = StageCache(max_entries=2)
+        cache.get('s', 'd', (1,), lambda: 1)
+        cache.get('s', 'd', (2,), lambda: 2)
+        cache.get('s', 'd', (1,), lambda: 1)
+        cache.get('s', 'd', (3,), lambda: 3)
+        
+        assert cache.get('s', 'd', (1,), lambda: 'recomputed') == 1
+        assert cache.get('s', 'd', (2,), lambda: 'recomputed') == 'recomputed'
+    
+    def test_disk_round_trip(self, tmp_path):
+        """Test entries written by one cache are read by another"""
+        table = NetTable.from_networks(NETWORKS)
+        StageCache(str(tmp_path)).get('merge', 'd', (), lambda: table)
+        
+        loaded = StageCache(str(tmp_path)).get('merge', 'd', (), lambda: None)
+        
+        assert loaded == table
+        assert not any(name.endswith('.tmp') for name in os.listdir(tmp_path))
+    
+    def test_failed_disk_write_leaves_no_file(self, tmp_path):
+        """Test a value that cannot be pickled leaves no temporary file"""
+        cache = StageCache(str(tmp_path))
+        
+        with pytest.raises(Exception):
+            cache.get('s', 'd', (), lambda: threading.Lock())
+        
+        assert os.listdir(tmp_path) == []
+    
+    def test_disk_eviction_and_corrupt_entries(self, tmp_path):
+        """Test old files are pruned and unreadable ones recomputed"""
+        cache = StageCache(str(tmp_path), max_entries=2)
+        for value in range(4):
+            cache.get('s', 'd', (value,), lambda: value)
+        assert len(os.listdir(tmp_path)) == 2
+        
+        key = StageCache.key('s', 'd', (3,))
+        with open(os.path.join(tmp_path, key + '.pickle'), 'wb') as f:
+            f.write(b'garbage')
+        assert StageCache(str(tmp_path)).get('s', 'd', (3,), lambda: 'fresh') == 'fresh'
+    
+    def test_disk_entry_of_missing_class_is_recomputed(self, tmp_path):
+        """Test an entry referring to a removed class is a miss and removed"""
+        key = StageCache.key('s', 'd', ())
+        path = os.path.join(tmp_path, key + '.pickle')
+        with open(path, 'wb') as f:
+            f.write(b'cflora_pac_lib.removed_module\nRemovedClass\n.')
+        
+        cache = StageCache(str(tmp_path))
+        assert cache._load(key) is None
+        assert not os.path.exists(path)
+        assert cache.get('s', 'd', (), lambda: 'fresh') == 'fresh'
+    
+    def test_nets_digest(self):
+        """Test lists and tables of the same networks share a digest"""
+        table = NetTable.from_networks(NETWORKS)
+        
+        assert nets_digest(NETWORKS) == nets_digest(table) == table.digest()
+        assert nets_digest(NETWORKS[:-1]) != table.digest()
+    
+    def test_generate_pac_matches_full_pipeline(self, tmp_path):
+        """Test cached generation writes the same PAC file"""
+        expected = full_pac(merge_all(NetTable.from_networks(NETWORKS)), ['SOCKS5 127.0.0.1:1984'])
+        output = str(tmp_path / 'out.pac')
+        
+        with patch('flora_pac_lib.pac_generator.fetch_ip_data',
+                   return_value=NetTable.from_networks(NETWORKS)), patch('builtins.print'):
+            generate_pac(['SOCKS5 127.0.0.1:1984'], 'no', [], output_file=output)
+        
+        with open(output) as f:
+            assert f.read() == expected
+    
+    def test_proxy_change_only_renders(self, tmp_path):
+        """Test a second run with other proxies reuses every stage"""
+        cache = StageCache(str(tmp_path / 'stages'))
+        output = str(tmp_path / 'out.pac')
+        
+        with patch('flora_pac_lib.pac_generator.fetch_ip_data',
+                   return_value=NetTable.from_networks(NETWORKS)), patch('builtins.print'):
+            generate_pac(['SOCKS5 127.0.0.1:1984'], 'no', [], output_file=output,
+                         stage_cache=cache)
+            with patch.object(pac_generator, 'fregment_nets') as mock_fregment, \
+                    patch.object(pac_generator, 'hash_nets') as mock_hash, \
+                    patch.object(pac_generator, '_generate_lookup_code') as mock_lookup:
+                generate_pac(['PROXY 10.0.0.1:8080', 'PROXY 10.0.0.2:8080'], 'host', [],
+                             output_file=output, stage_cache=StageCache(cache.cache_dir))
+        
+        mock_fregment.assert_not_called()
+        mock_hash.assert_not_called()
+        mock_lookup.assert_not_called()
+        with open(output) as f:
+            content = f.read()
+        assert 'PROXY 10.0.0.2:8080' in content
+        assert 'hashed_nets' in content
+    
+    def test_dict_stats_reuse_cached_stages(self, tmp_path):
+        """Test a dict engine rerun prints its stats without fragmenting or hashing"""
+        cache = StageCache(str(tmp_path / 'stages'))
+        output = str(tmp_path / 'out.pac')
+        
+        with patch('flora_pac_lib.pac_generator.fetch_ip_data',
+                   return_value=NetTable.from_networks(NETWORKS)), patch('builtins.print'):
+            generate_pac(['SOCKS5 127.0.0.1:1984'], 'no', [], output_file=output,
+                         engine='dict', stage_cache=cache)
+            with patch.object(pac_generator, 'fregment_nets') as mock_fregment, \
+                    patch.object(pac_generator, 'hash_nets') as mock_hash, \
+                    patch('builtins.print') as mock_print:
+                generate_pac(['PROXY 10.0.0.1:8080'], 'no', [], output_file=output,
+                             engine='dict', stage_cache=StageCache(cache.cache_dir))
+        
+        mock_fregment.assert_not_called()
+        mock_hash.assert_not_called()
+        printed = [str(call) for call in mock_print.call_args_list]
+        assert any('hash layout with hash_base 3011' in line for line in printed)
+    
+    def test_mph_stats_reuse_cached_stages(self, tmp_path):
+        """Test an mph engine rerun prints its stats without fragmenting"""
+        cache = StageCache(str(tmp_path / 'stages'))
+        output = str(tmp_path / 'out.pac')
+        
+        with patch('flora_pac_lib.pac_generator.fetch_ip_data',
+                   return_value=NetTable.from_networks(NETWORKS)), patch('builtins.print'):
+            generate_pac(['SOCKS5 127.0.0.1:1984'], 'no', [], output_file=output,
+                         engine='mph', stage_cache=cache)
+            with patch.object(pac_generator, 'fregment_nets') as mock_fregment, \
+                    patch('builtins.print') as mock_print:
+                generate_pac(['PROXY 10.0.0.1:8080'], 'no', [], output_file=output,
+                             engine='mph', stage_cache=StageCache(cache.cache_dir))
+        
+        mock_fregment.assert_not_called()
+        printed = [str(call) for call in mock_print.call_args_list]
+        assert any('Slots: ' in line for line in printed)
+        assert any('PAC size: %d bytes' % os.path.getsize(output) in line for line in printed)
+    
+    def test_parameter_change_recomputes(self):
+        """Test a new hash base rebuilds the tables but reuses the fragments"""
+        cache = StageCache()
+        
+        with patch('flora_pac_lib.pac_generator.fetch_ip_data',
+                   return_value=NetTable.from_networks(NETWORKS)), patch('builtins.print'), \
+                patch('flora_pac_lib.pac_generator.open'):
+            generate_pac(['SOCKS5 127.0.0.1:1984'], 'no', [], stage_cache=cache)
+            misses = cache.misses
+            generate_pac(['SOCKS5 127.0.0.1:1984'], 'no', [], hash_base=5003, stage_cache=cache)
+        
+        # The hash, tables and prefix stages are rebuilt, merge and fragment are reused
+        assert cache.misses == misses + 3
@@ -2,10 +2,14 @@
 Test suite for Flora PAC Web UI module
 """
 
+import ipaddress
 import os
 import tempfile
+import threading
+import time
 import pytest
 from unittest.mock import Mock, patch, MagicMock
+from flora_pac_lib.net_table import NetTable
 from flora_pac_lib.web_ui import FloraPacWebUI, create_web_ui, launch_web_ui
 
 
@@ -185,8 +189,9 @@ class TestFloraPacWebUI:
         assert 'theme' in call_kwargs
         assert 'css' in call_kwargs
     
+    @patch.object(FloraPacWebUI, 'start_refresh')
     @patch.object(FloraPacWebUI, 'create_interface')
-    def test_launch(self, mock_create_interface):
+    def test_launch(self, mock_create_interface, mock_start_refresh):
         """Test web UI launch functionality"""
         # Mock interface
         mock_interface = Mock()
@@ -200,6 +205,7 @@ class TestFloraPacWebUI:
         )
         
         # Verify interface creation and launch
+        mock_start_refresh.assert_called_once()
         mock_create_interface.assert_called_once()
         mock_interface.launch.assert_called_once_with(
             server_name="0.0.0.0",
@@ -239,6 +245,146 @@ class TestFactoryFunctions:
         )
 
 
+def _china_nets(*cidrs):
+    """Build the NetTable fetch_ip_data would return"""
+    return NetTable.from_networks(ipaddress.IPv4Network(cidr) for cidr in cidrs)
+
+
+class TestDatasetCache:
+    """Test the dataset shared by the requests of a FloraPacWebUI"""
+    
+    def setup_method(self):
+        """Setup test fixtures"""
+        self.ui = FloraPacWebUI()
+    
+    def teardown_method(self):
+        """Cleanup after each test"""
+        self.ui.cleanup()
+    
+    @patch('flora_pac_lib.web_ui.fetch_ip_data')
+    def test_requests_reuse_dataset(self, mock_fetch_ip_data, tmp_path, monkeypatch):
+        """Test that only the first request fetches the IP data"""
+        monkeypatch.chdir(tmp_path)
+        mock_fetch_ip_data.return_value = _china_nets('1.0.1.0/24', '1.0.2.0/23')
+        
+        for proxy in ("SOCKS5 127.0.0.1:1984", "PROXY 127.0.0.1:8080"):
+            status, content, file_path = self.ui.generate_pac_file(proxy_strings=proxy)
+            assert "Generated PAC file successfully!" in status
+            assert proxy in content
+        
+        mock_fetch_ip_data.assert_called_once()
+        assert "Data age: " in status
+        assert "Merged networks: 2" in status
+    
+    @patch('flora_pac_lib.web_ui.fetch_ip_data')
+    def test_concurrent_requests_fetch_once(self, mock_fetch_ip_data):
+        """Test that concurrent requests wait for a single fetch"""
+        def slow_fetch(**kwargs):
+            time.sleep(0.2)
+            return _china_nets('1.0.1.0/24')
+        mock_fetch_ip_data.side_effect = slow_fetch
+        
+        datasets = []
+        threads = [threading.Thread(target=lambda: datasets.append(self.ui.get_dataset()))
+                   for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        
+        mock_fetch_ip_data.assert_called_once()
+        assert len(datasets) == 8
+        assert all(dataset is datasets[0] for dataset in datasets)
+    
+    @patch('flora_pac_lib.web_ui.fetch_ip_data')
+    def test_stale_dataset_reloaded_without_refresh(self, mock_fetch_ip_data):
+        """Test that a request reloads an expired dataset when nothing refreshes it"""
+        mock_fetch_ip_data.return_value = _china_nets('1.0.1.0/24')
+        self.ui.dataset_ttl = 0
+        
+        first = self.ui.get_dataset()
+        second = self.ui.get_dataset()
+        
+        assert mock_fetch_ip_data.call_count == 2
+        assert second is not first
+    
+    @patch('flora_pac_lib.web_ui.fetch_ip_data')
+    def test_refresh_failure_keeps_dataset(self, mock_fetch_ip_data):
+        """Test that a failed refresh keeps serving the previous dataset"""
+        mock_fetch_ip_data.return_value = _china_nets('1.0.1.0/24')
+        dataset = self.ui.get_dataset()
+        
+        mock_fetch_ip_data.side_effect = Exception("Network error")
+        with pytest.raises(Exception):
+            self.ui.refresh_dataset()
+        
+        assert self.ui.get_dataset() is dataset
+    
+    @patch('flora_pac_lib.web_ui.fetch_ip_data')
+    def test_refresh_swaps_dataset(self, mock_fetch_ip_data, tmp_path, monkeypatch):
+        """Test that refresh_dataset replaces the dataset used by requests"""
+        monkeypatch.chdir(tmp_path)
+        mock_fetch_ip_data.return_value = _china_nets('1.0.1.0/24')
+        self.ui.get_dataset()
+        
+        mock_fetch_ip_data.return_value = _china_nets('1.0.1.0/24', '1.0.8.0/21')
+        self.ui.refresh_dataset()
+        status, content, file_path = self.ui.generate_pac_file("SOCKS5 127.0.0.1:1984")
+        
+        assert "Merged networks: 2" in status
+        assert mock_fetch_ip_data.call_count == 2
+    
+    @patch('flora_pac_lib.web_ui.fetch_ip_data')
+    def test_background_refresh(self, mock_fetch_ip_data):
+        """Test that start_refresh warms the dataset and reloads it every dataset_ttl"""
+        mock_fetch_ip_data.return_value = _china_nets('1.0.1.0/24')
+        self.ui.dataset_ttl = 0.05
+        
+        self.ui.start_refresh()
+        deadline = time.time() + 5
+        while mock_fetch_ip_data.call_count < 3 and time.time() < deadline:
+            time.sleep(0.01)
+        self.ui.stop_refresh()
+        calls = mock_fetch_ip_data.call_count
+        
+        assert calls >= 3
+        time.sleep(0.1)
+        assert mock_fetch_ip_data.call_count == calls
+    
+    @patch('flora_pac_lib.web_ui.fetch_ip_data')
+    def test_stale_dataset_served_during_refresh(self, mock_fetch_ip_data):
+        """Test that requests never fetch while the background refresh runs"""
+        mock_fetch_ip_data.return_value = _china_nets('1.0.1.0/24')
+        dataset = self.ui.get_dataset()
+        self.ui.dataset_ttl = 0
+        
+        # A refresh thread busy loading the next dataset
+        loading = threading.Event()
+        self.ui._refresh_thread = threading.Thread(target=loading.wait, daemon=True)
+        self.ui._refresh_thread.start()
+        try:
+            assert self.ui.get_dataset() is dataset
+        finally:
+            loading.set()
+            self.ui._refresh_thread.join()
+        
+        mock_fetch_ip_data.assert_called_once()
+    
+    def test_snapshot_dataset(self, tmp_path):
+        """Test that a snapshot backed UI loads the snapshot once"""
+        from flora_pac_lib.snapshot import write_snapshot
+        path = str(tmp_path / 'ranges.bin')
+        write_snapshot(path, _china_nets('1.0.1.0/24', '1.0.4.0/22').ranges(), '20250101', 7)
+        ui = FloraPacWebUI(path)
+        try:
+            dataset = ui.get_dataset()
+            assert dataset.source_date == '20250101'
+            assert len(dataset.networks) == 2
+            assert ui.get_dataset() is dataset
+        finally:
+            ui.cleanup()
+
+
 class TestWebUIIntegration:
     """Integration tests for Web UI components"""
     